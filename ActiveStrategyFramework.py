@@ -2,8 +2,125 @@ import pandas as pd
 import numpy as np
 import math
 import UNI_v3_funcs
-import copy
+import MarketData
+import SimulationResults
+import PositionBook
 import kaleido
+from collections.abc import MutableMapping
+
+########################################################
+# Copy-on-write state shared between consecutive observations
+# Reads fall through to a shared dict; writes are kept local to each
+# observation, so unchanged steps never copy range records or strategy_info
+########################################################
+
+class CopyOnWriteDict(MutableMapping):
+    __slots__ = ('_shared','_local')
+
+    def __init__(self,shared,local=None):
+        self._shared = shared
+        self._local  = {} if local is None else local
+
+    def __getitem__(self,key):
+        if key in self._local:
+            return self._local[key]
+        return self._shared[key]
+
+    def __setitem__(self,key,value):
+        self._local[key] = value
+
+    def __delitem__(self,key):
+        # Deleting shared keys materializes a private copy
+        if key not in self:
+            raise KeyError(key)
+        self._shared = dict(self)
+        self._local  = {}
+        del self._shared[key]
+
+    def __contains__(self,key):
+        return key in self._local or key in self._shared
+
+    def __iter__(self):
+        yield from self._shared
+        for key in self._local:
+            if key not in self._shared:
+                yield key
+
+    def __len__(self):
+        return len(self._shared) + sum(1 for key in self._local if key not in self._shared)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def copy(self):
+        return dict(self)
+
+    def share(self):
+        # New view for the next observation, carrying forward the values written in this one
+        return CopyOnWriteDict(self._shared,dict(self._local) if self._local else None)
+
+
+def share_state(state):
+    if state is None:
+        return None
+    elif isinstance(state,CopyOnWriteDict):
+        return state.share()
+    else:
+        return CopyOnWriteDict(state)
+
+
+def share_ranges(liquidity_ranges):
+    # A PositionBook is shared as a whole, a list of range dicts range by range
+    if isinstance(liquidity_ranges,PositionBook.PositionBook):
+        return liquidity_ranges.share()
+    return [share_state(x) for x in liquidity_ranges]
+
+
+def range_columns(liquidity_ranges):
+    # Lower ticks, upper ticks and liquidity of all ranges
+    if isinstance(liquidity_ranges,PositionBook.PositionBook):
+        return liquidity_ranges.lower_bin_tick,liquidity_ranges.upper_bin_tick,liquidity_ranges.position_liquidity
+    return ([x['lower_bin_tick']     for x in liquidity_ranges],
+            [x['upper_bin_tick']     for x in liquidity_ranges],
+            [x['position_liquidity'] for x in liquidity_ranges])
+
+
+def allocated_amounts(liquidity_ranges):
+    # Tokens in all ranges
+    if isinstance(liquidity_ranges,PositionBook.PositionBook):
+        return float(liquidity_ranges.token_0.sum()),float(liquidity_ranges.token_1.sum())
+    return sum(x['token_0'] for x in liquidity_ranges),sum(x['token_1'] for x in liquidity_ranges)
+
+
+# Ranges without labels are the base and limit ranges by position (as ResetStrategy and AutoRegressiveStrategy set them)
+RANGE_POSITIONS = {'base': 0, 'limit': 1}
+
+def has_labels(liquidity_ranges):
+    return isinstance(liquidity_ranges,PositionBook.PositionBook) or (len(liquidity_ranges) > 0 and 'label' in liquidity_ranges[0])
+
+
+def labelled_range(liquidity_ranges,label):
+    # First range with label ('base' or 'limit'), or None
+    if isinstance(liquidity_ranges,PositionBook.PositionBook):
+        return liquidity_ranges[label] if liquidity_ranges.labelled(label).any() else None
+    if has_labels(liquidity_ranges):
+        return next((x for x in liquidity_ranges if x['label'] == label),None)
+    k = RANGE_POSITIONS[label]
+    return liquidity_ranges[k] if len(liquidity_ranges) > k else None
+
+
+def labelled_value_in_token_0(liquidity_ranges,label,price):
+    # Value in token 0 of all ranges with label, 0 when there are none (e.g. strategies without a limit range)
+    if isinstance(liquidity_ranges,PositionBook.PositionBook):
+        return liquidity_ranges.value_in_token_0(price,label)
+    if not has_labels(liquidity_ranges):
+        x = labelled_range(liquidity_ranges,label)
+        return x['token_0'] + x['token_1'] / price if x is not None else 0.0
+    # Labels and amounts can be columns with a value per step (see SimulationResults.ObservationColumns)
+    labels = np.array([x['label'] for x in liquidity_ranges])
+    values = np.array([x['token_0'] + x['token_1'] / price for x in liquidity_ranges])
+    return np.where(labels == label,values,0.0).sum(axis=0)
+
 
 class StrategyObservation:
     def __init__(self,timepoint,
@@ -21,12 +138,17 @@ class StrategyObservation:
                      liquidity_ranges         = None,
                      strategy_info            = None,
                      swaps                    = None,
-                     simulate_strat           = True):
+                     simulate_strat           = True,
+                     price_tick               = None,
+                     price_tick_current       = None,
+                     pending_fees             = None,
+                     fee_model                = None):
         
         ######################################
         # 1. Store current values
         ######################################
         
+        self.pending_fees                = None
         self.time                        = timepoint
         self.price                       = current_price
         self.liquidity_in_0              = liquidity_in_0
@@ -45,11 +167,20 @@ class StrategyObservation:
         self.token_0_fees                = 0.0
         self.token_1_fees                = 0.0
         self.simulate_strat              = simulate_strat
-        self.strategy_info               = copy.deepcopy(strategy_info)
+        self.fee_model                   = fee_model
+        self.strategy_info               = share_state(strategy_info)
+        
+        # Uncollected fees can be left to settle when they are first read, as (FeeSegment,step)
+        self.pending_fees                = pending_fees
         
-        TICK_P_PRE                       = math.log(self.decimal_adjustment*self.price,1.0001)
-        self.price_tick                  = math.floor(TICK_P_PRE/self.tickSpacing)*self.tickSpacing
-        self.price_tick_current          = math.floor(TICK_P_PRE)
+        # Ticks can be passed in when precomputed (see MarketData)
+        if price_tick is None or price_tick_current is None:
+            TICK_P_PRE                   = math.log(self.decimal_adjustment*self.price,1.0001)
+            self.price_tick              = math.floor(TICK_P_PRE/self.tickSpacing)*self.tickSpacing
+            self.price_tick_current      = math.floor(TICK_P_PRE)
+        else:
+            self.price_tick              = int(price_tick)
+            self.price_tick_current      = int(price_tick_current)
             
         ######################################
         # 2. Execute the strategy
@@ -62,22 +193,30 @@ class StrategyObservation:
             self.liquidity_ranges,self.strategy_info  = strategy_in.set_liquidity_ranges(self)
                                  
         else: 
-            self.liquidity_ranges         = copy.deepcopy(liquidity_ranges)
+            # Ranges are shared with the previous observation, values written in this step stay local to it
+            self.liquidity_ranges         = share_ranges(liquidity_ranges)
             
             # Update amounts in each position according to current pool price
-            for i in range(len(self.liquidity_ranges)):
-                self.liquidity_ranges[i]['time'] = self.time
-                
+            if isinstance(self.liquidity_ranges,PositionBook.PositionBook):
+                # All ranges of a book at once
+                self.liquidity_ranges.time = self.time
                 if self.simulate_strat:
-                    amount_0, amount_1 = UNI_v3_funcs.get_amounts(self.price_tick_current,
-                                                                 self.liquidity_ranges[i]['lower_bin_tick'],
-                                                                 self.liquidity_ranges[i]['upper_bin_tick'],
-                                                                 self.liquidity_ranges[i]['position_liquidity'],
-                                                                 self.decimals_0,
-                                                                 self.decimals_1)
+                    self.liquidity_ranges.update_amounts(self.price_tick_current,self.decimals_0,self.decimals_1)
+            else:
+                for i in range(len(self.liquidity_ranges)):
+                    self.liquidity_ranges[i]['time'] = self.time
+                    
+                    if self.simulate_strat:
+                        amount_0, amount_1 = UNI_v3_funcs.get_amounts(self.price_tick_current,
+                                                                     self.liquidity_ranges[i]['lower_bin_tick'],
+                                                                     self.liquidity_ranges[i]['upper_bin_tick'],
+                                                                     self.liquidity_ranges[i]['position_liquidity'],
+                                                                     self.decimals_0,
+                                                                     self.decimals_1,
+                                                                     tick_spacing = self.tickSpacing)
 
-                    self.liquidity_ranges[i]['token_0'] = amount_0
-                    self.liquidity_ranges[i]['token_1'] = amount_1
+                        self.liquidity_ranges[i]['token_0'] = amount_0
+                        self.liquidity_ranges[i]['token_1'] = amount_1
 
             # If backtesting swaps, accrue the fees in the provided period
             if swaps is not None:
@@ -88,6 +227,38 @@ class StrategyObservation:
             # Check strategy and potentially reset the ranges
             self.liquidity_ranges,self.strategy_info     = strategy_in.check_strategy(self)
                 
+    ########################################################
+    # Uncollected fees, settled from pending_fees on first access
+    ########################################################
+    @property
+    def token_0_fees_uncollected(self):
+        if self.pending_fees is not None:
+            self.settle_fees()
+        return self._token_0_fees_uncollected
+    
+    @token_0_fees_uncollected.setter
+    def token_0_fees_uncollected(self,value):
+        if self.pending_fees is not None:
+            self.settle_fees()
+        self._token_0_fees_uncollected = value
+        
+    @property
+    def token_1_fees_uncollected(self):
+        if self.pending_fees is not None:
+            self.settle_fees()
+        return self._token_1_fees_uncollected
+    
+    @token_1_fees_uncollected.setter
+    def token_1_fees_uncollected(self,value):
+        if self.pending_fees is not None:
+            self.settle_fees()
+        self._token_1_fees_uncollected = value
+    
+    def settle_fees(self):
+        fee_segment,step                  = self.pending_fees
+        self.pending_fees                 = None
+        self._token_0_fees_uncollected,self._token_1_fees_uncollected = fee_segment.uncollected_at(step)
+        
     ########################################################
     # Accrue earned fees (not supply into LP yet)
     ########################################################               
@@ -96,24 +267,27 @@ class StrategyObservation:
         fees_earned_token_0 = 0.0
         fees_earned_token_1 = 0.0
                 
-        if len(relevant_swaps) > 0:
+        # Swaps can come in as a DataFrame or as a MarketData.SwapWindow
+        # A fee_model (e.g. FeeGrowthIndex) works on the swaps of the MarketData the window comes from
+        fee_model = self.fee_model
+        if isinstance(relevant_swaps,pd.DataFrame):
+            relevant_swaps = MarketData.SwapWindow.from_frame(relevant_swaps)
+            fee_model      = None
+                
+        if len(relevant_swaps) > 0 and fee_model is not None:
+            fees_earned_token_0,fees_earned_token_1 = fee_model.range_fees(relevant_swaps.start,relevant_swaps.stop,
+                                                                           *range_columns(self.liquidity_ranges))
+        elif len(relevant_swaps) > 0:
             
-            # For every swap in this time period
-            for s in range(len(relevant_swaps)):
-                for i in range(len(self.liquidity_ranges)):
-                    in_range   = (self.liquidity_ranges[i]['lower_bin_tick'] <= relevant_swaps.iloc[s]['tick_swap']) and \
-                                 (self.liquidity_ranges[i]['upper_bin_tick'] >= relevant_swaps.iloc[s]['tick_swap'])
-
-                    token_0_in = relevant_swaps.iloc[s]['token_in'] == 'token0'
-                    
-                    # Low liquidity tokens can have zero liquidity after swap
-                    if relevant_swaps.iloc[s]['virtual_liquidity'] < 1e-9:
-                        fraction_fees_earned_position = 1
-                    else:
-                        fraction_fees_earned_position = self.liquidity_ranges[i]['position_liquidity']/(self.liquidity_ranges[i]['position_liquidity'] + relevant_swaps.iloc[s]['virtual_liquidity'])
+            # Fees earned in every swap of this time period, all ranges at once
+            swap_fees  = compute_swap_fees(relevant_swaps.tick_swap,
+                                           relevant_swaps.virtual_liquidity,
+                                           relevant_swaps.traded_in,
+                                           *range_columns(self.liquidity_ranges),
+                                           self.fee_tier)
 
-                    fees_earned_token_0 += in_range * token_0_in     * self.fee_tier * fraction_fees_earned_position * relevant_swaps.iloc[s]['traded_in']
-                    fees_earned_token_1 += in_range * (1-token_0_in) * self.fee_tier * fraction_fees_earned_position * relevant_swaps.iloc[s]['traded_in']
+            fees_earned_token_0 = float(swap_fees[relevant_swaps.token_0_in].sum())
+            fees_earned_token_1 = float(swap_fees[~relevant_swaps.token_0_in].sum())
         
         self.token_0_fees_uncollected += fees_earned_token_0
         self.token_1_fees_uncollected += fees_earned_token_1
@@ -130,17 +304,22 @@ class StrategyObservation:
         removed_amount_1    = 0.0
         
         # For every bin, get the amounts you currently have and withdraw
-        for i in range(len(self.liquidity_ranges)):
-            
-            position_liquidity = self.liquidity_ranges[i]['position_liquidity']
-           
-            TICK_A             = self.liquidity_ranges[i]['lower_bin_tick']
-            TICK_B             = self.liquidity_ranges[i]['upper_bin_tick']
-            
-            token_amounts      = UNI_v3_funcs.get_amounts(self.price_tick,TICK_A,TICK_B,
-                                                     position_liquidity,self.decimals_0,self.decimals_1)   
-            removed_amount_0   += token_amounts[0]
-            removed_amount_1   += token_amounts[1]
+        if isinstance(self.liquidity_ranges,PositionBook.PositionBook):
+            token_amounts      = self.liquidity_ranges.amounts(self.price_tick,self.decimals_0,self.decimals_1)
+            removed_amount_0   = float(token_amounts[0].sum())
+            removed_amount_1   = float(token_amounts[1].sum())
+        else:
+            for i in range(len(self.liquidity_ranges)):
+                
+                position_liquidity = self.liquidity_ranges[i]['position_liquidity']
+               
+                TICK_A             = self.liquidity_ranges[i]['lower_bin_tick']
+                TICK_B             = self.liquidity_ranges[i]['upper_bin_tick']
+                
+                token_amounts      = UNI_v3_funcs.get_amounts(self.price_tick,TICK_A,TICK_B,
+                                                         position_liquidity,self.decimals_0,self.decimals_1,tick_spacing=self.tickSpacing)
+                removed_amount_0   += token_amounts[0]
+                removed_amount_1   += token_amounts[1]
         
         self.liquidity_in_0 = removed_amount_0 + self.token_0_left_over + self.token_0_fees_uncollected
         self.liquidity_in_1 = removed_amount_1 + self.token_1_left_over + self.token_1_fees_uncollected
@@ -152,47 +331,381 @@ class StrategyObservation:
         self.token_1_fees_uncollected = 0.0
         
    
+########################################################
+# Fee accrual kernel
+# Fees earned in each swap (in units of the token swapped in) by a set of 
+# liquidity ranges, computed for all swaps x ranges in one array operation
+# Ranges can also be (members x ranges) arrays, one row per strategy of a batch 
+# (see BatchSimulation), giving the fees of every swap x member
+########################################################
+
+def compute_swap_fees(tick_swap,virtual_liquidity,traded_in,lower_bin_tick,upper_bin_tick,position_liquidity,fee_tier):
+    
+    range_shape        = np.shape(lower_bin_tick)
+    swap_shape         = (-1,) + (1,)*len(range_shape)
+    tick_swap          = np.asarray(tick_swap).reshape(swap_shape)
+    virtual_liquidity  = np.asarray(virtual_liquidity,dtype=float).reshape(swap_shape)
+    lower_bin_tick     = np.asarray(lower_bin_tick)[None]
+    upper_bin_tick     = np.asarray(upper_bin_tick)[None]
+    position_liquidity = UNI_v3_funcs.liquidity_float_array(position_liquidity).reshape(range_shape)[None]
+    
+    in_range           = (lower_bin_tick <= tick_swap) & (upper_bin_tick >= tick_swap)
+    
+    # Low liquidity tokens can have zero liquidity after swap
+    with np.errstate(divide='ignore',invalid='ignore'):
+        fraction_fees_earned_position = np.where(virtual_liquidity < 1e-9,1.0,
+                                                 position_liquidity/(position_liquidity + virtual_liquidity))
+    
+    return (in_range * fraction_fees_earned_position).sum(axis=-1) * fee_tier * np.asarray(traded_in,dtype=float).reshape(swap_shape[:-1])
+
 ########################################################
 # Simulate strategy using a pandas Series called price_data, which has as an index
 # the time point, and contains the pool price (token 1 per token 0) 
+# A MarketData object compiled from the same inputs can be passed in as market_data
+# to reuse it across simulations
+# With columnar=True results are written into a SimulationResults column store
+# instead of a list with one StrategyObservation per time point
+# With skip_steps=True (requires columnar=True) strategies that implement next_trigger
+# are only evaluated at the time points where they could rebalance
+# With two_pass=True (requires columnar=True) the strategy decisions are simulated first
+# and positions and fees are valued afterwards, one reset segment at a time
+# fee_model replaces the proportional fee estimate (compute_swap_fees), e.g. with a
+# FeeGrowthIndex built on the same MarketData
 ########################################################
 
 def simulate_strategy(price_data,swap_data,strategy_in,
-                       liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1):
+                       liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,market_data=None,columnar=False,skip_steps=False,two_pass=False,
+                       fee_model=None):
 
-    strategy_results = []    
-  
-    # Go through every time period in the data that was passet
-    for i in range(len(price_data)): 
-        # Strategy Initialization
+    if market_data is None:
+        market_data = MarketData.MarketData(price_data,swap_data,fee_tier,decimals_0,decimals_1)
+        
+    if (skip_steps or two_pass) and not columnar:
+        raise ValueError('skip_steps and two_pass require columnar=True')
+        
+    if two_pass:
+        return simulate_strategy_two_pass(strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,market_data,skip_steps,fee_model)
+        
+    if skip_steps:
+        return simulate_strategy_skipping(strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,market_data,fee_model)
+
+    observations = simulate_strategy_iter(price_data,swap_data,strategy_in,liquidity_in_0,liquidity_in_1,
+                                          fee_tier,decimals_0,decimals_1,market_data,fee_model)
+    if not columnar:
+        return list(observations)
+    
+    strategy_results = None
+    for i,current in enumerate(observations):
         if i == 0:
-            strategy_results.append(StrategyObservation(price_data.index[i],
-                                              price_data[i],
-                                              strategy_in,
-                                              liquidity_in_0,liquidity_in_1,
-                                              fee_tier,decimals_0,decimals_1))
-        # After initialization
-        else:
+            strategy_results = SimulationResults.SimulationResults(market_data,len(current.liquidity_ranges))
+        strategy_results.record(i,current)
             
-            relevant_swaps = swap_data[price_data.index[i-1]:price_data.index[i]]
-            strategy_results.append(StrategyObservation(price_data.index[i],
-                                              price_data[i],
-                                              strategy_in,
-                                              strategy_results[i-1].liquidity_in_0,
-                                              strategy_results[i-1].liquidity_in_1,
-                                              strategy_results[i-1].fee_tier,
-                                              strategy_results[i-1].decimals_0,
-                                              strategy_results[i-1].decimals_1,
-                                              strategy_results[i-1].token_0_left_over,
-                                              strategy_results[i-1].token_1_left_over,
-                                              strategy_results[i-1].token_0_fees_uncollected,
-                                              strategy_results[i-1].token_1_fees_uncollected,
-                                              strategy_results[i-1].liquidity_ranges,
-                                              strategy_results[i-1].strategy_info,
-                                              relevant_swaps))
+    return strategy_results
+
+########################################################
+# Event driven simulation
+# After every evaluated step the strategy's next_trigger gives the price and tick bounds
+# and the next scheduled check within which check_strategy cannot rebalance. The steps 
+# until the first one outside of those bounds are filled in bulk: position amounts and
+# fees are computed with array operations and the strategy is not called.
+########################################################
+
+def simulate_strategy_skipping(strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,market_data,fee_model=None):
+    
+    strategy_results = None
+    previous         = None
+    i                = 0
+    
+    while i < len(market_data):
+        current = next_observation(market_data,i,previous,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,fee_model)
+        if i == 0:
+            strategy_results = SimulationResults.SimulationResults(market_data,len(current.liquidity_ranges))
+        strategy_results.record(i,current)
+        previous = current
+        
+        next_i   = next_evaluation_step(strategy_in,market_data,i,current)
+        if next_i > i+1:
+            fill_quiet_steps(strategy_results,market_data,i+1,next_i,current)
+        i        = next_i
             
     return strategy_results
 
+def next_evaluation_step(strategy_in,market_data,i,observation):
+    
+    trigger = strategy_in.next_trigger(observation) if hasattr(strategy_in,'next_trigger') else None
+    if trigger is None:
+        return i+1
+    
+    return market_data.next_trigger_step(i+1,
+                                         trigger.get('price_lower',-np.inf),
+                                         trigger.get('price_upper', np.inf),
+                                         trigger.get('tick_lower'),
+                                         trigger.get('tick_upper'),
+                                         trigger.get('time'))
+
+def fill_quiet_steps(strategy_results,market_data,start,stop,observation):
+    
+    # Ranges are fixed between start and stop
+    lower_bin_tick,upper_bin_tick,position_liquidity = range_columns(observation.liquidity_ranges)
+    
+    range_token_0,range_token_1 = range_amounts(market_data.price_tick_current[start:stop],lower_bin_tick,upper_bin_tick,position_liquidity,
+                                                observation.decimals_0,observation.decimals_1)
+    token_0_fees,token_1_fees   = span_fees(market_data,start,stop,lower_bin_tick,upper_bin_tick,position_liquidity,observation.fee_tier,observation.fee_model)
+    
+    strategy_results.record_quiet(start,stop,observation,token_0_fees,token_1_fees,range_token_0,range_token_1)
+    
+    # Carry the state forward to the last quiet step
+    observation.token_0_fees_uncollected = strategy_results.token_0_fees_uncollected[stop-1]
+    observation.token_1_fees_uncollected = strategy_results.token_1_fees_uncollected[stop-1]
+
+def range_amounts(ticks,lower_bin_tick,upper_bin_tick,position_liquidity,decimals_0,decimals_1):
+    
+    # Position amounts at every tick in ticks (ticks x ranges)
+    # Liquidity can exceed int64, keep it as Python integers
+    range_token_0,range_token_1 = UNI_v3_funcs.get_amounts_array(np.asarray(ticks)[:,None],
+                                                                 np.asarray(lower_bin_tick)[None,:],
+                                                                 np.asarray(upper_bin_tick)[None,:],
+                                                                 np.array(position_liquidity,dtype=object)[None,:],
+                                                                 decimals_0,decimals_1)
+    return range_token_0,range_token_1
+
+def span_fees(market_data,start,stop,lower_bin_tick,upper_bin_tick,position_liquidity,fee_tier,fee_model=None):
+    
+    # Fees of every swap in steps start to stop-1, then summed per step
+    swap_start         = market_data.swap_start[start]
+    swap_stop          = market_data.swap_stop[stop-1]
+    if fee_model is not None:
+        swap_fees      = fee_model.swap_fees(swap_start,swap_stop,lower_bin_tick,upper_bin_tick,position_liquidity)
+    else:
+        swap_fees      = compute_swap_fees(market_data.tick_swap[swap_start:swap_stop],
+                                           market_data.virtual_liquidity[swap_start:swap_stop],
+                                           market_data.traded_in[swap_start:swap_stop],
+                                           lower_bin_tick,upper_bin_tick,position_liquidity,fee_tier)
+    token_0_in         = market_data.token_0_in[swap_start:swap_stop]
+    token_0_fees       = market_data.window_sums(np.where(token_0_in,swap_fees,0.0),start,stop)
+    token_1_fees       = market_data.window_sums(np.where(token_0_in,0.0,swap_fees),start,stop)
+    return token_0_fees,token_1_fees
+
+########################################################
+# Two-pass simulation
+# 1. Decision pass: the strategy is evaluated (at every step, or only where it could 
+#    rebalance with skip_steps=True) without accruing fees. Uncollected fees are 
+#    settled from the current FeeSegment only when read, normally at a reset.
+# 2. Valuation pass: between resets the ranges are fixed, so position amounts and fees
+#    of every step are filled with array operations, one reset segment at a time.
+########################################################
+
+def simulate_strategy_two_pass(strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,market_data,skip_steps=False,fee_model=None):
+    
+    simulation = TwoPassSimulation(strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,market_data,fee_model)
+    i          = 0
+    while i < len(market_data):
+        current = simulation.evaluate(i)
+        i       = next_evaluation_step(strategy_in,market_data,i,current) if skip_steps else i+1
+        
+    return simulation.value()
+
+class TwoPassSimulation:
+    """
+    State of one two-pass simulation: evaluate(i) runs the decision pass at step i
+    (steps in increasing order), value() runs the valuation pass and returns the SimulationResults.
+    """
+    def __init__(self,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,market_data,fee_model=None):
+        
+        self.strategy_in      = strategy_in
+        self.liquidity_in_0   = liquidity_in_0
+        self.liquidity_in_1   = liquidity_in_1
+        self.fee_tier         = fee_tier
+        self.decimals_0       = decimals_0
+        self.decimals_1       = decimals_1
+        self.market_data      = market_data
+        self.fee_model        = fee_model
+        
+        self.evaluated        = np.zeros(len(market_data),dtype=bool)
+        self.segments         = []
+        self.strategy_results = None
+        self.previous         = None
+        self.range_state      = None
+        
+    ######################################
+    # 1. Decision pass
+    ######################################
+    def evaluate(self,i):
+        
+        market_data = self.market_data
+        previous    = self.previous
+        if previous is None:
+            current = next_observation(market_data,i,None,self.strategy_in,self.liquidity_in_0,self.liquidity_in_1,
+                                       self.fee_tier,self.decimals_0,self.decimals_1,self.fee_model)
+            self.strategy_results = SimulationResults.SimulationResults(market_data,len(current.liquidity_ranges))
+        else:
+            current = StrategyObservation(market_data.index[i],
+                                          market_data.price[i],
+                                          self.strategy_in,
+                                          previous.liquidity_in_0,
+                                          previous.liquidity_in_1,
+                                          previous.fee_tier,
+                                          previous.decimals_0,
+                                          previous.decimals_1,
+                                          previous.token_0_left_over,
+                                          previous.token_1_left_over,
+                                          liquidity_ranges   = previous.liquidity_ranges,
+                                          strategy_info      = previous.strategy_info,
+                                          price_tick         = market_data.price_tick[i],
+                                          price_tick_current = market_data.price_tick_current[i],
+                                          pending_fees       = (self.segments[-1],i),
+                                          fee_model          = previous.fee_model)
+        
+        # New fee segment whenever the ranges change
+        current_state = SimulationResults.ranges_state(current.liquidity_ranges)
+        if self.range_state is None or not SimulationResults.same_state(current_state,self.range_state):
+            self.segments.append(FeeSegment(market_data,i+1,current))
+            self.range_state = current_state
+            
+        self.strategy_results.record(i,current,fees=False)
+        self.evaluated[i] = True
+        self.previous     = current
+        return current
+    
+    ######################################
+    # 2. Valuation pass
+    ######################################
+    def value(self):
+        
+        market_data      = self.market_data
+        strategy_results = self.strategy_results
+        evaluated        = self.evaluated
+        segments         = self.segments
+        strategy_results.fill_forward(evaluated)
+        
+        for k,segment in enumerate(segments):
+            last  = segments[k+1].first_step - 1 if k+1 < len(segments) else len(market_data) - 1
+            steps = np.arange(segment.first_step,last+1)
+            
+            # Fees under this segment's ranges, up to and including the step of the next reset
+            token_0_fees,token_1_fees,token_0_fees_uncollected,token_1_fees_uncollected = segment.fees(last+1)
+            strategy_results.token_0_fees[steps]             = token_0_fees
+            strategy_results.token_1_fees[steps]             = token_1_fees
+            strategy_results.token_0_fees_uncollected[steps] = token_0_fees_uncollected
+            strategy_results.token_1_fees_uncollected[steps] = token_1_fees_uncollected
+            strategy_results.token_0_fees_uncollected[segment.first_step-1] = segment.token_0_fees_start
+            strategy_results.token_1_fees_uncollected[segment.first_step-1] = segment.token_1_fees_start
+            
+            # Position amounts where the strategy was not evaluated
+            quiet = steps[~evaluated[steps]]
+            if len(quiet) > 0:
+                range_token_0,range_token_1 = range_amounts(market_data.price_tick_current[quiet],segment.lower_bin_tick,segment.upper_bin_tick,
+                                                            segment.position_liquidity,segment.decimals_0,segment.decimals_1)
+                strategy_results.record_amounts(quiet,range_token_0,range_token_1)
+                
+        return strategy_results
+
+class FeeSegment:
+    """
+    Fees earned by a fixed set of liquidity ranges from first_step on. 
+    They are computed in bulk up to the step at which they are needed.
+    """
+    def __init__(self,market_data,first_step,observation):
+        
+        self.market_data        = market_data
+        self.first_step         = first_step
+        self.next_step          = first_step
+        self.fee_tier           = observation.fee_tier
+        self.fee_model          = observation.fee_model
+        self.decimals_0         = observation.decimals_0
+        self.decimals_1         = observation.decimals_1
+        self.lower_bin_tick,self.upper_bin_tick,self.position_liquidity = range_columns(observation.liquidity_ranges)
+        self.token_0_fees_start = observation.token_0_fees_uncollected
+        self.token_1_fees_start = observation.token_1_fees_uncollected
+        self.chunks             = []
+        
+    def extend(self,stop):
+        
+        # Fees of steps next_step to stop-1
+        stop = min(stop,len(self.market_data))
+        if stop <= self.next_step:
+            return
+        token_0_fees,token_1_fees = span_fees(self.market_data,self.next_step,stop,
+                                              self.lower_bin_tick,self.upper_bin_tick,self.position_liquidity,self.fee_tier,self.fee_model)
+        token_0_start,token_1_start = self.uncollected_at(self.next_step-1)
+        # Cumulated in order, as adding the fees step by step would
+        self.chunks.append((token_0_fees,token_1_fees,
+                            np.cumsum(np.r_[token_0_start,token_0_fees])[1:],
+                            np.cumsum(np.r_[token_1_start,token_1_fees])[1:]))
+        self.next_step = stop
+        
+    def uncollected_at(self,step):
+        
+        self.extend(step+1)
+        if step < self.first_step:
+            return self.token_0_fees_start,self.token_1_fees_start
+        if step == self.next_step - 1:
+            return float(self.chunks[-1][2][-1]),float(self.chunks[-1][3][-1])
+        _,_,token_0_fees_uncollected,token_1_fees_uncollected = self.fees(step+1)
+        return float(token_0_fees_uncollected[-1]),float(token_1_fees_uncollected[-1])
+    
+    def fees(self,stop):
+        
+        # Fees and uncollected fees of steps first_step to stop-1
+        self.extend(stop)
+        n = stop - self.first_step
+        if len(self.chunks) == 0:
+            return tuple(np.zeros(0) for x in range(4))
+        return tuple(np.concatenate([chunk[x] for chunk in self.chunks])[:n] for x in range(4))
+
+########################################################
+# Streaming version of simulate_strategy
+# Yields one StrategyObservation per time point, keeping only the previous
+# one alive, so that results can be reduced or written out as they are produced
+########################################################
+
+def simulate_strategy_iter(price_data,swap_data,strategy_in,
+                           liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,market_data=None,fee_model=None):
+
+    if market_data is None:
+        market_data = MarketData.MarketData(price_data,swap_data,fee_tier,decimals_0,decimals_1)
+
+    previous = None
+  
+    # Go through every time period in the data that was passet
+    for i in range(len(market_data)): 
+        current  = next_observation(market_data,i,previous,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,fee_model)
+        yield current
+        previous = current
+
+def next_observation(market_data,i,previous,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,fee_model=None):
+    
+    # Strategy Initialization
+    if previous is None:
+        return StrategyObservation(market_data.index[i],
+                                   market_data.price[i],
+                                   strategy_in,
+                                   liquidity_in_0,liquidity_in_1,
+                                   fee_tier,decimals_0,decimals_1,
+                                   price_tick         = market_data.price_tick[i],
+                                   price_tick_current = market_data.price_tick_current[i],
+                                   fee_model          = fee_model)
+    # After initialization
+    else:
+        return StrategyObservation(market_data.index[i],
+                                   market_data.price[i],
+                                   strategy_in,
+                                   previous.liquidity_in_0,
+                                   previous.liquidity_in_1,
+                                   previous.fee_tier,
+                                   previous.decimals_0,
+                                   previous.decimals_1,
+                                   previous.token_0_left_over,
+                                   previous.token_1_left_over,
+                                   previous.token_0_fees_uncollected,
+                                   previous.token_1_fees_uncollected,
+                                   previous.liquidity_ranges,
+                                   previous.strategy_info,
+                                   market_data.swap_window(i),
+                                   price_tick         = market_data.price_tick[i],
+                                   price_tick_current = market_data.price_tick_current[i],
+                                   fee_model          = previous.fee_model)
+
 ########################################################
 # Extract Strategy Data
 ########################################################
@@ -202,28 +715,65 @@ def generate_simulation_series(simulations,strategy_in,token_0_usd_data = None):
     # token_0_usd_data has in quotePrice 
     # token_0 / usd value for each index
     
-    data_strategy                    = pd.DataFrame([strategy_in.dict_components(i) for i in simulations])
+    # simulations is either a list of StrategyObservation or a SimulationResults column store
+    if isinstance(simulations,SimulationResults.SimulationResults):
+        data_strategy                   = simulations.to_frame(strategy_in)
+        token_0_initial,token_1_initial = simulations.initial_amounts()
+    else:
+        data_strategy                   = pd.DataFrame([strategy_in.dict_components(i) for i in simulations])
+        token_0_initial,token_1_initial = initial_amounts(simulations[0])
+        
+    if token_0_usd_data is not None:
+        token_0_usd_data = prepare_usd_data(token_0_usd_data)
+
+    data_return,_ = add_simulation_values(data_strategy,token_0_initial,token_1_initial,token_0_usd_data)
+    return data_return
+
+def initial_amounts(first_observation):
+    # Tokens in all ranges plus those left over
+    token_0_allocated,token_1_allocated = allocated_amounts(first_observation.liquidity_ranges)
+    token_0_initial = token_0_allocated + first_observation.token_0_left_over
+    token_1_initial = token_1_allocated + first_observation.token_1_left_over
+    return token_0_initial,token_1_initial
+
+def prepare_usd_data(token_0_usd_data):
+    token_0_usd_data['price_0_usd']         = 1/token_0_usd_data['quotePrice']
+    token_0_usd_data['time_pd']             = token_0_usd_data.index
+    token_0_usd_data                        = token_0_usd_data.set_index('time_pd').sort_index()
+    return token_0_usd_data
+
+def skipna_cumsum(start,values):
+    # Cumulative sum from start as pandas' cumsum computes it: NaN values stay NaN and later sums skip them
+    cum_values = start + np.nancumsum(values)
+    cum_values[np.isnan(values)] = np.nan
+    return cum_values
+
+def add_simulation_values(data_strategy,token_0_initial,token_1_initial,token_0_usd_data = None,cum_fees_start = (0.0,0.0)):
+    
+    # cum_fees_start carries the accumulated token 0 and token 1 fees (in token 0) of previous chunks when streaming
     data_strategy                    = data_strategy.set_index('time',drop=False)
     data_strategy                    = data_strategy.sort_index()
+    token_0_fees                     = data_strategy['token_0_fees'].to_numpy(dtype=float)
+    token_1_fees_in_0                = (data_strategy['token_1_fees'] / data_strategy['price']).to_numpy(dtype=float)
+    cum_fees_token_0                 = skipna_cumsum(cum_fees_start[0],token_0_fees)
+    cum_fees_token_1                 = skipna_cumsum(cum_fees_start[1],token_1_fees_in_0)
+    cum_fees_0                       = cum_fees_token_0 + cum_fees_token_1
     
-    token_0_initial                  = simulations[0].liquidity_ranges[0]['token_0'] + simulations[0].liquidity_ranges[1]['token_0'] + simulations[0].token_0_left_over
-    token_1_initial                  = simulations[0].liquidity_ranges[0]['token_1'] + simulations[0].liquidity_ranges[1]['token_1'] + simulations[0].token_1_left_over
+    # Strategies without a limit range can leave out its value
+    if 'limit_position_value_in_token_0' not in data_strategy:
+        data_strategy['limit_position_value_in_token_0'] = 0.0
     
     if token_0_usd_data is None:
         data_strategy['value_position_usd']       = data_strategy['value_position_in_token_0']
         data_strategy['base_position_value_usd']  = data_strategy['base_position_value_in_token_0']
         data_strategy['limit_position_value_usd'] = data_strategy['limit_position_value_in_token_0']
-        data_strategy['cum_fees_usd']             = data_strategy['token_0_fees'].cumsum() + (data_strategy['token_1_fees'] / data_strategy['price']).cumsum()
+        data_strategy['cum_fees_usd']             = cum_fees_0
         data_strategy['token_0_hold_usd']         = token_0_initial
         data_strategy['token_1_hold_usd']         = token_1_initial / data_strategy['price']
         data_strategy['value_hold_usd']           = data_strategy['token_0_hold_usd'] + data_strategy['token_1_hold_usd']
         data_return = data_strategy
     else:
         # Merge in usd price data
-        token_0_usd_data['price_0_usd']         = 1/token_0_usd_data['quotePrice']
-        token_0_usd_data['time_pd']             = token_0_usd_data.index
-        token_0_usd_data                        = token_0_usd_data.set_index('time_pd').sort_index()
-        
         data_strategy['time_pd']                = pd.to_datetime(data_strategy['time'],utc=True)
         data_strategy                           = data_strategy.set_index('time_pd').sort_index()
         data_return                             = pd.merge_asof(data_strategy,token_0_usd_data['price_0_usd'],on='time_pd',direction='backward',allow_exact_matches = True)
@@ -232,13 +782,76 @@ def generate_simulation_series(simulations,strategy_in,token_0_usd_data = None):
         data_return['value_position_usd']       = data_return['value_position_in_token_0']*data_return['price_0_usd']
         data_return['base_position_value_usd']  = data_return['base_position_value_in_token_0']*data_return['price_0_usd']
         data_return['limit_position_value_usd'] = data_return['limit_position_value_in_token_0']*data_return['price_0_usd']
-        data_return['cum_fees_0']               = data_return['token_0_fees'].cumsum() + (data_return['token_1_fees'] / data_return['price']).cumsum()
+        data_return['cum_fees_0']               = cum_fees_0
         data_return['cum_fees_usd']             = data_return['cum_fees_0']*data_return['price_0_usd']
         data_return['token_0_hold_usd']         = token_0_initial * data_return['price_0_usd']
         data_return['token_1_hold_usd']         = token_1_initial * data_return['price_0_usd'] / data_return['price']
         data_return['value_hold_usd']           = data_return['token_0_hold_usd'] + data_return['token_1_hold_usd']
         
-    return data_return
+    cum_fees_end = (cum_fees_start[0] + np.nansum(token_0_fees),cum_fees_start[1] + np.nansum(token_1_fees_in_0))
+    return data_return,cum_fees_end
+
+########################################################
+# Streaming version of generate_simulation_series
+# Takes any iterable of StrategyObservation (e.g. simulate_strategy_iter) and
+# yields the same series in chunks of chunk_size rows
+########################################################
+
+def generate_simulation_series_iter(observations,strategy_in,token_0_usd_data = None,chunk_size = 10000):
+    
+    if token_0_usd_data is not None:
+        token_0_usd_data = prepare_usd_data(token_0_usd_data)
+        
+    token_0_initial = None
+    cum_fees        = (0.0,0.0)
+    rows_out        = 0
+    chunk           = []
+    
+    for observation in observations:
+        if token_0_initial is None:
+            token_0_initial,token_1_initial = initial_amounts(observation)
+        chunk.append(strategy_in.dict_components(observation))
+        
+        if len(chunk) == chunk_size:
+            data_chunk,cum_fees = add_simulation_values(pd.DataFrame(chunk),token_0_initial,token_1_initial,token_0_usd_data,cum_fees)
+            chunk               = []
+            if token_0_usd_data is not None:
+                data_chunk.index = pd.RangeIndex(rows_out,rows_out+len(data_chunk))
+            rows_out           += len(data_chunk)
+            yield data_chunk
+            
+    if len(chunk) > 0:
+        data_chunk,cum_fees = add_simulation_values(pd.DataFrame(chunk),token_0_initial,token_1_initial,token_0_usd_data,cum_fees)
+        if token_0_usd_data is not None:
+            data_chunk.index = pd.RangeIndex(rows_out,rows_out+len(data_chunk))
+        yield data_chunk
+
+def write_simulation_series(series_chunks,file_name,file_format = 'csv'):
+    """
+    Writes chunks from generate_simulation_series_iter to a csv or parquet file as they are produced.
+    Returns the number of rows written.
+    """
+    rows_written = 0
+    writer       = None
+    
+    for data_chunk in series_chunks:
+        if file_format == 'csv':
+            data_chunk.to_csv(file_name,mode = 'w' if rows_written == 0 else 'a',header = rows_written == 0)
+        elif file_format == 'parquet':
+            import pyarrow
+            import pyarrow.parquet
+            table = pyarrow.Table.from_pandas(data_chunk)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(file_name,table.schema)
+            writer.write_table(table)
+        else:
+            raise ValueError('Unsupported file format:'+file_format)
+        rows_written += len(data_chunk)
+        
+    if writer is not None:
+        writer.close()
+        
+    return rows_written
 
 
 ########################################################
@@ -311,10 +924,8 @@ def analyze_strategy(data_usd,frequency = 'M'):
                         'volatility'           : ((data_usd['value_position_usd'].pct_change().var())**(0.5)) * ((annualization_factor)**(0.5)),
                         'sharpe_ratio'         : float(net_apr / (((data_usd['value_position_usd'].pct_change().var())**(0.5)) * ((annualization_factor)**(0.5)))),
                         'impermanent_loss'     : ((strategy_last_obs['value_position_usd'] - strategy_last_obs['value_hold_usd']) / strategy_last_obs['value_hold_usd'])[0],
-                        'mean_base_position'   : (data_usd['base_position_value_in_token_0']/ \
-                                                  (data_usd['base_position_value_in_token_0']+data_usd['limit_position_value_in_token_0']+data_usd['value_left_over_in_token_0'])).mean(),        
-                        'median_base_position' : (data_usd['base_position_value_in_token_0']/ \
-                                                  (data_usd['base_position_value_in_token_0']+data_usd['limit_position_value_in_token_0']+data_usd['value_left_over_in_token_0'])).median(),
+                        'mean_base_position'   : base_position_share(data_usd).mean(),        
+                        'median_base_position' : base_position_share(data_usd).median(),
                         'mean_base_width'      : ((data_usd['base_range_upper']-data_usd['base_range_lower'])/data_usd['price_at_reset']).mean(),
                         'median_base_width'    : ((data_usd['base_range_upper']-data_usd['base_range_lower'])/data_usd['price_at_reset']).median(),        
                         'final_value'          : data_usd['value_position_usd'].iloc[-1]
@@ -322,6 +933,112 @@ def analyze_strategy(data_usd,frequency = 'M'):
     
     return summary_strat
 
+def base_position_share(data_usd):
+    
+    # Base position value over the value of the ranges and left over tokens, without a limit column its value is 0
+    limit_value = data_usd['limit_position_value_in_token_0'] if 'limit_position_value_in_token_0' in data_usd else 0.0
+    return data_usd['base_position_value_in_token_0']/(data_usd['base_position_value_in_token_0']+limit_value+data_usd['value_left_over_in_token_0'])
+
+
+########################################################
+# Incremental version of analyze_strategy for streamed series
+# Feed the chunks of generate_simulation_series_iter to update and read the 
+# same summary as analyze_strategy from result. Only running statistics are kept,
+# plus the base position share and width columns that the medians need.
+########################################################
+
+class StrategySummary:
+    def __init__(self,frequency = 'M'):
+        self.frequency              = frequency
+        self.time_min               = None
+        self.time_max               = None
+        self.initial_position_value = None
+        self.last_obs               = None
+        self.rebalances             = 0
+        self.value_max              = -np.inf
+        self.value_min              = np.inf
+        self.last_value             = None
+        # Running count, mean and sum of squared deviations of position value returns
+        self.n_returns              = 0
+        self.mean_return            = 0.0
+        self.m2_return              = 0.0
+        self.base_position          = []
+        self.base_width             = []
+
+    def update(self,data_usd):
+        
+        if len(data_usd) == 0:
+            return
+        
+        time_chunk      = data_usd['time']
+        self.time_min   = time_chunk.min() if self.time_min is None else min(self.time_min,time_chunk.min())
+        self.time_max   = time_chunk.max() if self.time_max is None else max(self.time_max,time_chunk.max())
+        
+        if self.initial_position_value is None:
+            self.initial_position_value = data_usd.iloc[0]['value_hold_usd']
+        self.last_obs   = data_usd.iloc[-1][['value_position_usd','value_hold_usd','cum_fees_usd']]
+        
+        self.rebalances += data_usd['reset_point'].sum()
+        
+        value_position  = data_usd['value_position_usd'].to_numpy(dtype=float)
+        self.value_max  = max(self.value_max,np.nanmax(value_position))
+        self.value_min  = min(self.value_min,np.nanmin(value_position))
+        
+        # Returns within the chunk and across the chunk boundary
+        if self.last_value is not None:
+            value_position = np.r_[self.last_value,value_position]
+        self.last_value = value_position[-1]
+        returns         = value_position[1:]/value_position[:-1] - 1
+        returns         = returns[~np.isnan(returns)]
+        
+        if len(returns) > 0:
+            n_chunk          = len(returns)
+            mean_chunk       = returns.mean()
+            m2_chunk         = ((returns - mean_chunk)**2).sum()
+            n_total          = self.n_returns + n_chunk
+            delta            = mean_chunk - self.mean_return
+            self.mean_return = self.mean_return + delta * n_chunk / n_total
+            self.m2_return   = self.m2_return + m2_chunk + delta**2 * self.n_returns * n_chunk / n_total
+            self.n_returns   = n_total
+        
+        self.base_position.append(base_position_share(data_usd).to_numpy(dtype=float))
+        self.base_width.append(((data_usd['base_range_upper']-data_usd['base_range_lower'])/data_usd['price_at_reset']).to_numpy(dtype=float))
+
+    def result(self):
+        
+        if   self.frequency == 'M':
+                annualization_factor = 365*24*60
+        elif self.frequency == 'H':
+                annualization_factor = 365*24
+        elif self.frequency == 'D':
+                annualization_factor = 365
+        
+        days_strategy  = (self.time_max-self.time_min).days
+        net_apr        = (self.last_obs['value_position_usd']/self.initial_position_value - 1) * 365 / days_strategy
+        volatility     = ((self.m2_return/(self.n_returns-1))**(0.5)) * ((annualization_factor)**(0.5)) if self.n_returns > 1 else np.nan
+        base_position  = np.concatenate(self.base_position)
+        base_width     = np.concatenate(self.base_width)
+        
+        summary_strat = {
+                            'days_strategy'        : days_strategy,
+                            'gross_fee_apr'        : float((self.last_obs['cum_fees_usd']/self.initial_position_value) * 365 / days_strategy),
+                            'gross_fee_return'     : float(self.last_obs['cum_fees_usd']/self.initial_position_value),
+                            'net_apr'              : float(net_apr),
+                            'net_return'           : float(self.last_obs['value_position_usd']/self.initial_position_value  - 1),
+                            'rebalances'           : self.rebalances,
+                            'max_drawdown'         : ( self.value_max - self.value_min ) / self.value_max,
+                            'volatility'           : volatility,
+                            'sharpe_ratio'         : float(net_apr / volatility),
+                            'impermanent_loss'     : (self.last_obs['value_position_usd'] - self.last_obs['value_hold_usd']) / self.last_obs['value_hold_usd'],
+                            'mean_base_position'   : np.nanmean(base_position),
+                            'median_base_position' : np.nanmedian(base_position),
+                            'mean_base_width'      : np.nanmean(base_width),
+                            'median_base_width'    : np.nanmedian(base_width),
+                            'final_value'          : self.last_value
+                        }
+        
+        return summary_strat
+
 
 def plot_strategy(data_strategy,y_axis_label,base_color = '#ff0000',flip_price_axis=False):
     import plotly.graph_objects as go
@@ -1,14 +1,23 @@
 import pandas as pd
 import numpy as np
 import math
+import time
 import arch
 import UNI_v3_funcs
 import ActiveStrategyFramework
+import MarketData
+import ForecastPrecompute
 import scipy
-import copy
 
 class AutoRegressiveStrategy:
-    def __init__(self,model_data,alpha_param,tau_param,volatility_reset_ratio,tokens_outside_reset = .05,data_frequency='D',default_width = .5,days_ar_model = 180,return_forecast_cutoff=0.15,z_score_cutoff=5):
+    # State of the fits of a simulation (reset at its start) and lookups built from model_data,
+    # which SimulationCache keys leave out
+    runtime_attributes = ('model_state','fit_statistics','filter_states','model_prices','model_index','return_buffers','forecast_key')
+    # State carried from one step to the next, which SimulationCheckpoint stores to resume a simulation
+    checkpoint_attributes = ('model_state','filter_states')
+    
+    def __init__(self,model_data,alpha_param,tau_param,volatility_reset_ratio,tokens_outside_reset = .05,data_frequency='D',default_width = .5,days_ar_model = 180,return_forecast_cutoff=0.15,z_score_cutoff=5,clean_model_data=True,
+                 warm_start=False,refit_every=1,variance_filter=False,forecast_cache=None,forecast_table=None):
         
         
         # Allow for different input data frequencies, always get 1 day ahead forecast
@@ -38,7 +47,32 @@ class AutoRegressiveStrategy:
         self.days_ar_model          = days_ar_model
         self.z_score_cutoff         = z_score_cutoff
         self.window_size            = 60*24*30
-        self.model_data             = self.clean_data_for_garch(model_data)
+        self.ar_check_frequency     = 60
+        # clean_model_data=False takes model_data already cleaned by clean_data_for_garch (e.g. once for many strategies)
+        self.model_data             = self.clean_data_for_garch(model_data) if clean_model_data else model_data
+        
+        # Consecutive forecasts fit windows that differ by a few returns: with warm_start each fit starts from the 
+        # parameters of the previous one, and with refit_every=k parameters are only re-estimated every k forecasts
+        self.warm_start             = warm_start
+        self.refit_every            = refit_every
+        self.model_state            = None
+        self.fit_statistics         = []
+        
+        # With variance_filter the forecasts between refits update the fitted model's conditional variance and AR state
+        # with the GARCH(1,1) recursion, from the returns since the previous forecast on the same return grid
+        self.variance_filter        = variance_filter
+        self.filter_states          = dict()
+        self.frequency_ns           = pd.Timedelta(self.resample_option).value
+        self.model_prices           = None
+        self.model_index            = None
+        self.return_buffers         = dict()
+        
+        # Forecasts of cold fits are shared with other strategies over the same model through a ForecastCache
+        self.forecast_cache         = forecast_cache
+        self.forecast_key           = None
+        
+        # Forecasts computed ahead of the simulation (see ForecastPrecompute), read instead of fitting
+        self.set_forecast_table(forecast_table)
 
         
     #####################################
@@ -69,26 +103,190 @@ class AutoRegressiveStrategy:
         
     def generate_model_forecast(self,timepoint):
         
-            # Compute returns with data_frequency frequency starting at the current timepoint and looking backwards
-            current_data                   = self.model_data.loc[:timepoint].resample(self.resample_option,closed='right',label='right',origin=timepoint).last()      
-            current_data['price_return']   = current_data['quotePrice'].pct_change()
-            current_data         = current_data.dropna(axis=0,subset=['price_return'])
+            if self.forecast_table is not None:
+                model_forecast = ForecastPrecompute.table_forecast(self.forecast_table_arrays,pd.Timestamp(timepoint).value)
+                if model_forecast is not None:
+                    return model_forecast
             
-            ar_model             = arch.univariate.ARX(current_data.price_return[(current_data.index >= (timepoint - pd.Timedelta(str(self.days_ar_model)+' days')))].to_numpy(), lags=1,rescale=True)
-            ar_model.volatility  = arch.univariate.GARCH(p=1,q=1)
+            # Cold fits only depend on the model and timepoint, their forecasts can come from the cache
+            if self.forecast_cache is not None and not self.warm_start and self.refit_every == 1:
+                if self.forecast_key is None:
+                    self.forecast_key = self.forecast_cache.model_key(self)
+                return self.forecast_cache.forecast(self.forecast_key,pd.Timestamp(timepoint).value,lambda: self.fit_forecast(timepoint))
+            return self.fit_forecast(timepoint)
+        
+    def fit_forecast(self,timepoint):
+        
+            # Between refits the variance filter carries the fitted model forward
+            if self.variance_filter and self.model_state is not None and self.model_state['age'] + 1 < self.refit_every:
+                self.model_state['age'] += 1
+                return self.filter_forecast(timepoint)
             
-            res                  = ar_model.fit(update_freq=0, disp="off")
-            scale                = res.scale
+            returns              = self.model_returns(timepoint)
+            res,scale            = self.fit_model(returns,timepoint)
+            if self.variance_filter:
+                self.filter_states = dict()
+                self.seed_filter(timepoint,res,returns*scale)
 
             forecasts            = res.forecast(horizon=1, reindex=False)
 
             return_forecast      = forecasts.mean.to_numpy()[0][-1] / scale
-            sd_forecast          = (forecasts.variance.to_numpy()[0][-1] / np.power(res.scale,2))**0.5 * self.annualization_factor
+            sd_forecast          = (forecasts.variance.to_numpy()[0][-1] / np.power(scale,2))**0.5 * self.annualization_factor
             
             result_dict          = {'return_forecast': return_forecast,
                                     'sd_forecast'    : sd_forecast}            
             return result_dict
         
+    def model_returns(self,timepoint):
+        
+            # Returns with data_frequency frequency ending at the current timepoint and looking backwards, as resampling
+            # model_data up to timepoint from origin=timepoint (last price per period) and taking pct_change would give.
+            # The price of a period is the last one at or before its end, read from the return buffer of the
+            # timepoint's phase on the grid, which only needs the periods since its last forecast
+            time_ns      = pd.Timestamp(timepoint).value
+            window_start = time_ns - pd.Timedelta(str(self.days_ar_model)+' days').value
+            
+            # Periods end at timepoint, or at the end of the period of the last row of model_data before it
+            model_index  = self.model_index_ns()
+            k            = np.searchsorted(model_index,time_ns,side='right')
+            grid_end     = time_ns - self.frequency_ns*((time_ns - model_index[k-1]) // self.frequency_ns) if k > 0 else time_ns
+            n_returns    = (grid_end - window_start) // self.frequency_ns + 1 if grid_end >= window_start else 0
+            
+            buffer       = self.return_buffers.get(time_ns % self.frequency_ns)
+            if buffer is None:
+                buffer   = ReturnBuffer(self.frequency_ns,window_length_ns=time_ns - window_start)
+                self.return_buffers[time_ns % self.frequency_ns] = buffer
+            buffer.extend(grid_end,self.prices_at)
+            
+            prices       = buffer.latest(n_returns + 1)
+            returns      = prices[1:]/prices[:-1] - 1
+            return returns[~np.isnan(returns)]
+        
+    def fit_model(self,returns,timepoint = None):
+        """
+        ARX(1) + GARCH(1,1) fit on returns. Returns the fit (or the previous parameters applied to returns, between
+        refits) and the scale of the returns it was computed on, as arch rescales them to a variance between 0.1 and 10**4.
+        Warm started fits keep the scale of the previous fit, so that its parameters are a valid starting point. They follow 
+        the optimum of the previous fits, which can differ from the one of a cold fit where the likelihood has several local 
+        optima (their loglikelihood is in fit_statistics).
+        """
+        state = self.model_state
+        if state is not None:
+            state['age'] += 1
+            if state['age'] < self.refit_every:
+                ar_model            = arch.univariate.ARX(returns*state['scale'], lags=1, rescale=False)
+                ar_model.volatility = arch.univariate.GARCH(p=1,q=1)
+                return ar_model.fix(state['params']),state['scale']
+            
+        warm  = self.warm_start and state is not None and 0.1 <= np.var(returns*state['scale']) < 10**4
+        start = time.perf_counter()
+        if warm:
+            ar_model            = arch.univariate.ARX(returns*state['scale'], lags=1, rescale=False)
+            ar_model.volatility = arch.univariate.GARCH(p=1,q=1)
+            res                 = ar_model.fit(update_freq=0, disp="off", starting_values=state['params'])
+            scale               = state['scale']
+            # Fall back to a cold fit if the warm one did not converge
+            warm                = res.convergence_flag == 0
+        if not warm:
+            ar_model            = arch.univariate.ARX(returns, lags=1, rescale=True)
+            ar_model.volatility = arch.univariate.GARCH(p=1,q=1)
+            res                 = ar_model.fit(update_freq=0, disp="off")
+            scale               = res.scale
+        
+        self.model_state = {'params': res.params.to_numpy(), 'scale': scale, 'age': 0}
+        self.fit_statistics.append({'time'                 : timepoint,
+                                    'warm_start'           : warm,
+                                    'converged'            : res.convergence_flag == 0,
+                                    'iterations'           : res.optimization_result.nit,
+                                    'function_evaluations' : res.optimization_result.nfev,
+                                    'loglikelihood'        : res.loglikelihood,
+                                    'fit_time'             : time.perf_counter() - start})
+        return res,scale
+    
+    #####################################
+    # Recursive GARCH(1,1) filter between refits
+    # Returns are taken at data_frequency on a grid ending at each forecast's timepoint, so the filter keeps one state
+    # per phase of that grid (e.g. 24 for daily returns checked every hour). A state is seeded by running the fitted
+    # model over the returns window the first time its phase is forecast, and then updated with the returns since.
+    #####################################
+    
+    def seed_filter(self,timepoint,res,returns_scaled):
+        
+        # Last return, residual and conditional variance of a fit (or of the fitted parameters applied to a window), in the fit's scale
+        time_ns = pd.Timestamp(timepoint).value
+        self.filter_states[time_ns % self.frequency_ns] = {'time'     : time_ns,
+                                                           'return'   : returns_scaled[-1],
+                                                           'resid'    : np.asarray(res.resid)[-1],
+                                                           'variance' : np.asarray(res.conditional_volatility)[-1]**2}
+        
+    def filter_forecast(self,timepoint):
+        
+        const,phi,omega,alpha,beta = self.model_state['params']
+        scale                      = self.model_state['scale']
+        time_ns                    = pd.Timestamp(timepoint).value
+        state                      = self.filter_states.get(time_ns % self.frequency_ns)
+        
+        if state is None or state['time'] > time_ns:
+            returns             = self.model_returns(timepoint)
+            ar_model            = arch.univariate.ARX(returns*scale, lags=1, rescale=False)
+            ar_model.volatility = arch.univariate.GARCH(p=1,q=1)
+            self.seed_filter(timepoint,ar_model.fix(self.model_state['params']),returns*scale)
+            state               = self.filter_states[time_ns % self.frequency_ns]
+        else:
+            # Returns of the grid points since the last update
+            grid                = state['time'] + self.frequency_ns*np.arange((time_ns - state['time']) // self.frequency_ns + 1)
+            prices              = self.prices_at(grid)
+            for price_return in (prices[1:]/prices[:-1] - 1)*scale:
+                resid              = price_return - const - phi*state['return']
+                state['variance']  = omega + alpha*state['resid']**2 + beta*state['variance']
+                state['return']    = price_return
+                state['resid']     = resid
+            state['time']       = time_ns
+            
+        return_forecast = (const + phi*state['return']) / scale
+        sd_forecast     = (omega + alpha*state['resid']**2 + beta*state['variance'])**0.5 / scale * self.annualization_factor
+        return {'return_forecast': return_forecast,
+                'sd_forecast'    : sd_forecast}
+    
+    def price_arrays(self):
+        
+        # Times (ns) and prices of model_data, without missing prices as the resampled last price skips them
+        if self.model_prices is None:
+            prices            = self.model_data['quotePrice'].dropna()
+            self.model_prices = (MarketData.epoch_ns(prices.index),prices.to_numpy(dtype=float))
+        return self.model_prices
+    
+    def model_index_ns(self):
+        
+        if self.model_index is None:
+            self.model_index = MarketData.epoch_ns(self.model_data.index)
+        return self.model_index
+        
+    def prices_at(self,times_ns):
+        
+        # Last model price at or before each time
+        model_time,model_price = self.price_arrays()
+        k = np.searchsorted(model_time,times_ns,side='right') - 1
+        return np.where(k >= 0,model_price[np.maximum(k,0)],np.nan)
+        
+    def set_forecast_table(self,forecast_table):
+        
+        # Table of forecasts by time as returned by ForecastPrecompute.precompute_forecasts, or None to fit every forecast
+        self.forecast_table        = forecast_table
+        self.forecast_table_arrays = ForecastPrecompute.table_arrays(forecast_table) if forecast_table is not None else None
+        
+    def fit_summary(self):
+        """
+        Convergence statistics of the fits of the last simulation.
+        """
+        fits = pd.DataFrame(self.fit_statistics,columns=['time','warm_start','converged','iterations','function_evaluations','loglikelihood','fit_time'])
+        return {'fits'                      : len(fits),
+                'warm_started'              : int(fits['warm_start'].sum()),
+                'converged'                 : int(fits['converged'].sum()),
+                'mean_iterations'           : fits['iterations'].mean(),
+                'mean_function_evaluations' : fits['function_evaluations'].mean(),
+                'fit_time'                  : fits['fit_time'].sum()}
+        
     #####################################
     # Check if a rebalance is necessary. 
     # If it is, remove the liquidity and set new ranges
@@ -97,8 +295,8 @@ class AutoRegressiveStrategy:
     def check_strategy(self,current_strat_obs):
         
         model_forecast      = None
-        LIMIT_ORDER_BALANCE = current_strat_obs.liquidity_ranges[1]['token_0'] + current_strat_obs.liquidity_ranges[1]['token_1'] / current_strat_obs.price
-        BASE_ORDER_BALANCE  = current_strat_obs.liquidity_ranges[0]['token_0'] + current_strat_obs.liquidity_ranges[0]['token_1'] / current_strat_obs.price
+        LIMIT_ORDER_BALANCE = ActiveStrategyFramework.labelled_value_in_token_0(current_strat_obs.liquidity_ranges,'limit',current_strat_obs.price)
+        BASE_ORDER_BALANCE  = ActiveStrategyFramework.labelled_value_in_token_0(current_strat_obs.liquidity_ranges,'base',current_strat_obs.price)
         
         if not 'last_vol_check' in current_strat_obs.strategy_info:
             current_strat_obs.strategy_info['last_vol_check'] = current_strat_obs.time
@@ -125,16 +323,15 @@ class AutoRegressiveStrategy:
         # When volatility increases the reset range will be hit
         # Check every hour (60  minutes)
         
-        ar_check_frequency = 60        
         time_since_reset   = current_strat_obs.time - current_strat_obs.strategy_info['last_vol_check']
         
         VOL_REBALANCE    = False
-        if (time_since_reset.total_seconds() / 60) >= ar_check_frequency:
+        if (time_since_reset.total_seconds() / 60) >= self.ar_check_frequency:
             
             current_strat_obs.strategy_info['last_vol_check'] = current_strat_obs.time
             model_forecast                                    = self.generate_model_forecast(current_strat_obs.time)
         
-            if model_forecast['sd_forecast']/current_strat_obs.liquidity_ranges[0]['volatility'] <= self.volatility_reset_ratio:
+            if model_forecast['sd_forecast']/ActiveStrategyFramework.labelled_range(current_strat_obs.liquidity_ranges,'base')['volatility'] <= self.volatility_reset_ratio:
                 VOL_REBALANCE = True
             else:
                 VOL_REBALANCE = False
@@ -183,12 +380,58 @@ class AutoRegressiveStrategy:
             return current_strat_obs.liquidity_ranges,current_strat_obs.strategy_info
             
             
+    #####################################
+    # Conditions under which check_strategy cannot rebalance, used by the 
+    # simulator to skip evaluations (see ActiveStrategyFramework.simulate_strategy)
+    # Returns None when the strategy needs to be checked at the next time point
+    #####################################
+    
+    def next_trigger(self,current_strat_obs):
+        
+        strategy_info = current_strat_obs.strategy_info
+        if 'last_vol_check' not in strategy_info or strategy_info.get('force_initial_reset',False):
+            return None
+        
+        price_lower = strategy_info['reset_range_lower']
+        price_upper = strategy_info['reset_range_upper']
+        if not price_lower > 0.0:
+            return None
+        
+        # Tokens outside of the pool can only trigger if they exceed tokens_outside_reset of the
+        # smallest value the positions can take in the reset range. Token 0 amounts fall and 
+        # token 1 amounts rise with the tick, so evaluate each at the unfavourable end of the range.
+        tick_lower        = math.floor(math.log(current_strat_obs.decimal_adjustment*price_lower,1.0001))
+        tick_upper        = math.floor(math.log(current_strat_obs.decimal_adjustment*price_upper,1.0001))
+        min_balance       = 0.0
+        for liquidity_range in current_strat_obs.liquidity_ranges:
+            amount_0,_    = UNI_v3_funcs.get_amounts(tick_upper,liquidity_range['lower_bin_tick'],liquidity_range['upper_bin_tick'],
+                                                     liquidity_range['position_liquidity'],current_strat_obs.decimals_0,current_strat_obs.decimals_1,tick_spacing=current_strat_obs.tickSpacing)
+            _,amount_1    = UNI_v3_funcs.get_amounts(tick_lower,liquidity_range['lower_bin_tick'],liquidity_range['upper_bin_tick'],
+                                                     liquidity_range['position_liquidity'],current_strat_obs.decimals_0,current_strat_obs.decimals_1,tick_spacing=current_strat_obs.tickSpacing)
+            min_balance  += amount_0 + amount_1 / price_upper
+        max_left_over     = current_strat_obs.token_0_left_over + current_strat_obs.token_1_left_over / price_lower
+        
+        # Small margin for rounding in the amount computations
+        if max_left_over > self.tokens_outside_reset * min_balance * (1 - 1e-9):
+            return None
+        
+        return {'price_lower' : price_lower,
+                'price_upper' : price_upper,
+                'tick_lower'  : tick_lower,
+                'tick_upper'  : tick_upper,
+                'time'        : strategy_info['last_vol_check'] + pd.Timedelta(minutes=self.ar_check_frequency)}
+            
     def set_liquidity_ranges(self,current_strat_obs,model_forecast = None):
         
         ###########################################################
         # STEP 1: Do calculations required to determine base liquidity bounds
         ###########################################################
         
+        # A new simulation starts without the previous one's fit
+        if current_strat_obs.strategy_info is None:
+            self.model_state    = None
+            self.fit_statistics = []
+            
         # Fit model
         if model_forecast is None:
             model_forecast = self.generate_model_forecast(current_strat_obs.time)
@@ -196,7 +439,7 @@ class AutoRegressiveStrategy:
         if current_strat_obs.strategy_info is None:
             strategy_info_here = dict()
         else:
-            strategy_info_here = copy.deepcopy(current_strat_obs.strategy_info)
+            strategy_info_here = dict(current_strat_obs.strategy_info)
             
         # Limit return prediction to a return_forecast_cutoff % change
         if np.abs(model_forecast['return_forecast']) > self.return_forecast_cutoff:
@@ -205,7 +448,7 @@ class AutoRegressiveStrategy:
         # If error in volatility computation use last or overall standard deviation of returns
         if np.isnan(model_forecast['sd_forecast']):
             if hasattr(current_strat_obs,'liquidity_ranges'):
-                model_forecast['sd_forecast']  = current_strat_obs.liquidity_ranges[0]['volatility']
+                model_forecast['sd_forecast']  = ActiveStrategyFramework.labelled_range(current_strat_obs.liquidity_ranges,'base')['volatility']
             else:
                 model_forecast['sd_forecast'] = self.model_data.quotePrice.pct_change().std()
 
@@ -252,10 +495,10 @@ class AutoRegressiveStrategy:
             TICK_B = TICK_A + current_strat_obs.tickSpacing
         
         liquidity_placed_base   = int(UNI_v3_funcs.get_liquidity(current_strat_obs.price_tick_current,TICK_A,TICK_B,current_strat_obs.liquidity_in_0, \
-                                                                       current_strat_obs.liquidity_in_1,current_strat_obs.decimals_0,current_strat_obs.decimals_1))
+                                                                       current_strat_obs.liquidity_in_1,current_strat_obs.decimals_0,current_strat_obs.decimals_1,tick_spacing=current_strat_obs.tickSpacing))
         
         base_amount_0_placed,base_amount_1_placed   = UNI_v3_funcs.get_amounts(current_strat_obs.price_tick_current,TICK_A,TICK_B,liquidity_placed_base\
-                                                                 ,current_strat_obs.decimals_0,current_strat_obs.decimals_1)
+                                                                 ,current_strat_obs.decimals_0,current_strat_obs.decimals_1,tick_spacing=current_strat_obs.tickSpacing)
         
         total_token_0_amount  -= base_amount_0_placed
         total_token_1_amount  -= base_amount_1_placed
@@ -325,9 +568,9 @@ class AutoRegressiveStrategy:
                 TICK_B -= current_strat_obs.tickSpacing
 
         liquidity_placed_limit                      = int(UNI_v3_funcs.get_liquidity(current_strat_obs.price_tick_current,TICK_A,TICK_B, \
-                                                                       limit_amount_0,limit_amount_1,current_strat_obs.decimals_0,current_strat_obs.decimals_1))
+                                                                       limit_amount_0,limit_amount_1,current_strat_obs.decimals_0,current_strat_obs.decimals_1,tick_spacing=current_strat_obs.tickSpacing))
         limit_amount_0_placed,limit_amount_1_placed =     UNI_v3_funcs.get_amounts(current_strat_obs.price_tick_current,TICK_A,TICK_B,\
-                                                                     liquidity_placed_limit,current_strat_obs.decimals_0,current_strat_obs.decimals_1)  
+                                                                     liquidity_placed_limit,current_strat_obs.decimals_0,current_strat_obs.decimals_1,tick_spacing=current_strat_obs.tickSpacing)  
 
 
         limit_liq_range =       {'price'              : current_strat_obs.price,
@@ -372,18 +615,20 @@ class AutoRegressiveStrategy:
             this_data['price']                  = strategy_observation.price
             this_data['reset_point']            = strategy_observation.reset_point
             this_data['reset_reason']           = strategy_observation.reset_reason
-            this_data['volatility']             = strategy_observation.liquidity_ranges[0]['volatility']
-            this_data['return_forecast']        = strategy_observation.liquidity_ranges[0]['return_forecast']
+            base_range                          = ActiveStrategyFramework.labelled_range(strategy_observation.liquidity_ranges,'base')
+            limit_range                         = ActiveStrategyFramework.labelled_range(strategy_observation.liquidity_ranges,'limit')
+            this_data['volatility']             = base_range['volatility']
+            this_data['return_forecast']        = base_range['return_forecast']
             
             
             # Range Variables
-            this_data['base_range_lower']       = strategy_observation.liquidity_ranges[0]['lower_bin_price']
-            this_data['base_range_upper']       = strategy_observation.liquidity_ranges[0]['upper_bin_price']
-            this_data['limit_range_lower']      = strategy_observation.liquidity_ranges[1]['lower_bin_price']
-            this_data['limit_range_upper']      = strategy_observation.liquidity_ranges[1]['upper_bin_price']
+            this_data['base_range_lower']       = base_range['lower_bin_price']
+            this_data['base_range_upper']       = base_range['upper_bin_price']
+            this_data['limit_range_lower']      = limit_range['lower_bin_price'] if limit_range is not None else np.nan
+            this_data['limit_range_upper']      = limit_range['upper_bin_price'] if limit_range is not None else np.nan
             this_data['reset_range_lower']      = strategy_observation.strategy_info['reset_range_lower']
             this_data['reset_range_upper']      = strategy_observation.strategy_info['reset_range_upper']
-            this_data['price_at_reset']         = strategy_observation.liquidity_ranges[0]['price']
+            this_data['price_at_reset']         = base_range['price']
             
             # Fee Varaibles
             this_data['token_0_fees']                 = strategy_observation.token_0_fees 
@@ -395,11 +640,7 @@ class AutoRegressiveStrategy:
             this_data['token_0_left_over']      = strategy_observation.token_0_left_over
             this_data['token_1_left_over']      = strategy_observation.token_1_left_over
             
-            total_token_0 = 0.0
-            total_token_1 = 0.0
-            for i in range(len(strategy_observation.liquidity_ranges)):
-                total_token_0 += strategy_observation.liquidity_ranges[i]['token_0']
-                total_token_1 += strategy_observation.liquidity_ranges[i]['token_1']
+            total_token_0,total_token_1         = ActiveStrategyFramework.allocated_amounts(strategy_observation.liquidity_ranges)
                 
             this_data['token_0_allocated']      = total_token_0
             this_data['token_1_allocated']      = total_token_1
@@ -411,7 +652,40 @@ class AutoRegressiveStrategy:
             this_data['value_allocated_in_token_0']        = this_data['token_0_allocated'] + this_data['token_1_allocated'] / this_data['price']
             this_data['value_left_over_in_token_0']        = this_data['token_0_left_over'] + this_data['token_1_left_over'] / this_data['price']
             
-            this_data['base_position_value_in_token_0']    = strategy_observation.liquidity_ranges[0]['token_0'] + strategy_observation.liquidity_ranges[0]['token_1'] / this_data['price']
-            this_data['limit_position_value_in_token_0']   = strategy_observation.liquidity_ranges[1]['token_0'] + strategy_observation.liquidity_ranges[1]['token_1'] / this_data['price']
+            this_data['base_position_value_in_token_0']    = ActiveStrategyFramework.labelled_value_in_token_0(strategy_observation.liquidity_ranges,'base',this_data['price'])
+            this_data['limit_position_value_in_token_0']   = ActiveStrategyFramework.labelled_value_in_token_0(strategy_observation.liquidity_ranges,'limit',this_data['price'])
              
-            return this_data
\ No newline at end of file
+            return this_data
+
+
+class ReturnBuffer:
+    """
+    Model prices at the end of every data_frequency period of one phase of the return grid, the latest
+    ones covering days_ar_model in a ring. extend(end,prices_at) moves the grid forward to end, looking up only the
+    prices of the new periods, or all of them when the grid moved further back or forward than the ring holds.
+    """
+    def __init__(self,frequency_ns,window_length_ns):
+        
+        self.frequency_ns = frequency_ns
+        self.capacity     = window_length_ns // frequency_ns + 2
+        self.prices       = np.full(self.capacity,np.nan)
+        self.head         = 0
+        self.end          = None
+        
+    def extend(self,end,prices_at):
+        
+        n_new = (end - self.end) // self.frequency_ns if self.end is not None else self.capacity
+        if n_new == 0:
+            return
+        if n_new < 0 or n_new >= self.capacity:
+            self.head   = 0
+            n_new       = self.capacity
+        times                                                     = end - self.frequency_ns*np.arange(n_new-1,-1,-1)
+        self.prices[(self.head + np.arange(n_new)) % self.capacity] = prices_at(times)
+        self.head                                                 = (self.head + n_new) % self.capacity
+        self.end                                                  = end
+        
+    def latest(self,n):
+        
+        # Last n prices in time order
+        return self.prices[(self.head + np.arange(self.capacity - n,self.capacity)) % self.capacity]
@@ -0,0 +1,280 @@
+import numpy as np
+
+import ActiveStrategyFramework
+import MarketData
+import SimulationResults
+import UNI_v3_funcs
+
+########################################################
+# Lockstep simulation of many strategies (e.g. one per parameter set of a grid) over one pass of market data.
+# All members share one MarketData. Their next_trigger bounds are kept as arrays with one entry per member,
+# so finding the next step at which any member has to be evaluated is one array operation over
+# (steps x members) blocks. Only the members due at that step run their strategy logic.
+# Members whose strategy has no next_trigger (or returns None) are evaluated at every step.
+#
+# The ranges of all members are held as (members x ranges) arrays of ticks and liquidity (members with
+# fewer ranges are padded with empty ones). Between two steps at which members are due no range changes,
+# so the fees and position amounts of all members over those steps are computed with one
+# compute_swap_fees and one get_amounts_array call, and written into (steps x members) result arrays
+# that every member's SimulationResults views. A fee_model (e.g. FeeGrowthIndex) works on one set of
+# ranges at a time, so with one the fees are computed member by member.
+########################################################
+
+# Bound on swaps x members x ranges of the arrays computed at once
+MAX_BLOCK_SIZE = 2**22
+
+def simulate_batch(price_data,swap_data,strategies,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,market_data=None,fee_model=None):
+    """
+    Simulates every strategy in strategies from the same market data. Initial liquidities can be scalars or one value per strategy.
+    Returns a list with one SimulationResults per strategy, to be used with ActiveStrategyFramework.generate_simulation_series.
+    """
+    if market_data is None:
+        market_data = MarketData.MarketData(price_data,swap_data,fee_tier,decimals_0,decimals_1)
+
+    batch = BatchSimulation(strategies,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,market_data,fee_model)
+    batch.run()
+    return batch.value()
+
+class BatchSimulation:
+    def __init__(self,strategies,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,market_data,fee_model=None):
+
+        n_members           = len(strategies)
+        n_steps             = len(market_data)
+        self.strategies     = list(strategies)
+        self.liquidity_in_0 = np.broadcast_to(np.asarray(liquidity_in_0,dtype=float),(n_members,))
+        self.liquidity_in_1 = np.broadcast_to(np.asarray(liquidity_in_1,dtype=float),(n_members,))
+        self.fee_tier       = fee_tier
+        self.decimals_0     = decimals_0
+        self.decimals_1     = decimals_1
+        self.market_data    = market_data
+        self.fee_model      = fee_model
+
+        # Last observation, range state and results of every member
+        self.previous       = [None]*n_members
+        self.range_state    = [None]*n_members
+        self.evaluated      = np.zeros((n_steps,n_members),dtype=bool)
+        self.results        = [SimulationResults.SimulationResults(market_data,0) for k in range(n_members)]
+
+        # Ranges of every member (members x ranges), empty ranges have lower tick > upper tick and no liquidity
+        self.lower_bin_tick           = np.ones((n_members,0),dtype=np.int64)
+        self.upper_bin_tick           = np.zeros((n_members,0),dtype=np.int64)
+        self.position_liquidity       = np.zeros((n_members,0),dtype=object)
+        self.position_liquidity_float = np.zeros((n_members,0))
+        self.n_ranges                 = np.zeros(n_members,dtype=np.int64)
+
+        # Fees and range amounts (steps x members), viewed by the members' results
+        self.token_0_fees             = np.zeros((n_steps,n_members))
+        self.token_1_fees             = np.zeros((n_steps,n_members))
+        self.token_0_fees_uncollected = np.zeros((n_steps,n_members))
+        self.token_1_fees_uncollected = np.zeros((n_steps,n_members))
+        self.range_token_0            = np.zeros((n_steps,n_members,0))
+        self.range_token_1            = np.zeros((n_steps,n_members,0))
+        self.bind_results()
+
+        # next_trigger bounds of every member
+        self.price_lower    = np.full(n_members,-np.inf)
+        self.price_upper    = np.full(n_members, np.inf)
+        self.tick_lower     = np.full(n_members,-np.inf)
+        self.tick_upper     = np.full(n_members, np.inf)
+        self.time           = np.full(n_members,np.iinfo(np.int64).max)
+        self.every_step     = np.zeros(n_members,dtype=bool)
+
+    def run(self):
+
+        # All members are evaluated at the first step
+        due = np.arange(len(self.strategies))
+        i   = 0
+        while i < len(self.market_data):
+            for k in due:
+                current = self.evaluate(k,i)
+                self.set_trigger(k,current)
+            last = i
+            i    = self.next_due_step(i+1)
+            # Fees and amounts of all members up to the next due step, before the due members read them
+            self.accrue(last+1,min(i+1,len(self.market_data)))
+            due  = np.flatnonzero(self.due_mask(i,i+1)[0]) if i < len(self.market_data) else []
+
+    def value(self):
+
+        # Carry the state of the evaluated steps of every member to its other steps
+        for k,strategy_results in enumerate(self.results):
+            strategy_results.fill_forward(self.evaluated[:,k])
+        return self.results
+
+    ######################################
+    # Strategy logic of one member
+    ######################################
+    def evaluate(self,k,i):
+
+        market_data = self.market_data
+        previous    = self.previous[k]
+        if previous is None:
+            current = ActiveStrategyFramework.next_observation(market_data,i,None,self.strategies[k],float(self.liquidity_in_0[k]),float(self.liquidity_in_1[k]),
+                                                               self.fee_tier,self.decimals_0,self.decimals_1,self.fee_model)
+        else:
+            current = ActiveStrategyFramework.StrategyObservation(market_data.index[i],
+                                                                  market_data.price[i],
+                                                                  self.strategies[k],
+                                                                  previous.liquidity_in_0,
+                                                                  previous.liquidity_in_1,
+                                                                  previous.fee_tier,
+                                                                  previous.decimals_0,
+                                                                  previous.decimals_1,
+                                                                  previous.token_0_left_over,
+                                                                  previous.token_1_left_over,
+                                                                  self.token_0_fees_uncollected[i,k],
+                                                                  self.token_1_fees_uncollected[i,k],
+                                                                  liquidity_ranges   = previous.liquidity_ranges,
+                                                                  strategy_info      = previous.strategy_info,
+                                                                  price_tick         = market_data.price_tick[i],
+                                                                  price_tick_current = market_data.price_tick_current[i],
+                                                                  fee_model          = previous.fee_model)
+
+        # The batch arrays take the member's ranges whenever they change
+        current_state = SimulationResults.ranges_state(current.liquidity_ranges)
+        if self.range_state[k] is None or not SimulationResults.same_state(current_state,self.range_state[k]):
+            self.set_ranges(k,current.liquidity_ranges)
+            self.range_state[k] = current_state
+
+        # Fees of step i were accrued with the batch, uncollected fees are the ones left after the strategy
+        self.results[k].record(i,current,fees=False)
+        self.token_0_fees_uncollected[i,k] = current.token_0_fees_uncollected
+        self.token_1_fees_uncollected[i,k] = current.token_1_fees_uncollected
+        self.evaluated[i,k] = True
+        self.previous[k]    = current
+        return current
+
+    def set_ranges(self,k,liquidity_ranges):
+
+        lower_bin_tick,upper_bin_tick,position_liquidity = ActiveStrategyFramework.range_columns(liquidity_ranges)
+        n_ranges = len(lower_bin_tick)
+        if n_ranges > self.lower_bin_tick.shape[1]:
+            self.grow_ranges(n_ranges)
+
+        self.lower_bin_tick[k]                      = 1
+        self.upper_bin_tick[k]                      = 0
+        self.position_liquidity[k]                  = 0
+        self.position_liquidity_float[k]            = 0.0
+        self.lower_bin_tick[k,:n_ranges]            = lower_bin_tick
+        self.upper_bin_tick[k,:n_ranges]            = upper_bin_tick
+        self.position_liquidity[k,:n_ranges]        = list(position_liquidity)
+        self.position_liquidity_float[k,:n_ranges]  = UNI_v3_funcs.liquidity_float_array(position_liquidity)
+        self.n_ranges[k]                            = n_ranges
+
+    def grow_ranges(self,n_ranges):
+
+        extra                         = n_ranges - self.lower_bin_tick.shape[1]
+        self.lower_bin_tick           = np.pad(self.lower_bin_tick,((0,0),(0,extra)),constant_values=1)
+        self.upper_bin_tick           = np.pad(self.upper_bin_tick,((0,0),(0,extra)),constant_values=0)
+        self.position_liquidity       = np.pad(self.position_liquidity,((0,0),(0,extra)),constant_values=0)
+        self.position_liquidity_float = np.pad(self.position_liquidity_float,((0,0),(0,extra)))
+        self.range_token_0            = np.pad(self.range_token_0,((0,0),(0,0),(0,extra)))
+        self.range_token_1            = np.pad(self.range_token_1,((0,0),(0,0),(0,extra)))
+        self.bind_results()
+
+    def bind_results(self):
+
+        # Members' results are views of the batch arrays
+        for k,strategy_results in enumerate(self.results):
+            strategy_results.token_0_fees             = self.token_0_fees[:,k]
+            strategy_results.token_1_fees             = self.token_1_fees[:,k]
+            strategy_results.token_0_fees_uncollected = self.token_0_fees_uncollected[:,k]
+            strategy_results.token_1_fees_uncollected = self.token_1_fees_uncollected[:,k]
+            strategy_results.range_token_0            = self.range_token_0[:,k]
+            strategy_results.range_token_1            = self.range_token_1[:,k]
+
+    ######################################
+    # Fees and amounts of all members
+    ######################################
+    def accrue(self,start,stop):
+        """
+        Fees and range amounts of every member at steps start to stop-1, in which their ranges are fixed.
+        Steps are taken in blocks of at most MAX_BLOCK_SIZE swaps x members x ranges.
+        """
+        market_data = self.market_data
+        block_size  = max(MAX_BLOCK_SIZE // max(self.position_liquidity_float.size,1),1)
+        while start < stop:
+            # Steps whose swaps fit in a block, at least one
+            block_stop = int(np.searchsorted(market_data.swap_stop,market_data.swap_start[start] + block_size,side='right'))
+            block_stop = min(max(block_stop,start+1),stop)
+            self.accrue_block(start,block_stop)
+            start      = block_stop
+
+    def accrue_block(self,start,stop):
+
+        market_data                 = self.market_data
+        token_0_fees,token_1_fees   = self.span_fees(start,stop)
+
+        # Cumulated in order, as adding the fees step by step would
+        self.token_0_fees[start:stop]             = token_0_fees
+        self.token_1_fees[start:stop]             = token_1_fees
+        self.token_0_fees_uncollected[start:stop] = np.cumsum(np.r_[self.token_0_fees_uncollected[start-1:start],token_0_fees],axis=0)[1:]
+        self.token_1_fees_uncollected[start:stop] = np.cumsum(np.r_[self.token_1_fees_uncollected[start-1:start],token_1_fees],axis=0)[1:]
+
+        # Range amounts (steps x members x ranges)
+        liquidity = self.position_liquidity if UNI_v3_funcs.TICK_MATH == 'exact' else self.position_liquidity_float
+        self.range_token_0[start:stop],self.range_token_1[start:stop] = UNI_v3_funcs.get_amounts_array(market_data.price_tick_current[start:stop,None,None],
+                                                                                                      self.lower_bin_tick[None],self.upper_bin_tick[None],
+                                                                                                      liquidity[None],self.decimals_0,self.decimals_1)
+
+    def span_fees(self,start,stop):
+
+        # Fees of every member in steps start to stop-1 (steps x members)
+        market_data = self.market_data
+        if self.fee_model is not None:
+            fees = [ActiveStrategyFramework.span_fees(market_data,start,stop,self.lower_bin_tick[k,:n],self.upper_bin_tick[k,:n],self.position_liquidity[k,:n],
+                                                      self.fee_tier,self.fee_model) for k,n in enumerate(self.n_ranges)]
+            return np.stack([x[0] for x in fees],axis=1),np.stack([x[1] for x in fees],axis=1)
+
+        swap_start  = market_data.swap_start[start]
+        swap_stop   = market_data.swap_stop[stop-1]
+        swap_fees   = ActiveStrategyFramework.compute_swap_fees(market_data.tick_swap[swap_start:swap_stop],
+                                                                market_data.virtual_liquidity[swap_start:swap_stop],
+                                                                market_data.traded_in[swap_start:swap_stop],
+                                                                self.lower_bin_tick,self.upper_bin_tick,self.position_liquidity_float,self.fee_tier)
+        token_0_in  = market_data.token_0_in[swap_start:swap_stop,None]
+        return (market_data.window_sums(np.where(token_0_in,swap_fees,0.0),start,stop),
+                market_data.window_sums(np.where(token_0_in,0.0,swap_fees),start,stop))
+
+    ######################################
+    # Steps at which members are due
+    ######################################
+    def set_trigger(self,k,observation):
+
+        strategy_in = self.strategies[k]
+        trigger     = strategy_in.next_trigger(observation) if hasattr(strategy_in,'next_trigger') else None
+        if trigger is None:
+            self.every_step[k] = True
+            return
+
+        self.every_step[k]  = False
+        self.price_lower[k] = trigger.get('price_lower',-np.inf)
+        self.price_upper[k] = trigger.get('price_upper', np.inf)
+        self.tick_lower[k]  = trigger['tick_lower'] if trigger.get('tick_lower') is not None else -np.inf
+        self.tick_upper[k]  = trigger['tick_upper'] if trigger.get('tick_upper') is not None else  np.inf
+        self.time[k]        = MarketData.epoch_ns([trigger['time']])[0] if trigger.get('time') is not None else np.iinfo(np.int64).max
+
+    def due_mask(self,start,stop):
+
+        # (steps x members) mask of the members whose bounds are left at each step
+        price = self.market_data.price[start:stop,None]
+        tick  = self.market_data.price_tick_current[start:stop,None]
+        time  = self.market_data.time[start:stop,None]
+        return self.every_step[None,:] | (price < self.price_lower) | (price > self.price_upper) | \
+               (tick < self.tick_lower) | (tick > self.tick_upper) | (time >= self.time)
+
+    def next_due_step(self,start):
+
+        # First step from start on at which any member is due, searching in growing blocks
+        if self.every_step.any():
+            return start
+        block = 16
+        i     = start
+        while i < len(self.market_data):
+            stop = min(len(self.market_data),i+block)
+            due  = self.due_mask(i,stop).any(axis=1)
+            if due.any():
+                return i + int(np.argmax(due))
+            i      = stop
+            block *= 2
+        return len(self.market_data)
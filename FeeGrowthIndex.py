@@ -0,0 +1,129 @@
+import numpy as np
+
+import TickMath
+import UNI_v3_funcs
+
+########################################################
+# Fee growth index over the swaps of a MarketData object.
+# In the spirit of Uniswap v3's feeGrowthGlobal / feeGrowthInside accumulators, every swap adds
+# fee_tier*traded_in/virtual_liquidity of fees per unit of liquidity at the tick it happens, so the
+# fees of a range with liquidity L over a window of swaps are L times the fee growth inside the range.
+# This replaces the L/(L+virtual_liquidity) share of the proportional model by L/virtual_liquidity,
+# which is accurate while positions are small compared to the pool liquidity. Swaps without virtual
+# liquidity give the whole fee to in range positions, as in the proportional model.
+#
+# Swaps are split in blocks of block_size (in time order) and each block is sorted by tick with
+# cumulative sums, so the fees of a range over any window of swaps take one binary search per
+# block plus a scan of the swaps in the partial blocks at both ends.
+#
+# Can be passed to simulate_strategy as fee_model, and reused across simulations of the same MarketData.
+########################################################
+
+# Sorted ticks of all blocks are kept in one array, keyed by block*TICK_KEY_SPAN + tick - MIN_TICK
+TICK_KEY_SPAN = TickMath.MAX_TICK - TickMath.MIN_TICK + 1
+
+class FeeGrowthIndex:
+    def __init__(self,market_data,block_size = 1024):
+
+        ######################################
+        # 1. Fee growth of every swap, per token swapped in.
+        #    Columns: growth token 0, growth token 1, fees token 0 and fees token 1 of swaps without liquidity
+        ######################################
+
+        self.market_data    = market_data
+        self.block_size     = block_size
+        self.tick_swap      = market_data.tick_swap
+        self.token_0_in     = market_data.token_0_in
+
+        fees                = market_data.fee_tier * market_data.traded_in
+        no_liquidity        = market_data.virtual_liquidity < 1e-9
+        with np.errstate(divide='ignore',invalid='ignore'):
+            growth          = np.where(no_liquidity,0.0,fees/market_data.virtual_liquidity)
+        no_liquidity_fees   = np.where(no_liquidity,fees,0.0)
+
+        self.weights        = np.stack([np.where(self.token_0_in,growth,0.0),
+                                        np.where(self.token_0_in,0.0,growth),
+                                        np.where(self.token_0_in,no_liquidity_fees,0.0),
+                                        np.where(self.token_0_in,0.0,no_liquidity_fees)],axis=1)
+
+        ######################################
+        # 2. Full blocks sorted by tick, with cumulative weights (leading zero per block)
+        ######################################
+
+        self.n_blocks       = len(self.tick_swap) // block_size
+        n_indexed           = self.n_blocks * block_size
+        block_ticks         = self.tick_swap[:n_indexed].reshape(self.n_blocks,block_size)
+        order               = np.argsort(block_ticks,axis=1,kind='stable')
+        sorted_ticks        = np.take_along_axis(block_ticks,order,axis=1)
+        sorted_weights      = np.take_along_axis(self.weights[:n_indexed].reshape(self.n_blocks,block_size,4),order[:,:,None],axis=1)
+
+        self.block_keys     = (np.arange(self.n_blocks,dtype=np.int64)[:,None]*TICK_KEY_SPAN + sorted_ticks - TickMath.MIN_TICK).ravel()
+        self.block_cumsum   = np.concatenate([np.zeros((self.n_blocks,1,4)),np.cumsum(sorted_weights,axis=1)],axis=1)
+
+    def growth_inside(self,swap_start,swap_stop,tick_lower,tick_upper):
+        """
+        Fee growth of the swaps swap_start to swap_stop-1 with tick in [tick_lower,tick_upper], as an array with
+        the growth of token 0 and token 1 and the fees of token 0 and token 1 of swaps without liquidity.
+        tick_lower and tick_upper can be arrays of ranges, which gives one row per range.
+        """
+        scalar      = np.ndim(tick_lower) == 0
+        (tick_lower,tick_upper) = (np.atleast_1d(tick_lower).astype(np.int64),np.atleast_1d(tick_upper).astype(np.int64))
+        (tick_lower,tick_upper) = (np.maximum(np.minimum(tick_lower,tick_upper),TickMath.MIN_TICK),
+                                   np.minimum(np.maximum(tick_lower,tick_upper),TickMath.MAX_TICK))
+
+        first_block = -(-swap_start // self.block_size)
+        last_block  = min(swap_stop // self.block_size,self.n_blocks)
+        if first_block >= last_block:
+            growth  = self.scan(swap_start,swap_stop,tick_lower,tick_upper)
+            return growth[0] if scalar else growth
+
+        growth      = self.scan(swap_start,first_block*self.block_size,tick_lower,tick_upper) + \
+                      self.scan(last_block*self.block_size,swap_stop,tick_lower,tick_upper)
+
+        # blocks x ranges positions of the range bounds in every sorted block
+        blocks      = np.arange(first_block,last_block,dtype=np.int64)[:,None]
+        block_base  = blocks*TICK_KEY_SPAN - TickMath.MIN_TICK
+        lower       = np.searchsorted(self.block_keys,block_base + tick_lower[None,:],side='left')  - blocks*self.block_size
+        upper       = np.searchsorted(self.block_keys,block_base + tick_upper[None,:],side='right') - blocks*self.block_size
+        growth      = growth + (self.block_cumsum[blocks,upper] - self.block_cumsum[blocks,lower]).sum(axis=0)
+        return growth[0] if scalar else growth
+
+    def scan(self,swap_start,swap_stop,tick_lower,tick_upper):
+
+        if swap_stop <= swap_start:
+            return np.zeros((len(tick_lower),4))
+        tick_swap = self.tick_swap[swap_start:swap_stop,None]
+        in_range  = (tick_swap >= tick_lower[None,:]) & (tick_swap <= tick_upper[None,:])
+        return in_range.T.astype(float) @ self.weights[swap_start:swap_stop]
+
+    ########################################################
+    # Fee model interface, used by StrategyObservation.accrue_fees
+    # and the bulk fee computations of simulate_strategy
+    ########################################################
+    def range_fees(self,swap_start,swap_stop,lower_bin_tick,upper_bin_tick,position_liquidity):
+        """
+        Fees of token 0 and token 1 earned by a set of ranges in the swaps swap_start to swap_stop-1.
+        """
+        if len(lower_bin_tick) == 0:
+            return 0.0,0.0
+        # All ranges at once, ranges x (growth 0, growth 1, fees 0, fees 1)
+        growth             = self.growth_inside(swap_start,swap_stop,np.asarray(lower_bin_tick),np.asarray(upper_bin_tick))
+        position_liquidity = UNI_v3_funcs.liquidity_float_array(position_liquidity)
+        fees_token_0       = np.sum(position_liquidity*growth[:,0] + growth[:,2])
+        fees_token_1       = np.sum(position_liquidity*growth[:,1] + growth[:,3])
+        return float(fees_token_0),float(fees_token_1)
+
+    def swap_fees(self,swap_start,swap_stop,lower_bin_tick,upper_bin_tick,position_liquidity):
+        """
+        Fees earned by a set of ranges in each of the swaps swap_start to swap_stop-1, in units of the token swapped in.
+        """
+        tick_swap          = self.tick_swap[swap_start:swap_stop,None]
+        weights            = self.weights[swap_start:swap_stop]
+        lower_bin_tick     = np.asarray(lower_bin_tick)[None,:]
+        upper_bin_tick     = np.asarray(upper_bin_tick)[None,:]
+        position_liquidity = UNI_v3_funcs.liquidity_float_array(position_liquidity)[None,:]
+
+        in_range           = (np.minimum(lower_bin_tick,upper_bin_tick) <= tick_swap) & (np.maximum(lower_bin_tick,upper_bin_tick) >= tick_swap)
+        growth             = (weights[:,0] + weights[:,1])[:,None]
+        no_liquidity_fees  = (weights[:,2] + weights[:,3])[:,None]
+        return (in_range * (position_liquidity*growth + no_liquidity_fees)).sum(axis=1)
@@ -0,0 +1,122 @@
+import collections
+import hashlib
+import os
+import sys
+
+import SimulationCache
+
+########################################################
+# Cache of AutoRegressiveStrategy forecasts, shared by strategy instances and worker processes.
+# A forecast (return_forecast, sd_forecast) only depends on the model data, the timepoint and the
+# model options (data_frequency, days_ar_model, z_score_cutoff), not on alpha_param, tau_param or
+# volatility_reset_ratio, so the strategies of a parameter sweep over those fit every model once.
+# Entries are keyed by a hash of the model (see model_key) and the timepoint. Only forecasts of cold fits
+# are cached, as warm starts and refit_every make them depend on the previous fits.
+#
+# Up to max_entries forecasts are kept in memory, the least recently used ones are dropped first.
+# With a directory, forecasts are also appended to one log file per model, which other processes
+# (e.g. the workers of ParameterSweep, which get a copy of the cache through strategy_factory) read
+# before fitting a model themselves.
+########################################################
+
+# Bump when the log format or the model key changes
+FORECAST_FORMAT = 1
+
+class ForecastCache:
+    # The cache does not change forecasts, so SimulationCache keys of strategies holding it do not hash its entries
+    hash_as_type = True
+
+    def __init__(self,max_entries = 2**18,directory = None):
+
+        self.max_entries = max_entries
+        self.directory   = directory
+        self.entries     = collections.OrderedDict()
+        self.log_offsets = dict()
+        self.hits        = 0
+        self.misses      = 0
+        if directory is not None:
+            os.makedirs(directory,exist_ok=True)
+
+    def forecast(self,model_key,time_ns,fit_forecast):
+        """
+        Forecast of the model at time_ns (epoch ns) from the cache, or fit_forecast() stored in it.
+        Returns a new dict every time, as set_liquidity_ranges modifies it.
+        """
+        entry = self.get(model_key,time_ns)
+        if entry is None:
+            self.misses += 1
+            result       = fit_forecast()
+            self.put(model_key,time_ns,(float(result['return_forecast']),float(result['sd_forecast'])))
+            return result
+        self.hits += 1
+        return {'return_forecast': entry[0], 'sd_forecast': entry[1]}
+
+    def model_key(self,strategy_in):
+        """
+        Hash of what an AutoRegressiveStrategy's forecasts depend on: its (cleaned) model data, model options
+        and the source of the module fitting them.
+        """
+        arch   = sys.modules.get('arch')
+        digest = hashlib.blake2b(digest_size=20)
+        SimulationCache.update_hash(digest,(FORECAST_FORMAT,SimulationCache.source_fingerprint(type(strategy_in).__module__),
+                                            getattr(arch,'__version__',None)))
+        SimulationCache.update_hash(digest,(strategy_in.model_data,strategy_in.data_frequency,strategy_in.days_ar_model,
+                                            strategy_in.z_score_cutoff))
+        return digest.hexdigest()
+
+    ########################################################
+    # Entries
+    ########################################################
+    def get(self,model_key,time_ns):
+
+        key = (model_key,time_ns)
+        if key not in self.entries and self.directory is not None:
+            self.read_log(model_key)
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self,model_key,time_ns,entry):
+
+        self.store(model_key,time_ns,entry)
+        if self.directory is not None:
+            # One write in append mode, so lines of concurrent processes do not interleave
+            with open(self.log_file(model_key),'a') as f:
+                f.write('{} {!r} {!r}\n'.format(time_ns,entry[0],entry[1]))
+
+    def store(self,model_key,time_ns,entry):
+
+        self.entries[(model_key,time_ns)] = entry
+        self.entries.move_to_end((model_key,time_ns))
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def read_log(self,model_key):
+        """
+        Loads the forecasts appended to the model's log since it was last read.
+        """
+        try:
+            with open(self.log_file(model_key),'rb') as f:
+                f.seek(self.log_offsets.get(model_key,0))
+                data = f.read()
+        except OSError:
+            return
+        # A line still being written by another process is read next time
+        complete = data.rfind(b'\n') + 1
+        self.log_offsets[model_key] = self.log_offsets.get(model_key,0) + complete
+        for line in data[:complete].splitlines():
+            time_ns,return_forecast,sd_forecast = line.split()
+            self.store(model_key,int(time_ns),(float(return_forecast),float(sd_forecast)))
+
+    def log_file(self,model_key):
+        return os.path.join(self.directory,model_key + '.log')
+
+    def clear(self):
+
+        self.entries.clear()
+        self.log_offsets.clear()
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith('.log'):
+                    os.remove(os.path.join(self.directory,name))
@@ -0,0 +1,125 @@
+import concurrent.futures
+import os
+
+import numpy as np
+import pandas as pd
+
+import MarketData
+
+########################################################
+# AutoRegressiveStrategy forecasts computed ahead of a simulation over a process pool.
+# A simulation asks for forecasts at its first step (initial ranges), at the volatility checks and at
+# resets. Volatility checks only depend on the steps of the price data: the first one is
+# ar_check_frequency minutes after the second step, and every next one the first step ar_check_frequency
+# minutes after the previous check, as resets keep last_vol_check in strategy_info (see check_times).
+# precompute_forecasts fits the strategy's model at those times and returns the forecasts as a table
+# indexed by time. A strategy given the table (forecast_table=, or set_forecast_table) reads its forecasts
+# from it in check_strategy and set_liquidity_ranges, and only fits at resets outside the checks.
+#
+# Times are split in contiguous chunks that workers run in order, so consecutive forecasts of a chunk
+# reuse the strategy's return buffers (and warm starts, refit_every and the variance filter if enabled,
+# each chunk starting from a full fit). The strategy is sent once to every worker, with its ForecastCache if any.
+########################################################
+
+def precompute_forecasts(strategy_in,times,start=None,end=None,max_workers=None,chunk_size=None,progress=None,mp_context=None):
+    """
+    Table of strategy_in.generate_model_forecast(t) (return_forecast, sd_forecast) for the first step and volatility
+    checks of a simulation over times (the index of the price data to simulate, from its first step) that fall between
+    start and end, computed by max_workers processes (default: one per CPU).
+    chunk_size consecutive times go to a worker at a time (default: four chunks per worker).
+    progress(completed,total) is called as chunks come in, counting times.
+    """
+    times = check_times(pd.DatetimeIndex(times).unique().sort_values(),strategy_in.ar_check_frequency)
+    if start is not None:
+        times = times[times >= time_bound(start,times.tz)]
+    if end is not None:
+        times = times[times <= time_bound(end,times.tz)]
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(-(-len(times) // (4*max_workers)),1)
+    tasks       = [times[k:k+chunk_size] for k in range(0,len(times),chunk_size)]
+    max_workers = min(max_workers,max(len(tasks),1))
+
+    results   = [None]*len(tasks)
+    completed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers,mp_context=mp_context,initializer=init_worker,initargs=(strategy_in,)) as executor:
+        futures = {executor.submit(forecast_chunk,task): k for k,task in enumerate(tasks)}
+        for future in concurrent.futures.as_completed(futures):
+            k           = futures[future]
+            results[k]  = future.result()
+            completed  += len(tasks[k])
+            if progress is not None:
+                progress(completed,len(times))
+
+    forecasts = np.array([forecast for chunk in results for forecast in chunk],dtype=float).reshape(-1,2)
+    return pd.DataFrame({'return_forecast': forecasts[:,0], 'sd_forecast': forecasts[:,1]},index=times)
+
+def check_times(times,check_frequency):
+    """
+    Times of the first step and of the volatility checks (every check_frequency minutes, see
+    AutoRegressiveStrategy.check_strategy) of a simulation over the sorted times.
+    """
+    times_ns = MarketData.epoch_ns(times)
+    checks   = [0] if len(times) > 0 else []
+    if len(times) > 1:
+        # The second step starts the checks, which then come at the first step check_frequency after the previous one
+        last_check = times_ns[1]
+        k          = 1
+        while True:
+            k = max(k,int(np.searchsorted(times_ns,last_check + pd.Timedelta(minutes=check_frequency).value,side='left')))
+            if k == len(times_ns):
+                break
+            checks.append(k)
+            last_check = times_ns[k]
+            k         += 1
+    return times[checks]
+
+def time_bound(bound,tz):
+
+    # Bounds without a time zone are in the time zone of the times
+    bound = pd.Timestamp(bound)
+    if bound.tz is None and tz is not None:
+        bound = bound.tz_localize(tz)
+    return bound
+
+def table_arrays(forecast_table):
+    """
+    Times (ns), return forecasts and sd forecasts of a forecast table, sorted by time, for lookups with table_forecast.
+    """
+    forecast_table = forecast_table.sort_index()
+    return (MarketData.epoch_ns(forecast_table.index),forecast_table['return_forecast'].to_numpy(dtype=float),
+            forecast_table['sd_forecast'].to_numpy(dtype=float))
+
+def table_forecast(arrays,time_ns):
+    """
+    Forecast of the table at exactly time_ns, or None.
+    """
+    table_time,return_forecast,sd_forecast = arrays
+    k = np.searchsorted(table_time,time_ns)
+    if k == len(table_time) or table_time[k] != time_ns:
+        return None
+    return {'return_forecast': return_forecast[k], 'sd_forecast': sd_forecast[k]}
+
+########################################################
+# Worker side
+########################################################
+
+# Strategy of a worker process, set up once by init_worker
+WORKER_STATE = dict()
+
+def init_worker(strategy_in):
+
+    WORKER_STATE['strategy'] = strategy_in
+
+def forecast_chunk(times):
+
+    # A chunk does not continue the fits of the previous chunk the worker ran
+    strategy_in               = WORKER_STATE['strategy']
+    strategy_in.model_state   = None
+    strategy_in.filter_states = dict()
+    forecasts                 = []
+    for timepoint in times:
+        forecast = strategy_in.generate_model_forecast(timepoint)
+        forecasts.append((forecast['return_forecast'],forecast['sd_forecast']))
+    return forecasts
@@ -107,6 +107,52 @@ def get_pool_data_bigquery(contract_address,date_begin,date_end,decimals_0,decim
 
     return resulting_data
 
+def download_bigquery_liquidity_events_mainnet(contract_address,date_begin,date_end,block_start):
+    """
+    Internal function to query Google Bigquery for the Mint and Burn events of a Uniswap v3 pool between two dates starting from a particular block from Ethereum Mainnet. 
+    Use GetPoolData.get_liquidity_events_bigquery which preprocesses the data in order to build a LiquidityBook.
+    """
+    
+    from google.cloud import bigquery
+    client = bigquery.Client()
+
+    query = """
+            SELECT 'mint' AS event, block_number, block_timestamp, log_index, tickLower, tickUpper, amount
+            FROM blockchain-etl.ethereum_uniswap.UniswapV3Pool_event_Mint
+            where contract_address = lower('"""+contract_address.lower()+"""') and
+              block_timestamp >= '"""+str(date_begin)+"""' and block_timestamp <= '"""+str(date_end)+"""' and block_number >= """+str(block_start)+"""
+            UNION ALL
+            SELECT 'burn' AS event, block_number, block_timestamp, log_index, tickLower, tickUpper, amount
+            FROM blockchain-etl.ethereum_uniswap.UniswapV3Pool_event_Burn
+            where contract_address = lower('"""+contract_address.lower()+"""') and
+              block_timestamp >= '"""+str(date_begin)+"""' and block_timestamp <= '"""+str(date_end)+"""' and block_number >= """+str(block_start)+"""
+            """
+    query_job       = client.query(query)  # Make an API request.
+    return query_job.to_dataframe(create_bqstorage_client=False)
+
+def get_liquidity_events_bigquery(contract_address,date_begin,date_end,network='mainnet',block_start=0):
+    
+    """
+    Queries Google Bigquery for the Mint and Burn events of a Uniswap v3 pool between two dates starting from a particular block.
+    Returns them in order with the liquidity added (mints) or removed (burns) between tick_lower and tick_upper as liquidity_delta.
+    To reconstruct the pool's liquidity with LiquidityBook.LiquidityBook, date_begin has to be the pool's creation date.
+    """
+    
+    if network == 'mainnet':
+        resulting_data                       = download_bigquery_liquidity_events_mainnet(contract_address.lower(),date_begin,date_end,block_start)
+    else:
+        raise ValueError('Unsupported Network:'+network)
+    
+    resulting_data['block_date']            = pd.to_datetime(resulting_data['block_timestamp'])
+    resulting_data                          = resulting_data.sort_values(['block_number','log_index']).set_index('block_date',drop=False)
+
+    resulting_data['tick_lower']            = resulting_data['tickLower'].astype(int)
+    resulting_data['tick_upper']            = resulting_data['tickUpper'].astype(int)
+    resulting_data['liquidity_delta']       = resulting_data['amount'].astype(float)
+    resulting_data.loc[resulting_data['event'] == 'burn','liquidity_delta'] *= -1
+
+    return resulting_data
+
 def signed_int(h):
     """
     Converts hex values to signed integers.
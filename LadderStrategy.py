@@ -0,0 +1,157 @@
+import math
+import numpy as np
+import UNI_v3_funcs
+import ActiveStrategyFramework
+import PositionBook
+
+########################################################
+# Example strategy with many ranges, held in a PositionBook.
+# The position is a ladder of n_ranges adjacent ranges of equal width covering width (relative to the
+# price) below and above the price, or of one tick spacing each centred on the price when width is too
+# narrow for that. Token 0 is split equally among the ranges above the price, token 1
+# among the ranges below it, and the range holding the price gets a share of both.
+# All ranges are labelled 'base', the strategy has no limit range. It rebalances when the price leaves the ladder.
+########################################################
+
+class LadderStrategy:
+    def __init__(self,n_ranges = 50,width = .1):
+
+        self.n_ranges = n_ranges
+        self.width    = width
+
+    #####################################
+    # Check if a rebalance is necessary.
+    # If it is, remove the liquidity and set new ranges
+    #####################################
+
+    def check_strategy(self,current_strat_obs):
+
+        LEFT_RANGE_LOW  = current_strat_obs.price < current_strat_obs.strategy_info['reset_range_lower']
+        LEFT_RANGE_HIGH = current_strat_obs.price > current_strat_obs.strategy_info['reset_range_upper']
+
+        if (LEFT_RANGE_LOW | LEFT_RANGE_HIGH):
+            current_strat_obs.reset_point  = True
+            current_strat_obs.reset_reason = 'exited_range'
+
+            # Remove liquidity and claim fees
+            current_strat_obs.remove_liquidity()
+
+            # Reset liquidity
+            liq_range,strategy_info = self.set_liquidity_ranges(current_strat_obs)
+            return liq_range,strategy_info
+        else:
+            return current_strat_obs.liquidity_ranges,current_strat_obs.strategy_info
+
+    #####################################
+    # Conditions under which check_strategy cannot rebalance, used by the
+    # simulator to skip evaluations (see ActiveStrategyFramework.simulate_strategy)
+    #####################################
+
+    def next_trigger(self,current_strat_obs):
+
+        return {'price_lower' : current_strat_obs.strategy_info['reset_range_lower'],
+                'price_upper' : current_strat_obs.strategy_info['reset_range_upper']}
+
+    def set_liquidity_ranges(self,current_strat_obs):
+
+        if current_strat_obs.strategy_info is None:
+            strategy_info_here = dict()
+        else:
+            strategy_info_here = dict(current_strat_obs.strategy_info)
+
+        ###########################################################
+        # STEP 1: Range edges, on the tick spacing and at least one spacing apart
+        ###########################################################
+
+        tick_spacing       = current_strat_obs.tickSpacing
+        TICK_A             = int(round(math.log(current_strat_obs.decimal_adjustment*current_strat_obs.price*(1 - self.width),1.0001)/tick_spacing)*tick_spacing)
+        TICK_B             = int(round(math.log(current_strat_obs.decimal_adjustment*current_strat_obs.price*(1 + self.width),1.0001)/tick_spacing)*tick_spacing)
+        n_spacings         = (TICK_B - TICK_A) // tick_spacing
+        if n_spacings < self.n_ranges:
+            # Too narrow for a spacing per range, the ladder is n_ranges spacings centred on the price
+            n_spacings     = self.n_ranges
+            TICK_A         = int(current_strat_obs.price_tick // tick_spacing - self.n_ranges // 2)*tick_spacing
+        edges              = TICK_A + tick_spacing*np.round(np.linspace(0,n_spacings,self.n_ranges + 1)).astype(np.int64)
+        lower_bin_tick     = edges[:-1]
+        upper_bin_tick     = edges[1:]
+
+        ###########################################################
+        # STEP 2: Split the tokens among the ranges that hold them and place the liquidity
+        ###########################################################
+
+        above              = lower_bin_tick >= current_strat_obs.price_tick
+        below              = upper_bin_tick <= current_strat_obs.price_tick
+        amount_0           = np.where(below,0.0,current_strat_obs.liquidity_in_0 / max(np.sum(~below),1))
+        amount_1           = np.where(above,0.0,current_strat_obs.liquidity_in_1 / max(np.sum(~above),1))
+
+        position_liquidity = UNI_v3_funcs.get_liquidity_array(current_strat_obs.price_tick,lower_bin_tick,upper_bin_tick,amount_0,amount_1,
+                                                              current_strat_obs.decimals_0,current_strat_obs.decimals_1)
+        token_0,token_1    = UNI_v3_funcs.get_amounts_array(current_strat_obs.price_tick,lower_bin_tick,upper_bin_tick,position_liquidity,
+                                                            current_strat_obs.decimals_0,current_strat_obs.decimals_1)
+
+        liquidity_ranges   = PositionBook.PositionBook.from_arrays(lower_bin_tick,upper_bin_tick,position_liquidity,token_0,token_1,label='base',
+                                                                   time            = current_strat_obs.time,
+                                                                   lower_bin_price = 1.0001**lower_bin_tick.astype(float) / current_strat_obs.decimal_adjustment,
+                                                                   upper_bin_price = 1.0001**upper_bin_tick.astype(float) / current_strat_obs.decimal_adjustment,
+                                                                   price           = current_strat_obs.price,
+                                                                   reset_time      = current_strat_obs.time)
+
+        # The ladder is the reset range
+        strategy_info_here['reset_range_lower'] = 1.0001**float(edges[0])  / current_strat_obs.decimal_adjustment
+        strategy_info_here['reset_range_upper'] = 1.0001**float(edges[-1]) / current_strat_obs.decimal_adjustment
+        strategy_info_here['price_at_reset']    = current_strat_obs.price
+
+        # How much liquidity is not allcated to ranges
+        total_token_0,total_token_1         = ActiveStrategyFramework.allocated_amounts(liquidity_ranges)
+        current_strat_obs.token_0_left_over = max([current_strat_obs.liquidity_in_0 - total_token_0,0.0])
+        current_strat_obs.token_1_left_over = max([current_strat_obs.liquidity_in_1 - total_token_1,0.0])
+
+        # Since liquidity was allocated, set to 0
+        current_strat_obs.liquidity_in_0 = 0.0
+        current_strat_obs.liquidity_in_1 = 0.0
+
+        return liquidity_ranges,strategy_info_here
+
+    ########################################################
+    # Extract strategy parameters
+    ########################################################
+    def dict_components(self,strategy_observation):
+            this_data = dict()
+
+            # General variables
+            this_data['time']                   = strategy_observation.time
+            this_data['price']                  = strategy_observation.price
+            this_data['reset_point']            = strategy_observation.reset_point
+            this_data['reset_reason']           = strategy_observation.reset_reason
+
+            # Range Variables, the ladder spans the reset range
+            this_data['base_range_lower']       = strategy_observation.strategy_info['reset_range_lower']
+            this_data['base_range_upper']       = strategy_observation.strategy_info['reset_range_upper']
+            this_data['reset_range_lower']      = strategy_observation.strategy_info['reset_range_lower']
+            this_data['reset_range_upper']      = strategy_observation.strategy_info['reset_range_upper']
+            this_data['price_at_reset']         = strategy_observation.strategy_info['price_at_reset']
+
+            # Fee Variables
+            this_data['token_0_fees']                 = strategy_observation.token_0_fees
+            this_data['token_1_fees']                 = strategy_observation.token_1_fees
+            this_data['token_0_fees_uncollected']     = strategy_observation.token_0_fees_uncollected
+            this_data['token_1_fees_uncollected']     = strategy_observation.token_1_fees_uncollected
+
+            # Asset Variables
+            this_data['token_0_left_over']      = strategy_observation.token_0_left_over
+            this_data['token_1_left_over']      = strategy_observation.token_1_left_over
+
+            total_token_0,total_token_1         = ActiveStrategyFramework.allocated_amounts(strategy_observation.liquidity_ranges)
+
+            this_data['token_0_allocated']      = total_token_0
+            this_data['token_1_allocated']      = total_token_1
+            this_data['token_0_total']          = total_token_0 + strategy_observation.token_0_left_over + strategy_observation.token_0_fees_uncollected
+            this_data['token_1_total']          = total_token_1 + strategy_observation.token_1_left_over + strategy_observation.token_1_fees_uncollected
+
+            # Value Variables, without a limit range its value is left out
+            this_data['value_position_in_token_0']         = this_data['token_0_total']     + this_data['token_1_total']     / this_data['price']
+            this_data['value_allocated_in_token_0']        = this_data['token_0_allocated'] + this_data['token_1_allocated'] / this_data['price']
+            this_data['value_left_over_in_token_0']        = this_data['token_0_left_over'] + this_data['token_1_left_over'] / this_data['price']
+            this_data['base_position_value_in_token_0']    = ActiveStrategyFramework.labelled_value_in_token_0(strategy_observation.liquidity_ranges,'base',this_data['price'])
+
+            return this_data
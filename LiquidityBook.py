@@ -0,0 +1,116 @@
+import numpy as np
+
+import MarketData
+
+########################################################
+# Tick level liquidity of a pool through time, built from its Mint and Burn events
+# (see GetPoolData.get_liquidity_events_bigquery, which needs to start at the pool's creation).
+# Every event adds liquidity_delta to liquidityNet at tick_lower and removes it at tick_upper, so
+# the liquidity active at tick X is the sum of liquidityNet over the initialized ticks <= X.
+#
+# liquidityNet is kept in a Fenwick tree over the initialized ticks, with a snapshot of the tree
+# every snapshot_interval events. The liquidity at (tick,time) is a prefix sum on the last snapshot
+# before time, O(log ticks), plus the events between that snapshot and time (less than snapshot_interval).
+# Memory is (events/snapshot_interval) x initialized ticks floats.
+########################################################
+
+class LiquidityBook:
+    def __init__(self,liquidity_events,snapshot_interval = 256):
+
+        ######################################
+        # 1. Events in time order and the initialized ticks
+        ######################################
+
+        event_time              = MarketData.epoch_ns(liquidity_events.index)
+        order                   = np.argsort(event_time,kind='stable')
+        self.snapshot_interval  = snapshot_interval
+        self.event_time         = event_time[order]
+        self.tick_lower         = liquidity_events['tick_lower'].to_numpy().astype(np.int64)[order]
+        self.tick_upper         = liquidity_events['tick_upper'].to_numpy().astype(np.int64)[order]
+        self.liquidity_delta    = liquidity_events['liquidity_delta'].to_numpy(dtype=float)[order]
+
+        self.ticks              = np.unique(np.r_[self.tick_lower,self.tick_upper])
+        # 1-based positions in the Fenwick tree
+        position_lower          = np.searchsorted(self.ticks,self.tick_lower) + 1
+        position_upper          = np.searchsorted(self.ticks,self.tick_upper) + 1
+
+        ######################################
+        # 2. Fenwick tree of liquidityNet after every snapshot_interval events
+        ######################################
+
+        n_snapshots             = len(self.event_time) // snapshot_interval + 1
+        self.snapshots          = np.zeros((n_snapshots,len(self.ticks)+1))
+        liquidity_net           = np.zeros(len(self.ticks)+1)
+        for s in range(1,n_snapshots):
+            events = slice((s-1)*snapshot_interval,s*snapshot_interval)
+            np.add.at(liquidity_net,position_lower[events], self.liquidity_delta[events])
+            np.add.at(liquidity_net,position_upper[events],-self.liquidity_delta[events])
+            self.snapshots[s] = fenwick_from_values(liquidity_net)
+
+    def __len__(self):
+        return len(self.event_time)
+
+    def liquidity_at(self,tick,time):
+        """
+        Liquidity active at tick (positions with tick_lower <= tick < tick_upper) after the events up to time.
+        tick and time can be arrays, which are broadcast against each other.
+        """
+        tick,time     = np.broadcast_arrays(np.asarray(tick),np.asarray(time))
+        scalar        = tick.ndim == 0
+        tick          = np.ravel(tick).astype(np.int64)
+        time_ns       = MarketData.epoch_ns(np.ravel(time)) if not np.issubdtype(np.ravel(time).dtype,np.integer) else np.ravel(time)
+
+        n_events      = np.searchsorted(self.event_time,time_ns,side='right')
+        snapshot      = n_events // self.snapshot_interval
+        liquidity     = fenwick_prefix(self.snapshots,snapshot,np.searchsorted(self.ticks,tick,side='right'))
+
+        # Events after the snapshot
+        for j in range(self.snapshot_interval):
+            event      = snapshot*self.snapshot_interval + j
+            pending    = event < n_events
+            if not pending.any():
+                break
+            event      = event[pending]
+            liquidity[pending] += self.liquidity_delta[event] * ((self.tick_lower[event] <= tick[pending]).astype(float) -
+                                                                 (self.tick_upper[event] <= tick[pending]).astype(float))
+
+        return float(liquidity[0]) if scalar else liquidity
+
+    def liquidity_net_between(self,tick_lower,tick_upper,time):
+        """
+        Change in active liquidity when the price moves from tick_lower to tick_upper at time.
+        """
+        return self.liquidity_at(tick_upper,time) - self.liquidity_at(tick_lower,time)
+
+    def liquidity_at_swaps(self,market_data):
+        """
+        Liquidity active at the tick and time of every swap of a MarketData object,
+        an alternative to the virtual_liquidity column of the swap data.
+        """
+        return self.liquidity_at(market_data.tick_swap,market_data.swap_time)
+
+
+########################################################
+# Fenwick tree helpers (1-based, position 0 unused)
+########################################################
+
+def fenwick_from_values(values):
+
+    # Node i holds the sum of values in (i - lowbit(i), i]
+    prefix   = np.cumsum(values)
+    position = np.arange(len(values))
+    tree     = prefix - prefix[position - (position & -position)]
+    tree[0]  = 0.0
+    return tree
+
+def fenwick_prefix(trees,tree_index,position):
+
+    # Sum of values 1..position in trees[tree_index], vectorized over queries
+    position = np.array(position,dtype=np.int64)
+    total    = np.zeros(len(position))
+    active   = position > 0
+    while active.any():
+        total[active]    += trees[tree_index[active],position[active]]
+        position[active] -= position[active] & -position[active]
+        active            = position > 0
+    return total
@@ -0,0 +1,209 @@
+import pandas as pd
+import numpy as np
+import math
+
+########################################################
+# Market data compiled once for simulations.
+# Holds prices, pool ticks and swaps as NumPy arrays, together with the
+# offsets of the swaps that fall in each simulation step, so that every
+# step of simulate_strategy works on zero-copy views instead of pandas slices.
+########################################################
+
+class SwapWindow:
+    """
+    Zero-copy view of the swaps that took place during one simulation step.
+    """
+    __slots__ = ('tick_swap','token_0_in','virtual_liquidity','traded_in','start','stop')
+
+    def __init__(self,tick_swap,token_0_in,virtual_liquidity,traded_in,start=0,stop=None):
+        self.tick_swap         = tick_swap
+        self.token_0_in        = token_0_in
+        self.virtual_liquidity = virtual_liquidity
+        self.traded_in         = traded_in
+        self.start             = start
+        self.stop              = len(tick_swap) + start if stop is None else stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    @classmethod
+    def from_frame(cls,swap_data):
+        """
+        Builds a window from a DataFrame of swaps with the tick_swap, token_in, virtual_liquidity and traded_in columns.
+        """
+        return cls(swap_data['tick_swap'].to_numpy(),
+                   swap_data['token_in'].to_numpy() == 'token0',
+                   swap_data['virtual_liquidity'].to_numpy(dtype=float),
+                   swap_data['traded_in'].to_numpy(dtype=float))
+
+
+# Array attributes of a MarketData, see MarketData.arrays
+ARRAY_ATTRIBUTES = ('time','price','price_tick','price_tick_current',
+                    'swap_time','tick_swap','token_0_in','virtual_liquidity','traded_in',
+                    'swap_start','swap_stop')
+
+class MarketData:
+    def __init__(self,price_data,swap_data,fee_tier,decimals_0,decimals_1):
+
+        ######################################
+        # 1. Prices and pool ticks at every simulation step
+        ######################################
+
+        self.fee_tier           = fee_tier
+        self.decimals_0         = decimals_0
+        self.decimals_1         = decimals_1
+        self.decimal_adjustment = 10**(decimals_1  - decimals_0)
+        self.tickSpacing        = int(fee_tier*2*10000)
+
+        self.index              = price_data.index
+        self.time               = epoch_ns(price_data.index)
+        self.price              = price_data.to_numpy(dtype=float)
+
+        # Same tick computation as StrategyObservation, done once for the whole series
+        TICK_P_PRE              = np.array([math.log(self.decimal_adjustment*x,1.0001) for x in self.price])
+        self.price_tick         = (np.floor(TICK_P_PRE/self.tickSpacing)*self.tickSpacing).astype(np.int64)
+        self.price_tick_current = np.floor(TICK_P_PRE).astype(np.int64)
+
+        ######################################
+        # 2. Swaps and the swaps relevant to each step.
+        #    Step i gets the swaps between the timestamps of steps i-1 and i,
+        #    both included, as swap_data[price_data.index[i-1]:price_data.index[i]] would
+        ######################################
+
+        if swap_data is None or len(swap_data) == 0:
+            self.swap_time         = np.zeros(0,dtype=np.int64)
+            self.tick_swap         = np.zeros(0,dtype=np.int64)
+            self.token_0_in        = np.zeros(0,dtype=bool)
+            self.virtual_liquidity = np.zeros(0)
+            self.traded_in         = np.zeros(0)
+        else:
+            swap_time              = epoch_ns(swap_data.index)
+            order                  = np.argsort(swap_time,kind='stable')
+            self.swap_time         = swap_time[order]
+            self.tick_swap         = swap_data['tick_swap'].to_numpy().astype(np.int64)[order]
+            self.token_0_in        = (swap_data['token_in'].to_numpy() == 'token0')[order]
+            self.virtual_liquidity = swap_data['virtual_liquidity'].to_numpy(dtype=float)[order]
+            self.traded_in         = swap_data['traded_in'].to_numpy(dtype=float)[order]
+
+        self.swap_start         = np.zeros(len(self.time),dtype=np.int64)
+        self.swap_stop          = np.zeros(len(self.time),dtype=np.int64)
+        if len(self.time) > 1:
+            self.swap_start[1:] = np.searchsorted(self.swap_time,self.time[:-1],side='left')
+            self.swap_stop[1:]  = np.searchsorted(self.swap_time,self.time[1:], side='right')
+
+    def __len__(self):
+        return len(self.time)
+
+    def arrays(self):
+        """
+        Array attributes by name, which together with the fee tier, decimals and time zone rebuild the object with from_arrays.
+        """
+        return {name: getattr(self,name) for name in ARRAY_ATTRIBUTES}
+
+    @classmethod
+    def from_arrays(cls,arrays,fee_tier,decimals_0,decimals_1,tz=None,index_name=None):
+        """
+        MarketData over existing arrays (e.g. mapped from shared memory), without copying them.
+        """
+        market_data                    = cls.__new__(cls)
+        market_data.fee_tier           = fee_tier
+        market_data.decimals_0         = decimals_0
+        market_data.decimals_1         = decimals_1
+        market_data.decimal_adjustment = 10**(decimals_1  - decimals_0)
+        market_data.tickSpacing        = int(fee_tier*2*10000)
+        for name in ARRAY_ATTRIBUTES:
+            setattr(market_data,name,arrays[name])
+        market_data.index              = index_from_epoch_ns(market_data.time,tz,index_name)
+        return market_data
+
+    def window(self,start,stop):
+        """
+        MarketData of steps start to stop-1 over views of these arrays, the same as
+        building it from the prices of those steps (and the swaps relevant to them).
+        """
+        first_swap          = self.swap_start[start+1] if stop > start + 1 else 0
+        last_swap           = self.swap_stop[stop-1]   if stop > start + 1 else 0
+        arrays              = self.arrays()
+        for name in ('time','price','price_tick','price_tick_current'):
+            arrays[name]    = arrays[name][start:stop]
+        for name in ('swap_time','tick_swap','token_0_in','virtual_liquidity','traded_in'):
+            arrays[name]    = arrays[name][first_swap:last_swap]
+        arrays['swap_start'] = np.r_[0,self.swap_start[start+1:stop] - first_swap]
+        arrays['swap_stop']  = np.r_[0,self.swap_stop[start+1:stop]  - first_swap]
+        return MarketData.from_arrays(arrays,self.fee_tier,self.decimals_0,self.decimals_1,self.index.tz,self.index.name)
+
+    def swap_window(self,i):
+        """
+        Swaps relevant to step i as array views.
+        """
+        start = self.swap_start[i]
+        stop  = self.swap_stop[i]
+        return SwapWindow(self.tick_swap[start:stop],
+                          self.token_0_in[start:stop],
+                          self.virtual_liquidity[start:stop],
+                          self.traded_in[start:stop],
+                          start,stop)
+
+    def next_trigger_step(self,start,price_lower=-np.inf,price_upper=np.inf,tick_lower=None,tick_upper=None,time=None):
+        """
+        First step from start on where the price leaves [price_lower,price_upper], the current tick leaves
+        [tick_lower,tick_upper] or time reaches time. Returns len(self) if there is none.
+        Searches in blocks of growing size so that nearby triggers are found without scanning the whole series.
+        """
+        time_ns = np.iinfo(np.int64).max if time is None else epoch_ns([time])[0]
+        block   = 256
+        i       = start
+        while i < len(self.time):
+            stop = min(len(self.time),i+block)
+            hit  = (self.price[i:stop] < price_lower) | (self.price[i:stop] > price_upper) | (self.time[i:stop] >= time_ns)
+            if tick_lower is not None:
+                hit |= self.price_tick_current[i:stop] < tick_lower
+            if tick_upper is not None:
+                hit |= self.price_tick_current[i:stop] > tick_upper
+            if hit.any():
+                return i + int(np.argmax(hit))
+            i      = stop
+            block *= 2
+        return len(self.time)
+
+    def window_sums(self,values,start,stop):
+        """
+        Sums per step, for steps start to stop-1, of per-swap values covering the swaps
+        from self.swap_start[start] to self.swap_stop[stop-1]. values can have more axes after the swaps axis.
+        """
+        offset       = self.swap_start[start]
+        starts       = self.swap_start[start:stop] - offset
+        stops        = self.swap_stop[start:stop]  - offset
+        sums         = np.zeros((stop-start,) + np.shape(values)[1:])
+        nonempty     = np.flatnonzero(stops > starts)
+        if len(nonempty) == 0:
+            return sums
+        
+        # reduceat sums each window up to the start of the next non-empty one (and returns a single value
+        # when both start at the same swap). Windows share the swaps that happen exactly at a step's timestamp, add those back.
+        next_start     = np.r_[starts[nonempty[1:]],stops[nonempty[-1]]]
+        separate       = (next_start > starts[nonempty]).reshape((-1,) + (1,)*(np.ndim(values)-1))
+        sums[nonempty] = np.where(separate,np.add.reduceat(values[:stops[nonempty[-1]]],starts[nonempty]),0.0)
+        overlap        = np.flatnonzero(stops[nonempty] > next_start)
+        for k in overlap:
+            sums[nonempty[k]] += values[next_start[k]:stops[nonempty[k]]].sum(axis=0)
+        return sums
+
+
+def epoch_ns(index):
+    """
+    Nanoseconds since epoch (UTC for timezone aware data) of a DatetimeIndex.
+    """
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    return index.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+def index_from_epoch_ns(time,tz=None,name=None):
+    """
+    DatetimeIndex from nanoseconds since epoch, the inverse of epoch_ns for an index in time zone tz.
+    """
+    index = pd.DatetimeIndex(np.asarray(time,dtype=np.int64).view('datetime64[ns]'),name=name)
+    if tz is not None:
+        index = index.tz_localize('UTC').tz_convert(tz)
+    return index
@@ -0,0 +1,247 @@
+import concurrent.futures
+import itertools
+import os
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import ActiveStrategyFramework
+import MarketData
+
+########################################################
+# Parameter sweeps over a process pool.
+# Every parameter set builds a strategy with strategy_factory(**parameters), which is simulated,
+# turned into a simulation series and summarized with analyze_strategy, as run_hypervisor_single
+# does in 3_Uniswap_Simulation.ipynb. The result is a table with one row per parameter set:
+# the parameters, the analyze_strategy summary, the run time and the error raised, if any.
+#
+# The MarketData arrays and the token 0 USD prices are copied once into a shared memory block.
+# Workers map the block and rebuild the MarketData over it without copying, so only parameter
+# sets and summaries travel between processes. strategy_factory is sent once to every worker and
+# has to be picklable, e.g. functools.partial(ResetStrategy.ResetStrategy,model_data).
+########################################################
+
+# Offsets of the arrays in the shared block are multiples of this
+ARRAY_ALIGNMENT        = 64
+
+# Seconds between checks of cancel_event while waiting for results
+POLL_INTERVAL          = 0.2
+
+# Only the summary of each simulation is kept, so it runs on the columnar store skipping quiet steps
+DEFAULT_SIMULATION_OPTIONS = {'columnar': True, 'skip_steps': True}
+
+def run_sweep(price_data,swap_data,strategy_factory,parameters,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+              token_0_usd_data=None,frequency='M',market_data=None,fee_model_factory=None,simulation_options=None,
+              max_workers=None,chunk_size=1,progress=None,cancel_event=None,mp_context=None,cache=None):
+    """
+    Simulates strategy_factory(**p) for every parameter set p in parameters (a list of dicts, or a dict of value lists
+    that is expanded to their product) over a pool of max_workers processes (default: one per CPU).
+
+    fee_model_factory, if given, is called once per worker with its MarketData to build the fee model (e.g. FeeGrowthIndex.FeeGrowthIndex).
+    simulation_options are passed to simulate_strategy. chunk_size parameter sets are sent to a worker at a time.
+    With a SimulationCache as cache, simulation series are loaded from it when the same simulation was run before.
+    progress(completed,total) is called as results come in, and setting cancel_event (e.g. a threading.Event)
+    stops the sweep: parameter sets not started are dropped and the rows completed so far are returned.
+    """
+    if market_data is None:
+        market_data = MarketData.MarketData(price_data,swap_data,fee_tier,decimals_0,decimals_1)
+    if simulation_options is None:
+        simulation_options = DEFAULT_SIMULATION_OPTIONS
+
+    parameter_sets = parameter_grid(parameters)
+    tasks          = [parameter_sets[k:k+chunk_size] for k in range(0,len(parameter_sets),chunk_size)]
+    worker_setup   = {'strategy_factory'   : strategy_factory,
+                      'fee_model_factory'  : fee_model_factory,
+                      'simulation_options' : simulation_options,
+                      'liquidity_in_0'     : liquidity_in_0,
+                      'liquidity_in_1'     : liquidity_in_1,
+                      'frequency'          : frequency,
+                      'cache'              : cache}
+
+    results = run_in_pool(run_chunk,tasks,market_data,token_0_usd_data,worker_setup,max_workers,progress,cancel_event,mp_context)
+    return pd.DataFrame([row for chunk in results for row in chunk])
+
+def run_in_pool(function,tasks,market_data,token_0_usd_data,worker_setup,max_workers=None,progress=None,cancel_event=None,mp_context=None):
+    """
+    Runs function(task) for every task (a list of items, e.g. parameter sets) in a process pool whose workers share
+    market_data and token_0_usd_data and find worker_setup in WORKER_STATE. Returns the list of results of every task,
+    empty for the tasks dropped by cancel_event. progress(completed,total) counts items.
+    """
+    max_workers = min(max_workers or os.cpu_count() or 1,max(len(tasks),1))
+    total       = sum(len(task) for task in tasks)
+
+    ######################################
+    # 1. Market data and USD prices into shared memory
+    ######################################
+
+    arrays = market_data.arrays()
+    if token_0_usd_data is not None:
+        arrays['usd_time']        = MarketData.epoch_ns(token_0_usd_data.index)
+        arrays['usd_quote_price'] = token_0_usd_data['quotePrice'].to_numpy(dtype=float)
+    shared = SharedArrays(arrays)
+
+    worker_setup = dict(worker_setup,
+                        spec       = shared.spec,
+                        fee_tier   = market_data.fee_tier,
+                        decimals_0 = market_data.decimals_0,
+                        decimals_1 = market_data.decimals_1,
+                        tz         = market_data.index.tz,
+                        index_name = market_data.index.name,
+                        usd_tz     = token_0_usd_data.index.tz if token_0_usd_data is not None else None)
+
+    ######################################
+    # 2. Keep up to two tasks per worker in flight until done or cancelled
+    ######################################
+
+    results   = [[] for task in tasks]
+    executor  = concurrent.futures.ProcessPoolExecutor(max_workers,mp_context=mp_context,initializer=init_worker,initargs=(worker_setup,))
+    pending   = dict()
+    next_task = 0
+    completed = 0
+    try:
+        while next_task < len(tasks) or len(pending) > 0:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            while next_task < len(tasks) and len(pending) < 2*max_workers:
+                pending[executor.submit(function,tasks[next_task])] = next_task
+                next_task += 1
+
+            done,_ = concurrent.futures.wait(pending,timeout=POLL_INTERVAL,return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                k           = pending.pop(future)
+                results[k]  = future.result()
+                completed  += len(tasks[k])
+                if progress is not None:
+                    progress(completed,total)
+    finally:
+        # Workers still running a task finish it in the background, their results are dropped
+        executor.shutdown(wait=len(pending) == 0,cancel_futures=True)
+        shared.release()
+
+    return results
+
+def parameter_grid(parameters):
+    """
+    List of parameter dicts from a list of dicts, or from a dict of value lists (all their combinations).
+    """
+    if isinstance(parameters,dict):
+        names = list(parameters)
+        return [dict(zip(names,values)) for values in itertools.product(*[parameters[name] for name in names])]
+    return [dict(p) for p in parameters]
+
+def print_progress(completed,total):
+    """
+    Progress callback for run_sweep that keeps a counter on one line.
+    """
+    sys.stdout.write('\r{} / {} parameter sets'.format(completed,total))
+    if completed == total:
+        sys.stdout.write('\n')
+    sys.stdout.flush()
+
+########################################################
+# Arrays in one shared memory block
+########################################################
+
+class SharedArrays:
+    """
+    Copies a dict of NumPy arrays into one shared memory block. spec is a small picklable
+    description of the block, from which attach_arrays maps the same arrays in another process.
+    """
+    def __init__(self,arrays):
+
+        layout = []
+        offset = 0
+        for name,array in arrays.items():
+            array   = np.asarray(array)
+            layout.append((name,array.dtype.str,array.shape,offset))
+            offset += -(-array.nbytes // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+        self.memory = shared_memory.SharedMemory(create=True,size=max(offset,1))
+        for (name,dtype,shape,offset),array in zip(layout,arrays.values()):
+            np.ndarray(shape,dtype,self.memory.buf,offset)[...] = array
+        self.spec   = (self.memory.name,layout)
+
+    def release(self):
+
+        self.memory.close()
+        self.memory.unlink()
+
+def attach_arrays(spec):
+    """
+    Maps the arrays of a SharedArrays block as read-only views. The returned SharedMemory has to be kept alive while they are used.
+    """
+    name,layout = spec
+    memory      = shared_memory.SharedMemory(name=name)
+    arrays      = dict()
+    for key,dtype,shape,offset in layout:
+        arrays[key]                 = np.ndarray(shape,dtype,memory.buf,offset)
+        arrays[key].flags.writeable = False
+    return memory,arrays
+
+########################################################
+# Worker side
+########################################################
+
+# State of a worker process, set up once by init_worker
+WORKER_STATE = dict()
+
+def init_worker(worker_setup):
+
+    memory,arrays = attach_arrays(worker_setup['spec'])
+    market_data   = MarketData.MarketData.from_arrays(arrays,worker_setup['fee_tier'],worker_setup['decimals_0'],worker_setup['decimals_1'],
+                                                      worker_setup['tz'],worker_setup['index_name'])
+
+    WORKER_STATE.update(worker_setup)
+    WORKER_STATE['memory']      = memory
+    WORKER_STATE['arrays']      = arrays
+    WORKER_STATE['market_data'] = market_data
+    WORKER_STATE['fee_model']   = worker_setup['fee_model_factory'](market_data) if worker_setup['fee_model_factory'] is not None else None
+
+def run_chunk(parameter_sets):
+
+    return [evaluate_parameters(parameters) for parameters in parameter_sets]
+
+def evaluate_parameters(parameters):
+    """
+    Simulation summary of one parameter set in a worker process, as a row of the sweep table.
+    """
+    row   = dict(parameters)
+    start = time.perf_counter()
+    try:
+        row.update(simulation_summary(WORKER_STATE['strategy_factory'](**parameters),WORKER_STATE['market_data'],WORKER_STATE['fee_model']))
+        row['error'] = None
+    except Exception as e:
+        row['error'] = '{}: {}'.format(type(e).__name__,e)
+    row['run_time']  = time.perf_counter() - start
+    return row
+
+def simulation_summary(strategy_in,market_data,fee_model=None):
+    """
+    analyze_strategy summary of strategy_in simulated on market_data (the worker's or a window of it) in a worker process.
+    fee_model has to be built on the same market_data.
+    """
+    state = WORKER_STATE
+    if state['cache'] is not None:
+        sim_data    = state['cache'].simulation_series(None,None,strategy_in,state['liquidity_in_0'],state['liquidity_in_1'],
+                                                       state['fee_tier'],state['decimals_0'],state['decimals_1'],
+                                                       token_0_usd_data=worker_usd_data(),market_data=market_data,
+                                                       fee_model=fee_model,**state['simulation_options'])
+    else:
+        simulations = ActiveStrategyFramework.simulate_strategy(None,None,strategy_in,state['liquidity_in_0'],state['liquidity_in_1'],
+                                                                state['fee_tier'],state['decimals_0'],state['decimals_1'],
+                                                                market_data=market_data,fee_model=fee_model,
+                                                                **state['simulation_options'])
+        sim_data    = ActiveStrategyFramework.generate_simulation_series(simulations,strategy_in,token_0_usd_data=worker_usd_data())
+    return ActiveStrategyFramework.analyze_strategy(sim_data,frequency=state['frequency'])
+
+def worker_usd_data():
+
+    # prepare_usd_data adds columns to its input, so every simulation gets a new frame
+    arrays = WORKER_STATE['arrays']
+    if 'usd_time' not in arrays:
+        return None
+    return pd.DataFrame({'quotePrice': arrays['usd_quote_price']},
+                        index=MarketData.index_from_epoch_ns(arrays['usd_time'],WORKER_STATE['usd_tz']))
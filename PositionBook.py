@@ -0,0 +1,284 @@
+import itertools
+from collections.abc import MutableMapping, Sequence
+
+import numpy as np
+
+import UNI_v3_funcs
+
+########################################################
+# Liquidity ranges of a strategy as one structured array, for strategies with many ranges
+# (e.g. ladders of 50-500 ranges) where a dict per range is too slow.
+# Every row is a range: its ticks, liquidity, token amounts, a label naming its role ('base',
+# 'limit', 'ladder', ...) and any metadata fields (price, lower_bin_price, reset_time, ...).
+# StrategyObservation values, accrues fees on and removes all ranges of a book with array
+# operations instead of one call per range.
+#
+# set_liquidity_ranges and check_strategy can return a PositionBook in place of the list of range
+# dicts. Indexing gives a dict-like view of one range, so book[0]['token_0'] works as with the list,
+# and book['base'] is the view of the first range labelled 'base'.
+# Consecutive observations share the array (see share), which is copied on the first write.
+########################################################
+
+# Fields of every book, metadata fields are added after them
+POSITION_FIELDS = (('lower_bin_tick',np.int64),('upper_bin_tick',np.int64),('position_liquidity',np.float64),
+                   ('token_0',np.float64),('token_1',np.float64),('label',object))
+
+# Fields that are updated every step, writing the others starts a new range state (see SimulationResults)
+STEP_FIELDS     = ('token_0','token_1')
+
+# Range states of all books
+STATE_IDS       = itertools.count()
+
+class PositionBook(Sequence):
+    def __init__(self,positions,time = None):
+
+        self.positions = positions
+        self.time      = time
+        self.state     = next(STATE_IDS)
+        self._shared   = False
+
+    @classmethod
+    def from_arrays(cls,lower_bin_tick,upper_bin_tick,position_liquidity,token_0 = 0.0,token_1 = 0.0,label = '',time = None,**metadata):
+        """
+        Book of ranges given by arrays (or scalars, broadcast to all ranges). Keyword arguments become metadata fields.
+        """
+        lower_bin_tick     = np.atleast_1d(np.asarray(lower_bin_tick))
+        n                  = len(lower_bin_tick)
+        columns            = {'lower_bin_tick'     : lower_bin_tick,
+                              'upper_bin_tick'     : upper_bin_tick,
+                              'position_liquidity' : position_liquidity,
+                              'token_0'            : token_0,
+                              'token_1'            : token_1,
+                              'label'              : label}
+        columns.update(metadata)
+
+        dtype              = [(name,field_dtype(name,columns[name])) for name in columns]
+        positions          = np.zeros(n,dtype=dtype)
+        for name,values in columns.items():
+            if positions.dtype[name] == object:
+                positions[name] = object_column(values,n)
+            else:
+                positions[name] = values
+        return cls(positions,time)
+
+    @classmethod
+    def from_ranges(cls,ranges,labels = None):
+        """
+        Book of a list of range dicts (as set_liquidity_ranges builds them), with an optional label per range.
+        Keys other than the position fields and time become metadata fields.
+        """
+        keys     = [key for key in dict.fromkeys(key for x in ranges for key in x) if key != 'time']
+        columns  = {key: [x.get(key) for x in ranges] for key in keys}
+        if labels is not None:
+            columns['label'] = list(labels)
+        time     = ranges[0].get('time') if len(ranges) > 0 else None
+        return cls.from_arrays(time=time,**columns)
+
+    ########################################################
+    # Sequence of ranges
+    ########################################################
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self,key):
+        if isinstance(key,str):
+            rows = np.flatnonzero(self.labelled(key))
+            if len(rows) == 0:
+                raise KeyError(key)
+            return PositionView(self,int(rows[0]))
+        if isinstance(key,slice):
+            return [PositionView(self,j) for j in range(len(self))[key]]
+        j = int(key)
+        if j < 0:
+            j += len(self)
+        if not 0 <= j < len(self):
+            raise IndexError(key)
+        return PositionView(self,j)
+
+    def __repr__(self):
+        return 'PositionBook({} ranges, labels {})'.format(len(self),sorted(set(self.positions['label'])))
+
+    @property
+    def fields(self):
+        return self.positions.dtype.names
+
+    def column(self,name):
+        """
+        Values of a field for all ranges (read-only, write with set_column).
+        """
+        values                 = self.positions[name]
+        values.flags.writeable = False
+        return values
+
+    lower_bin_tick     = property(lambda self: self.column('lower_bin_tick'))
+    upper_bin_tick     = property(lambda self: self.column('upper_bin_tick'))
+    position_liquidity = property(lambda self: self.column('position_liquidity'))
+    token_0            = property(lambda self: self.column('token_0'))
+    token_1            = property(lambda self: self.column('token_1'))
+    label              = property(lambda self: self.column('label'))
+
+    def labelled(self,label):
+        """
+        Boolean mask of the ranges with label.
+        """
+        return self.positions['label'] == label
+
+    def select(self,label):
+        """
+        New book with the ranges labelled label.
+        """
+        return PositionBook(self.positions[self.labelled(label)],self.time)
+
+    def records(self,exclude = ()):
+        """
+        The ranges as a list of dicts.
+        """
+        names   = [name for name in self.fields if name not in exclude]
+        columns = [self.positions[name].tolist() for name in names]
+        records = [dict(zip(names,values)) for values in zip(*columns)]
+        if self.time is not None and 'time' not in exclude:
+            for x in records:
+                x['time'] = self.time
+        return records
+
+    ########################################################
+    # Writes, copying the array when it is shared
+    ########################################################
+    def set_column(self,name,values):
+
+        self.own()
+        if name not in self.fields:
+            self.add_field(name,field_dtype(name,values))
+        if self.positions.dtype[name] == object:
+            self.positions[name] = object_column(values,len(self))
+        else:
+            self.positions[name] = values
+        if name not in STEP_FIELDS:
+            self.state = next(STATE_IDS)
+
+    def set_value(self,j,name,value):
+
+        self.own()
+        if name not in self.fields:
+            self.add_field(name,field_dtype(name,[value]))
+        self.positions[name][j] = value
+        if name not in STEP_FIELDS:
+            self.state = next(STATE_IDS)
+
+    def add_field(self,name,dtype):
+
+        positions = np.zeros(len(self),dtype=self.positions.dtype.descr + [(name,dtype)])
+        for field in self.fields:
+            positions[field] = self.positions[field]
+        if positions.dtype[name] == object:
+            positions[name] = object_column(None,len(self))
+        elif positions.dtype[name].kind == 'f':
+            positions[name] = np.nan
+        self.positions = positions
+
+    def own(self):
+        if self._shared:
+            self.positions = self.positions.copy()
+            self._shared   = False
+
+    def share(self):
+        """
+        Book for the next observation over the same array, values written in either one are copied first.
+        """
+        book         = PositionBook.__new__(PositionBook)
+        book.__dict__.update(self.__dict__)
+        book._shared = True
+        self._shared = True
+        return book
+
+    def copy(self):
+        book           = self.share()
+        book.positions = self.positions.copy()
+        book._shared   = False
+        return book
+
+    ########################################################
+    # Valuation of all ranges at once
+    ########################################################
+    def amounts(self,tick,decimals_0,decimals_1):
+        """
+        Token 0 and token 1 in every range at tick.
+        """
+        return UNI_v3_funcs.get_amounts_array(tick,self.positions['lower_bin_tick'],self.positions['upper_bin_tick'],
+                                              self.positions['position_liquidity'],decimals_0,decimals_1)
+
+    def update_amounts(self,tick,decimals_0,decimals_1):
+
+        amount_0,amount_1 = self.amounts(tick,decimals_0,decimals_1)
+        self.set_column('token_0',amount_0)
+        self.set_column('token_1',amount_1)
+
+    def value_in_token_0(self,price,label = None):
+        """
+        Value of the ranges (all, or those with label) at price, in token 0.
+        """
+        rows = self.labelled(label) if label is not None else slice(None)
+        return float(np.sum(self.positions['token_0'][rows] + self.positions['token_1'][rows]/price))
+
+
+class PositionView(MutableMapping):
+    """
+    One range of a PositionBook as a dict.
+    """
+    __slots__ = ('book','j')
+
+    def __init__(self,book,j):
+        self.book = book
+        self.j    = j
+
+    def __getitem__(self,key):
+        if key == 'time' and self.book.time is not None:
+            return self.book.time
+        if key not in self.book.fields:
+            raise KeyError(key)
+        value = self.book.positions[key][self.j]
+        return value.item() if isinstance(value,np.generic) else value
+
+    def __setitem__(self,key,value):
+        if key == 'time':
+            self.book.time = value
+        else:
+            self.book.set_value(self.j,key,value)
+
+    def __delitem__(self,key):
+        raise TypeError('Unsupported deletion of position field: ' + str(key))
+
+    def __iter__(self):
+        yield from self.book.fields
+        if self.book.time is not None:
+            yield 'time'
+
+    def __len__(self):
+        return len(self.book.fields) + (self.book.time is not None)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def field_dtype(name,values):
+
+    # Liquidity can exceed int64 (exact tick math), it is kept as Python integers unless all values are floats
+    values = np.asarray(values) if not isinstance(values,np.ndarray) else values
+    if name == 'position_liquidity':
+        if values.dtype == object and any(isinstance(x,int) and float(x) != x for x in values.ravel()):
+            return object
+        return np.float64
+    if name in ('lower_bin_tick','upper_bin_tick'):
+        return np.int64
+    if values.dtype.kind in 'biuf':
+        return values.dtype
+    return object
+
+def object_column(values,n):
+
+    column = np.empty(n,dtype=object)
+    if isinstance(values,(list,tuple,np.ndarray)):
+        column[:] = list(values)
+    else:
+        column[:] = [values]*n
+    return column
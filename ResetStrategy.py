@@ -3,7 +3,7 @@ import numpy as np
 import math
 from statsmodels.distributions.empirical_distribution import ECDF, monotone_fn_inverter
 import UNI_v3_funcs
-import copy
+import ActiveStrategyFramework
 
 class ResetStrategy:
     def __init__(self,model_data,alpha_param,tau_param,limit_parameter):
@@ -69,6 +69,32 @@ class ResetStrategy:
         else:
             return current_strat_obs.liquidity_ranges,current_strat_obs.strategy_info
             
+    #####################################
+    # Conditions under which check_strategy cannot rebalance, used by the 
+    # simulator to skip evaluations (see ActiveStrategyFramework.simulate_strategy)
+    # Returns None when the strategy needs to be checked at the next time point
+    #####################################
+    
+    def next_trigger(self,current_strat_obs):
+        
+        trigger = {'price_lower' : current_strat_obs.strategy_info['reset_range_lower'],
+                   'price_upper' : current_strat_obs.strategy_info['reset_range_upper']}
+        
+        # The limit rebalance can only happen while the limit position holds both tokens, 
+        # that is while the current tick is strictly inside of it
+        limit_range = current_strat_obs.liquidity_ranges[1]
+        if limit_range['position_liquidity'] > 0:
+            TICK_A = min(limit_range['lower_bin_tick'],limit_range['upper_bin_tick'])
+            TICK_B = max(limit_range['lower_bin_tick'],limit_range['upper_bin_tick'])
+            
+            if   current_strat_obs.price_tick_current <= TICK_A:
+                trigger['tick_upper'] = TICK_A
+            elif current_strat_obs.price_tick_current >= TICK_B:
+                trigger['tick_lower'] = TICK_B
+            else:
+                return None
+            
+        return trigger
             
     def set_liquidity_ranges(self,current_strat_obs):
         
@@ -80,7 +106,7 @@ class ResetStrategy:
         if current_strat_obs.strategy_info is None:
             strategy_info_here = dict()
         else:
-            strategy_info_here = copy.deepcopy(current_strat_obs.strategy_info)
+            strategy_info_here = dict(current_strat_obs.strategy_info)
             
         strategy_info_here['reset_range_lower']     = (1 + self.inverse_ecdf((1 -      self.tau_param)/2))    * current_strat_obs.price
         strategy_info_here['reset_range_upper']     = (1 + self.inverse_ecdf( 1 - (1 - self.tau_param)/2))    * current_strat_obs.price
@@ -108,10 +134,10 @@ class ResetStrategy:
         TICK_B            = int(round(TICK_B_PRE/current_strat_obs.tickSpacing)*current_strat_obs.tickSpacing)
         
         liquidity_placed_base         = int(UNI_v3_funcs.get_liquidity(current_strat_obs.price_tick,TICK_A,TICK_B,current_strat_obs.liquidity_in_0, \
-                                                                       current_strat_obs.liquidity_in_1,current_strat_obs.decimals_0,current_strat_obs.decimals_1))
+                                                                       current_strat_obs.liquidity_in_1,current_strat_obs.decimals_0,current_strat_obs.decimals_1,tick_spacing=current_strat_obs.tickSpacing))
         
         base_0_amount,base_1_amount   = UNI_v3_funcs.get_amounts(current_strat_obs.price_tick,TICK_A,TICK_B,liquidity_placed_base\
-                                                                 ,current_strat_obs.decimals_0,current_strat_obs.decimals_1)
+                                                                 ,current_strat_obs.decimals_0,current_strat_obs.decimals_1,tick_spacing=current_strat_obs.tickSpacing)
         
         total_token_0_amount  -= base_0_amount
         total_token_1_amount  -= base_1_amount
@@ -157,9 +183,9 @@ class ResetStrategy:
         TICK_B            = int(round(TICK_B_PRE/current_strat_obs.tickSpacing)*current_strat_obs.tickSpacing)
 
         liquidity_placed_limit        = int(UNI_v3_funcs.get_liquidity(current_strat_obs.price_tick,TICK_A,TICK_B, \
-                                                                       limit_amount_0,limit_amount_1,current_strat_obs.decimals_0,current_strat_obs.decimals_1))
+                                                                       limit_amount_0,limit_amount_1,current_strat_obs.decimals_0,current_strat_obs.decimals_1,tick_spacing=current_strat_obs.tickSpacing))
         limit_0_amount,limit_1_amount =     UNI_v3_funcs.get_amounts(current_strat_obs.price_tick,TICK_A,TICK_B,\
-                                                                     liquidity_placed_limit,current_strat_obs.decimals_0,current_strat_obs.decimals_1)      
+                                                                     liquidity_placed_limit,current_strat_obs.decimals_0,current_strat_obs.decimals_1,tick_spacing=current_strat_obs.tickSpacing)      
 
         limit_liq_range =       {'price'              : current_strat_obs.price,
                                  'lower_bin_tick'     : TICK_A,
@@ -207,13 +233,15 @@ class ResetStrategy:
             this_data['reset_reason']           = strategy_observation.reset_reason
             
             # Range Variables
-            this_data['base_range_lower']       = strategy_observation.liquidity_ranges[0]['lower_bin_price']
-            this_data['base_range_upper']       = strategy_observation.liquidity_ranges[0]['upper_bin_price']
-            this_data['limit_range_lower']      = strategy_observation.liquidity_ranges[1]['lower_bin_price']
-            this_data['limit_range_upper']      = strategy_observation.liquidity_ranges[1]['upper_bin_price']
+            base_range                          = ActiveStrategyFramework.labelled_range(strategy_observation.liquidity_ranges,'base')
+            limit_range                         = ActiveStrategyFramework.labelled_range(strategy_observation.liquidity_ranges,'limit')
+            this_data['base_range_lower']       = base_range['lower_bin_price']
+            this_data['base_range_upper']       = base_range['upper_bin_price']
+            this_data['limit_range_lower']      = limit_range['lower_bin_price'] if limit_range is not None else np.nan
+            this_data['limit_range_upper']      = limit_range['upper_bin_price'] if limit_range is not None else np.nan
             this_data['reset_range_lower']      = strategy_observation.strategy_info['reset_range_lower']
             this_data['reset_range_upper']      = strategy_observation.strategy_info['reset_range_upper']
-            this_data['price_at_reset']         = strategy_observation.liquidity_ranges[0]['price']
+            this_data['price_at_reset']         = base_range['price']
             
             # Fee Varaibles
             this_data['token_0_fees']           = strategy_observation.token_0_fees 
@@ -225,11 +253,7 @@ class ResetStrategy:
             this_data['token_0_left_over']      = strategy_observation.token_0_left_over
             this_data['token_1_left_over']      = strategy_observation.token_1_left_over
             
-            total_token_0 = 0.0
-            total_token_1 = 0.0
-            for i in range(len(strategy_observation.liquidity_ranges)):
-                total_token_0 += strategy_observation.liquidity_ranges[i]['token_0']
-                total_token_1 += strategy_observation.liquidity_ranges[i]['token_1']
+            total_token_0,total_token_1         = ActiveStrategyFramework.allocated_amounts(strategy_observation.liquidity_ranges)
                 
             this_data['token_0_allocated']      = total_token_0
             this_data['token_1_allocated']      = total_token_1
@@ -241,7 +265,7 @@ class ResetStrategy:
             this_data['value_allocated_in_token_0']        = this_data['token_0_allocated'] + this_data['token_1_allocated'] / this_data['price']
             this_data['value_left_over_in_token_0']        = this_data['token_0_left_over'] + this_data['token_1_left_over'] / this_data['price']
             
-            this_data['base_position_value_in_token_0']    = strategy_observation.liquidity_ranges[0]['token_0'] + strategy_observation.liquidity_ranges[0]['token_1'] / this_data['price']
-            this_data['limit_position_value_in_token_0']   = strategy_observation.liquidity_ranges[1]['token_0'] + strategy_observation.liquidity_ranges[1]['token_1'] / this_data['price']
+            this_data['base_position_value_in_token_0']    = ActiveStrategyFramework.labelled_value_in_token_0(strategy_observation.liquidity_ranges,'base',this_data['price'])
+            this_data['limit_position_value_in_token_0']   = ActiveStrategyFramework.labelled_value_in_token_0(strategy_observation.liquidity_ranges,'limit',this_data['price'])
              
             return this_data
\ No newline at end of file
@@ -0,0 +1,258 @@
+import functools
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import types
+import weakref
+
+import numpy as np
+import pandas as pd
+
+import ActiveStrategyFramework
+import MarketData
+import UNI_v3_funcs
+
+########################################################
+# Persistent cache of simulation series.
+# SimulationCache.simulation_series runs simulate_strategy and generate_simulation_series, or loads
+# their result from disk when the same simulation was run before. Entries are content addressed:
+# the key hashes the MarketData arrays, the strategy's class and attributes (parameters and model
+# data), the initial tokens, fee tier, decimals, simulation options, USD prices, the tick math mode
+# (UNI_v3_funcs.set_tick_math) and the source of the modules that produce the result, so changing
+# any of them gives a new entry.
+#
+# Every entry is a directory with one .npy file per column, loaded memory-mapped (read-only) on a
+# hit. When the cache grows over max_bytes the least recently used entries are removed. Entries are
+# written to a temporary directory and renamed, so processes of a sweep can share one cache.
+########################################################
+
+# Bump when the stored layout or the key changes
+CACHE_FORMAT = 2
+
+# Modules whose source is part of every key, besides the strategy's and the fee model's
+KEY_MODULES  = ('ActiveStrategyFramework','SimulationResults','MarketData','UNI_v3_funcs','TickMath','PositionBook')
+
+class SimulationCache:
+    def __init__(self,directory,max_bytes = 2**32):
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory,exist_ok=True)
+
+    def simulation_series(self,price_data,swap_data,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                          token_0_usd_data=None,market_data=None,**simulation_options):
+        """
+        generate_simulation_series(simulate_strategy(...),strategy_in,token_0_usd_data), from the cache when possible.
+        simulation_options are passed to simulate_strategy (columnar, skip_steps, two_pass, fee_model).
+        """
+        if market_data is None:
+            market_data = MarketData.MarketData(price_data,swap_data,fee_tier,decimals_0,decimals_1)
+
+        key         = self.key(market_data,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,token_0_usd_data,simulation_options)
+        data_return = self.get(key)
+        if data_return is None:
+            simulations = ActiveStrategyFramework.simulate_strategy(None,None,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                                                                    market_data=market_data,**simulation_options)
+            data_return = ActiveStrategyFramework.generate_simulation_series(simulations,strategy_in,
+                                                                             token_0_usd_data=token_0_usd_data.copy() if token_0_usd_data is not None else None)
+            self.put(key,data_return)
+        return data_return
+
+    def key(self,market_data,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,token_0_usd_data=None,simulation_options=None):
+        """
+        Content hash of a simulation's inputs.
+        """
+        simulation_options = dict(simulation_options or {})
+        fee_model          = simulation_options.pop('fee_model',None)
+        modules            = KEY_MODULES + (type(strategy_in).__module__,) + ((type(fee_model).__module__,) if fee_model is not None else ())
+
+        digest = hashlib.blake2b(digest_size=20)
+        update_hash(digest,(CACHE_FORMAT,[source_fingerprint(name) for name in modules],UNI_v3_funcs.TICK_MATH))
+        update_hash(digest,(cached_fingerprint(market_data),cached_fingerprint(fee_model) if fee_model is not None else None))
+        update_hash(digest,(strategy_in,float(liquidity_in_0),float(liquidity_in_1),fee_tier,decimals_0,decimals_1,token_0_usd_data,simulation_options))
+        return digest.hexdigest()
+
+    ########################################################
+    # Entries
+    ########################################################
+    def get(self,key):
+        """
+        Cached frame of key with memory-mapped columns, or None.
+        """
+        path = os.path.join(self.directory,key)
+        try:
+            with open(os.path.join(path,'meta.json')) as f:
+                meta = json.load(f)
+            columns = {column['name']: load_column(path,k,column) for k,column in enumerate(meta['columns'])}
+        except (OSError,ValueError):
+            return None
+
+        # Most recently used entries are the ones with the newest meta.json
+        os.utime(os.path.join(path,'meta.json'))
+        if meta['index']['kind'] == 'range':
+            index = pd.RangeIndex(meta['index']['length'])
+        else:
+            index = pd.Index(columns[meta['index']['column']],name=meta['index']['name'])
+        return pd.DataFrame({column['name']: columns[column['name']] for column in meta['columns'] if column['name'] != '__index__'},
+                            index=index,copy=False)
+
+    def put(self,key,data):
+
+        path      = os.path.join(self.directory,key)
+        temporary = tempfile.mkdtemp(dir=self.directory,prefix='.tmp-')
+        try:
+            columns = [(name,data[name]) for name in data.columns]
+            if isinstance(data.index,pd.RangeIndex) and data.index.start == 0 and data.index.step == 1:
+                index = {'kind': 'range', 'length': len(data)}
+            else:
+                index = {'kind': 'column', 'column': '__index__', 'name': data.index.name}
+                columns.append(('__index__',pd.Series(data.index)))
+
+            meta = {'format': CACHE_FORMAT, 'index': index,
+                    'columns': [save_column(temporary,k,name,values) for k,(name,values) in enumerate(columns)]}
+            with open(os.path.join(temporary,'meta.json'),'w') as f:
+                json.dump(meta,f)
+            os.replace(temporary,path)
+        except OSError:
+            # Another process stored the same entry first
+            pass
+        finally:
+            shutil.rmtree(temporary,ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is within max_bytes.
+        """
+        entries = []
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory,key)
+            try:
+                used = os.path.getmtime(os.path.join(path,'meta.json'))
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+            except OSError:
+                continue
+            entries.append((used,size,path))
+
+        total = sum(size for used,size,path in entries)
+        for used,size,path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path,ignore_errors=True)
+            total -= size
+
+    def clear(self):
+
+        for key in os.listdir(self.directory):
+            shutil.rmtree(os.path.join(self.directory,key),ignore_errors=True)
+
+########################################################
+# Column files
+########################################################
+
+def save_column(path,k,name,values):
+
+    column = {'name': name, 'kind': 'array'}
+    if isinstance(values.dtype,pd.DatetimeTZDtype):
+        column.update(kind='datetime',tz=str(values.dt.tz))
+        values = MarketData.epoch_ns(values)
+    elif values.dtype == object:
+        column['kind'] = 'object'
+    np.save(os.path.join(path,'{}.npy'.format(k)),np.asarray(values),allow_pickle=column['kind'] == 'object')
+    return column
+
+def load_column(path,k,column):
+
+    file_name = os.path.join(path,'{}.npy'.format(k))
+    if column['kind'] == 'object':
+        return np.load(file_name,allow_pickle=True)
+    values    = np.load(file_name,mmap_mode='r')
+    if column['kind'] == 'datetime':
+        return MarketData.index_from_epoch_ns(values,column['tz'])
+    return values
+
+########################################################
+# Fingerprints of simulation inputs
+########################################################
+
+# Fingerprints of objects that do not change once built (MarketData, fee models), by object
+FINGERPRINTS = weakref.WeakKeyDictionary()
+
+def cached_fingerprint(obj):
+
+    try:
+        return FINGERPRINTS[obj]
+    except KeyError:
+        pass
+    digest = hashlib.blake2b(digest_size=20)
+    if isinstance(obj,MarketData.MarketData):
+        update_hash(digest,(obj.fee_tier,obj.decimals_0,obj.decimals_1,str(obj.index.tz),obj.arrays()))
+    else:
+        update_hash(digest,obj)
+    FINGERPRINTS[obj] = digest.hexdigest()
+    return FINGERPRINTS[obj]
+
+@functools.lru_cache(maxsize=None)
+def source_fingerprint(module_name):
+
+    module = sys.modules.get(module_name)
+    if module is None or getattr(module,'__file__',None) is None:
+        return module_name
+    with open(module.__file__,'rb') as f:
+        return hashlib.blake2b(f.read(),digest_size=20).hexdigest()
+
+def update_hash(digest,obj,depth = 0):
+    """
+    Adds the content of obj to a hashlib digest: scalars, arrays, pandas objects, containers,
+    functions and plain objects through their attributes (e.g. a strategy's parameters and model).
+    """
+    if depth > 32:
+        raise ValueError('Unsupported object nesting for a cache key: {}'.format(type(obj).__name__))
+
+    if obj is None or isinstance(obj,(bool,int,float,complex,str,bytes,np.generic)):
+        digest.update(repr((type(obj).__name__,obj)).encode())
+    elif isinstance(obj,MarketData.MarketData):
+        digest.update(cached_fingerprint(obj).encode())
+    elif isinstance(obj,np.ndarray):
+        digest.update(repr((obj.dtype.str,obj.shape)).encode())
+        if obj.dtype == object:
+            for value in obj.ravel():
+                update_hash(digest,value,depth+1)
+        else:
+            digest.update(np.ascontiguousarray(obj).view(np.uint8).data)
+    elif isinstance(obj,(pd.DataFrame,pd.Series,pd.Index)):
+        if isinstance(obj,pd.DataFrame):
+            header = (type(obj).__name__,list(obj.columns),[str(dtype) for dtype in obj.dtypes])
+        else:
+            header = (type(obj).__name__,obj.name,str(obj.dtype))
+        digest.update(repr(header).encode())
+        digest.update(pd.util.hash_pandas_object(obj,index=not isinstance(obj,pd.Index)).to_numpy().data)
+    elif isinstance(obj,dict):
+        digest.update(b'dict')
+        for key in sorted(obj,key=repr):
+            update_hash(digest,key,depth+1)
+            update_hash(digest,obj[key],depth+1)
+    elif isinstance(obj,(list,tuple)):
+        digest.update(type(obj).__name__.encode())
+        for value in obj:
+            update_hash(digest,value,depth+1)
+    elif isinstance(obj,functools.partial):
+        update_hash(digest,(obj.func,obj.args,obj.keywords),depth+1)
+    elif isinstance(obj,types.MethodType):
+        update_hash(digest,(obj.__func__,obj.__self__),depth+1)
+    elif isinstance(obj,(type,types.FunctionType,types.BuiltinFunctionType)):
+        digest.update('{}.{}'.format(obj.__module__,obj.__qualname__).encode())
+    elif getattr(type(obj),'hash_as_type',False):
+        # Objects that do not change results, e.g. a ForecastCache held by a strategy
+        digest.update('{}.{}'.format(type(obj).__module__,type(obj).__qualname__).encode())
+    elif hasattr(obj,'__dict__'):
+        # Attributes a class declares in runtime_attributes (fit state, caches) do not change its results
+        runtime = getattr(type(obj),'runtime_attributes',())
+        digest.update('{}.{}'.format(type(obj).__module__,type(obj).__qualname__).encode())
+        update_hash(digest,{name: value for name,value in vars(obj).items() if name not in runtime},depth+1)
+    else:
+        digest.update(pickle.dumps(obj))
@@ -0,0 +1,199 @@
+import copy
+import pickle
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import ActiveStrategyFramework
+import MarketData
+import PositionBook
+import SimulationResults
+
+########################################################
+# Checkpoints of a simulation, to extend it when new data arrives instead of simulating from the start.
+# A checkpoint holds the last StrategyObservation (liquidity ranges, left over tokens, uncollected fees,
+# strategy_info), the strategy's mutable state (the attributes its class lists in checkpoint_attributes,
+# e.g. the model state of AutoRegressiveStrategy), and what the simulation series needs to continue
+# seamlessly: initial token amounts, accumulated fees and rows written. The strategy itself (parameters,
+# model data) is not stored: it is passed again when resuming and the state is bound to it.
+# It is stored as a zlib compressed pickle behind a format header.
+#
+# simulate_incremental runs from the start, or from the step after a checkpoint, and returns the new
+# rows of the simulation series together with the checkpoint at its last step.
+########################################################
+
+CHECKPOINT_HEADER = b'ASF-CHECKPOINT-2\n'
+
+# StrategyObservation attributes that are not stored: the fee model works on a given MarketData,
+# and pending fees are settled before storing
+OBSERVATION_TRANSIENT = ('fee_model','pending_fees')
+
+class SimulationCheckpoint:
+    def __init__(self,observation,strategy_in,token_0_initial,token_1_initial,cum_fees = (0.0,0.0),rows = 0):
+
+        self.time            = observation.time
+        self.observation     = observation_state(observation)
+        self.strategy_state  = strategy_state(strategy_in)
+        self.token_0_initial = token_0_initial
+        self.token_1_initial = token_1_initial
+        self.cum_fees        = tuple(cum_fees)
+        self.rows            = rows
+
+    def restore_observation(self,fee_model = None):
+        """
+        StrategyObservation at the checkpoint, to be passed as previous to ActiveStrategyFramework.next_observation.
+        """
+        observation = ActiveStrategyFramework.StrategyObservation.__new__(ActiveStrategyFramework.StrategyObservation)
+        observation.__dict__.update(self.observation)
+        observation.liquidity_ranges = copy_ranges(self.observation['liquidity_ranges'])
+        observation.strategy_info    = dict(self.observation['strategy_info']) if self.observation['strategy_info'] is not None else None
+        observation.pending_fees     = None
+        observation.fee_model        = fee_model
+        return observation
+
+    def restore_strategy(self,strategy_in):
+        """
+        Binds the strategy state at the checkpoint to strategy_in.
+        """
+        for name,value in self.strategy_state.items():
+            setattr(strategy_in,name,copy.deepcopy(value))
+        return strategy_in
+
+    ########################################################
+    # Binary format
+    ########################################################
+    def to_bytes(self):
+
+        return CHECKPOINT_HEADER + zlib.compress(pickle.dumps(self,protocol=pickle.HIGHEST_PROTOCOL))
+
+    @classmethod
+    def from_bytes(cls,data):
+
+        if not data.startswith(CHECKPOINT_HEADER):
+            raise ValueError('Unsupported checkpoint format')
+        return pickle.loads(zlib.decompress(data[len(CHECKPOINT_HEADER):]))
+
+    def save(self,file_name):
+
+        with open(file_name,'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls,file_name):
+
+        with open(file_name,'rb') as f:
+            return cls.from_bytes(f.read())
+
+
+def observation_state(observation):
+    """
+    Attributes of a StrategyObservation as plain values, with uncollected fees settled and shared state copied.
+    """
+    if observation.pending_fees is not None:
+        observation.settle_fees()
+    state                     = {name: value for name,value in vars(observation).items() if name not in OBSERVATION_TRANSIENT}
+    state['liquidity_ranges'] = copy_ranges(observation.liquidity_ranges)
+    state['strategy_info']    = dict(observation.strategy_info) if observation.strategy_info is not None else None
+    return state
+
+def strategy_state(strategy_in):
+    """
+    Copies of the attributes a strategy's class lists in checkpoint_attributes.
+    """
+    return {name: copy.deepcopy(getattr(strategy_in,name)) for name in getattr(type(strategy_in),'checkpoint_attributes',())}
+
+def copy_ranges(liquidity_ranges):
+
+    if isinstance(liquidity_ranges,PositionBook.PositionBook):
+        return liquidity_ranges.copy()
+    return [dict(x) for x in liquidity_ranges]
+
+def simulate_incremental(price_data,swap_data,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                         checkpoint=None,token_0_usd_data=None,market_data=None,fee_model=None,columnar=False,skip_steps=False):
+    """
+    Simulates from the first step, or from the step after checkpoint (whose time has to be in the market data,
+    which can start there). Returns the rows of the simulation series for those steps, which continue the
+    series of the previous runs, and the checkpoint at the last step.
+    When resuming, strategy_in is the strategy of the previous runs, possibly with updated model data, and the
+    checkpoint's strategy state is bound to it; liquidity_in_0 and liquidity_in_1 are not used.
+    columnar and skip_steps are those of simulate_strategy. With skip_steps the last step is always evaluated,
+    so that the checkpoint holds its observation.
+    """
+    if market_data is None:
+        market_data = MarketData.MarketData(price_data,swap_data,fee_tier,decimals_0,decimals_1)
+
+    if skip_steps and not columnar:
+        raise ValueError('skip_steps requires columnar=True')
+
+    if checkpoint is None:
+        start    = 0
+        previous = None
+        cum_fees = (0.0,0.0)
+        rows     = 0
+    else:
+        if strategy_in is None:
+            raise ValueError('Resuming from a checkpoint requires strategy_in')
+        start    = int(np.searchsorted(market_data.time,MarketData.epoch_ns([checkpoint.time])[0],side='left'))
+        if start >= len(market_data) or market_data.time[start] != MarketData.epoch_ns([checkpoint.time])[0]:
+            raise ValueError('Checkpoint time {} is not in the market data'.format(checkpoint.time))
+        start   += 1
+        previous = checkpoint.restore_observation(fee_model)
+        checkpoint.restore_strategy(strategy_in)
+        cum_fees = checkpoint.cum_fees
+        rows     = checkpoint.rows
+
+    if start >= len(market_data):
+        return pd.DataFrame(),checkpoint
+
+    if columnar:
+        strategy_results,previous = simulate_columnar(market_data,start,previous,strategy_in,liquidity_in_0,liquidity_in_1,
+                                                      fee_tier,decimals_0,decimals_1,fee_model,skip_steps)
+        data_strategy = strategy_results.to_frame(strategy_in,start)
+        if checkpoint is None:
+            token_0_initial,token_1_initial = strategy_results.initial_amounts()
+    else:
+        rows_data = []
+        for i in range(start,len(market_data)):
+            previous = ActiveStrategyFramework.next_observation(market_data,i,previous,strategy_in,liquidity_in_0,liquidity_in_1,
+                                                                fee_tier,decimals_0,decimals_1,fee_model)
+            if i == 0:
+                token_0_initial,token_1_initial = ActiveStrategyFramework.initial_amounts(previous)
+            rows_data.append(strategy_in.dict_components(previous))
+        data_strategy = pd.DataFrame(rows_data)
+
+    if checkpoint is not None:
+        token_0_initial,token_1_initial = checkpoint.token_0_initial,checkpoint.token_1_initial
+
+    if token_0_usd_data is not None:
+        token_0_usd_data = ActiveStrategyFramework.prepare_usd_data(token_0_usd_data)
+    data_return,cum_fees = ActiveStrategyFramework.add_simulation_values(data_strategy,token_0_initial,token_1_initial,token_0_usd_data,cum_fees)
+    if token_0_usd_data is not None:
+        data_return.index = pd.RangeIndex(rows,rows+len(data_return))
+
+    return data_return,SimulationCheckpoint(previous,strategy_in,token_0_initial,token_1_initial,cum_fees,rows+len(data_return))
+
+def simulate_columnar(market_data,start,previous,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,fee_model=None,skip_steps=False):
+    """
+    Steps start on of simulate_strategy(...,columnar=True,skip_steps=skip_steps), continuing from previous.
+    Returns the SimulationResults (filled from start on) and the observation at the last step.
+    """
+    strategy_results = None
+    i                = start
+
+    while i < len(market_data):
+        current = ActiveStrategyFramework.next_observation(market_data,i,previous,strategy_in,liquidity_in_0,liquidity_in_1,
+                                                           fee_tier,decimals_0,decimals_1,fee_model)
+        if strategy_results is None:
+            strategy_results = SimulationResults.SimulationResults(market_data,len(current.liquidity_ranges))
+        strategy_results.record(i,current)
+        previous = current
+
+        next_i   = ActiveStrategyFramework.next_evaluation_step(strategy_in,market_data,i,current) if skip_steps else i+1
+        # Quiet steps stop before the last step, which is evaluated for the checkpoint
+        next_i   = max(i+1,min(next_i,len(market_data)-1))
+        if next_i > i+1:
+            ActiveStrategyFramework.fill_quiet_steps(strategy_results,market_data,i+1,next_i,current)
+        i        = next_i
+
+    return strategy_results,previous
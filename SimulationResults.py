@@ -0,0 +1,301 @@
+import pandas as pd
+import numpy as np
+
+import PositionBook
+
+########################################################
+# Columnar store for simulation results.
+# simulate_strategy(...,columnar=True) writes every step into preallocated
+# arrays instead of keeping one StrategyObservation per step. Range records and
+# strategy_info only change at resets (or when a strategy writes into them), so
+# they are stored once per change and referenced by a segment index per step.
+########################################################
+
+# Range values that change every step and are stored as (steps x ranges) columns
+STEP_RANGE_KEYS = ('time','token_0','token_1')
+
+class SimulationResults:
+    def __init__(self,market_data,n_ranges):
+
+        n_steps                       = len(market_data)
+        self.market_data              = market_data
+        self.time                     = market_data.index
+        self.price                    = market_data.price
+        self.n_steps                  = 0
+
+        self.reset_point              = np.zeros(n_steps,dtype=bool)
+        self.reset_reason             = np.full(n_steps,'',dtype=object)
+        self.token_0_fees             = np.zeros(n_steps)
+        self.token_1_fees             = np.zeros(n_steps)
+        self.token_0_fees_uncollected = np.zeros(n_steps)
+        self.token_1_fees_uncollected = np.zeros(n_steps)
+        self.token_0_left_over        = np.zeros(n_steps)
+        self.token_1_left_over        = np.zeros(n_steps)
+        self.liquidity_in_0           = np.zeros(n_steps)
+        self.liquidity_in_1           = np.zeros(n_steps)
+        self.range_token_0            = np.zeros((n_steps,n_ranges))
+        self.range_token_1            = np.zeros((n_steps,n_ranges))
+
+        # Index into range_records / info_records for each step
+        self.range_segment            = np.zeros(n_steps,dtype=np.int64)
+        self.info_segment             = np.zeros(n_steps,dtype=np.int64)
+        self.range_records            = []
+        self.info_records             = []
+        self.n_ranges                 = np.zeros(0,dtype=np.int64)
+
+        self._last_ranges             = None
+        self._last_info               = None
+
+    def __len__(self):
+        return self.n_steps
+
+    ########################################################
+    # Store one StrategyObservation
+    # With fees=False fee columns are left to be filled later (two-pass simulation)
+    ########################################################
+    def record(self,i,observation,fees=True):
+
+        self.reset_point[i]              = observation.reset_point
+        self.reset_reason[i]             = observation.reset_reason
+        if fees:
+            self.token_0_fees[i]             = observation.token_0_fees
+            self.token_1_fees[i]             = observation.token_1_fees
+            self.token_0_fees_uncollected[i] = observation.token_0_fees_uncollected
+            self.token_1_fees_uncollected[i] = observation.token_1_fees_uncollected
+        self.token_0_left_over[i]        = observation.token_0_left_over
+        self.token_1_left_over[i]        = observation.token_1_left_over
+        self.liquidity_in_0[i]           = observation.liquidity_in_0
+        self.liquidity_in_1[i]           = observation.liquidity_in_1
+
+        liquidity_ranges = observation.liquidity_ranges
+        if len(liquidity_ranges) > self.range_token_0.shape[1]:
+            self.grow_ranges(len(liquidity_ranges))
+
+        if isinstance(liquidity_ranges,PositionBook.PositionBook):
+            self.range_token_0[i,:len(liquidity_ranges)] = liquidity_ranges.token_0
+            self.range_token_1[i,:len(liquidity_ranges)] = liquidity_ranges.token_1
+        else:
+            for j in range(len(liquidity_ranges)):
+                self.range_token_0[i,j]      = liquidity_ranges[j]['token_0']
+                self.range_token_1[i,j]      = liquidity_ranges[j]['token_1']
+
+        # New segment only when the range records or strategy_info changed
+        range_state = ranges_state(liquidity_ranges)
+        if self._last_ranges is None or not same_state(range_state,self._last_ranges):
+            if isinstance(liquidity_ranges,PositionBook.PositionBook):
+                self.range_records.append(liquidity_ranges.records(exclude=STEP_RANGE_KEYS))
+            else:
+                self.range_records.append([{key: x[key] for key in x if key not in STEP_RANGE_KEYS} for x in liquidity_ranges])
+            self.n_ranges      = np.append(self.n_ranges,len(liquidity_ranges))
+            self._last_ranges  = range_state
+        self.range_segment[i] = len(self.range_records) - 1
+
+        info_state = [state_key(observation.strategy_info)]
+        if self._last_info is None or not same_state(info_state,self._last_info):
+            self.info_records.append(dict(observation.strategy_info) if observation.strategy_info is not None else dict())
+            self._last_info    = info_state
+        self.info_segment[i]  = len(self.info_records) - 1
+
+        self.n_steps = max(self.n_steps,i+1)
+
+    ########################################################
+    # Store steps start to stop-1 in which the strategy was not evaluated.
+    # State is the one of observation, with the given fees and range amounts
+    ########################################################
+    def record_quiet(self,start,stop,observation,token_0_fees,token_1_fees,range_token_0,range_token_1):
+
+        n_ranges                                  = range_token_0.shape[1]
+        if n_ranges > self.range_token_0.shape[1]:
+            self.grow_ranges(n_ranges)
+
+        self.reset_point[start:stop]              = False
+        self.reset_reason[start:stop]             = ''
+        self.token_0_fees[start:stop]             = token_0_fees
+        self.token_1_fees[start:stop]             = token_1_fees
+        # Cumulated in order, as adding the fees step by step would
+        self.token_0_fees_uncollected[start:stop] = np.cumsum(np.r_[observation.token_0_fees_uncollected,token_0_fees])[1:]
+        self.token_1_fees_uncollected[start:stop] = np.cumsum(np.r_[observation.token_1_fees_uncollected,token_1_fees])[1:]
+        self.token_0_left_over[start:stop]        = observation.token_0_left_over
+        self.token_1_left_over[start:stop]        = observation.token_1_left_over
+        self.liquidity_in_0[start:stop]           = observation.liquidity_in_0
+        self.liquidity_in_1[start:stop]           = observation.liquidity_in_1
+        self.range_token_0[start:stop,:n_ranges]  = range_token_0
+        self.range_token_1[start:stop,:n_ranges]  = range_token_1
+        self.range_segment[start:stop]            = len(self.range_records) - 1
+        self.info_segment[start:stop]             = len(self.info_records) - 1
+
+        self.n_steps = max(self.n_steps,stop)
+
+    ########################################################
+    # Two-pass simulation: carry the state of the last recorded step
+    # to the steps that were not recorded, and store their range amounts
+    ########################################################
+    def fill_forward(self,recorded):
+
+        steps                         = np.arange(len(recorded))
+        last_recorded                 = np.maximum.accumulate(np.where(recorded,steps,0))
+        quiet                         = steps[~recorded]
+        source                        = last_recorded[quiet]
+        self.token_0_left_over[quiet] = self.token_0_left_over[source]
+        self.token_1_left_over[quiet] = self.token_1_left_over[source]
+        self.liquidity_in_0[quiet]    = self.liquidity_in_0[source]
+        self.liquidity_in_1[quiet]    = self.liquidity_in_1[source]
+        self.range_segment[quiet]     = self.range_segment[source]
+        self.info_segment[quiet]      = self.info_segment[source]
+
+        self.n_steps = max(self.n_steps,len(recorded))
+
+    def record_amounts(self,steps,range_token_0,range_token_1):
+
+        n_ranges                               = range_token_0.shape[1]
+        if n_ranges > self.range_token_0.shape[1]:
+            self.grow_ranges(n_ranges)
+        self.range_token_0[steps,:n_ranges]    = range_token_0
+        self.range_token_1[steps,:n_ranges]    = range_token_1
+
+    def grow_ranges(self,n_ranges):
+        extra              = n_ranges - self.range_token_0.shape[1]
+        self.range_token_0 = np.pad(self.range_token_0,((0,0),(0,extra)))
+        self.range_token_1 = np.pad(self.range_token_1,((0,0),(0,extra)))
+
+    ########################################################
+    # Column views, used to evaluate a strategy's dict_components
+    # on whole columns at once
+    ########################################################
+    def columns(self,rows=None):
+        return ObservationColumns(self,rows)
+
+    def to_frame(self,strategy_in,first_step = 0):
+        """
+        DataFrame with one row per step from first_step on and the columns of strategy_in.dict_components.
+        """
+        n_rows  = self.n_steps - first_step
+        columns = self.columns(slice(first_step,self.n_steps))
+        try:
+            data = strategy_in.dict_components(columns)
+        except (TypeError,ValueError):
+            # dict_components not expressible on arrays, build it row by row
+            return pd.DataFrame([strategy_in.dict_components(columns.row(i)) for i in range(first_step,self.n_steps)])
+        return pd.DataFrame({key: broadcast(value,n_rows) for key,value in data.items()})
+
+    def initial_amounts(self):
+        """
+        Tokens held at the first step (allocated to ranges plus left over).
+        """
+        n_ranges = self.n_ranges[self.range_segment[0]]
+        token_0  = self.range_token_0[0,:n_ranges].sum() + self.token_0_left_over[0]
+        token_1  = self.range_token_1[0,:n_ranges].sum() + self.token_1_left_over[0]
+        return token_0,token_1
+
+
+class ObservationColumns:
+    """
+    Stands in for a StrategyObservation, with arrays (one value per step) as attributes.
+    """
+    def __init__(self,results,rows=None):
+        n                             = results.n_steps
+        rows                          = slice(0,n) if rows is None else rows
+        self.results                  = results
+        self.rows                     = rows
+        self.time                     = results.time[:n][rows]
+        self.price                    = results.price[:n][rows]
+        self.reset_point              = results.reset_point[:n][rows]
+        self.reset_reason             = results.reset_reason[:n][rows]
+        self.token_0_fees             = results.token_0_fees[:n][rows]
+        self.token_1_fees             = results.token_1_fees[:n][rows]
+        self.token_0_fees_uncollected = results.token_0_fees_uncollected[:n][rows]
+        self.token_1_fees_uncollected = results.token_1_fees_uncollected[:n][rows]
+        self.token_0_left_over        = results.token_0_left_over[:n][rows]
+        self.token_1_left_over        = results.token_1_left_over[:n][rows]
+        self.liquidity_in_0           = results.liquidity_in_0[:n][rows]
+        self.liquidity_in_1           = results.liquidity_in_1[:n][rows]
+
+        range_segment                 = results.range_segment[:n][rows]
+        n_ranges                      = int(results.n_ranges[range_segment].max()) if np.ndim(range_segment) else int(results.n_ranges[range_segment])
+        self.liquidity_ranges         = [RangeColumns(results,j,rows) for j in range(n_ranges)]
+        self.strategy_info            = InfoColumns(results,rows)
+
+    def row(self,i):
+        return ObservationColumns(self.results,i)
+
+
+class RangeColumns:
+    def __init__(self,results,j,rows):
+        self.results = results
+        self.j       = j
+        self.rows    = rows
+
+    def __getitem__(self,key):
+        n = self.results.n_steps
+        if key == 'token_0':
+            return self.results.range_token_0[:n,self.j][self.rows]
+        elif key == 'token_1':
+            return self.results.range_token_1[:n,self.j][self.rows]
+        elif key == 'time':
+            return self.results.time[:n][self.rows]
+        values = segment_values([x[self.j] if self.j < len(x) else dict() for x in self.results.range_records],key)
+        return values[self.results.range_segment[:n][self.rows]]
+
+    def __contains__(self,key):
+        return key in STEP_RANGE_KEYS or any(key in x[self.j] for x in self.results.range_records if self.j < len(x))
+
+
+class InfoColumns:
+    def __init__(self,results,rows):
+        self.results = results
+        self.rows    = rows
+
+    def __getitem__(self,key):
+        n      = self.results.n_steps
+        values = segment_values(self.results.info_records,key)
+        return values[self.results.info_segment[:n][self.rows]]
+
+    def __contains__(self,key):
+        return any(key in x for x in self.results.info_records)
+
+
+def segment_values(records,key):
+    if not any(key in x for x in records):
+        raise KeyError(key)
+    values = [x.get(key,np.nan) for x in records]
+    try:
+        return np.asarray(values,dtype=float)
+    except (TypeError,ValueError,OverflowError):
+        values_array    = np.empty(len(values),dtype=object)
+        values_array[:] = values
+        return values_array
+
+
+def state_key(state):
+    # Identity of the shared record plus any values written on top of it
+    if state is None:
+        return (None,None)
+    local = getattr(state,'_local',None)
+    if local is None:
+        return (state,None)
+    extra = {key: value for key,value in local.items() if key not in STEP_RANGE_KEYS}
+    return (state._shared,extra)
+
+
+def ranges_state(liquidity_ranges):
+    # A PositionBook keeps one state for all its ranges, changed when a field other than the amounts is written
+    if isinstance(liquidity_ranges,PositionBook.PositionBook):
+        return [(liquidity_ranges.state,None)]
+    return [state_key(x) for x in liquidity_ranges]
+
+
+def same_state(state_a,state_b):
+    if len(state_a) != len(state_b):
+        return False
+    for a,b in zip(state_a,state_b):
+        if a[0] is not b[0]:
+            return False
+        if a[1] != b[1]:
+            return False
+    return True
+
+
+def broadcast(value,n_steps):
+    if np.ndim(value) == 0:
+        return np.full(n_steps,value)
+    return value
@@ -0,0 +1,141 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+import MarketData
+import ParameterSweep
+
+########################################################
+# Parallel strategy parameter optimization by successive halving.
+# A batch of candidates is drawn over the parameter bounds (Latin hypercube) and every candidate is
+# simulated on a short window at the start of the period, scored from its analyze_strategy summary.
+# The best 1/reduction of them move on to the next rung, whose window is reduction times longer,
+# until the survivors are simulated over the full period. Each rung is one ParameterSweep, so
+# candidates are evaluated in parallel over all workers, and most of the simulated time is spent
+# on the candidates that survive, unlike scipy.optimize.minimize which evaluates one at a time.
+########################################################
+
+# Parameter bounds of the strategies in this repository, to be adjusted to the pool at hand
+RESET_STRATEGY_BOUNDS          = {'alpha_param'            : (0.2,0.99),
+                                  'tau_param'              : (0.2,0.99),
+                                  'limit_parameter'        : (0.05,0.9)}
+
+AUTOREGRESSIVE_STRATEGY_BOUNDS = {'alpha_param'            : (0.5,5.0),
+                                  'tau_param'              : (0.01,1.0),
+                                  'volatility_reset_ratio' : (0.5,1.0)}
+
+# Nanoseconds in a day
+DAY_NS                         = 24*60*60*10**9
+
+def optimize_strategy(price_data,swap_data,strategy_factory,bounds,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                      objective='net_return',maximize=True,n_candidates=64,reduction=2,n_rungs=4,min_window_steps=None,
+                      initial_candidates=None,seed=None,token_0_usd_data=None,frequency='M',market_data=None,
+                      progress=None,cancel_event=None,**sweep_options):
+    """
+    Searches the parameters within bounds (a dict of name: (low,high)) that optimize objective, either a key of
+    the analyze_strategy summary or a function of the summary dict, for strategies built with strategy_factory(**parameters).
+    Windows are at least min_window_steps long, by default one day as analyze_strategy annualizes over days.
+    initial_candidates (list of dicts, e.g. a notebook's starting point) are added to the sampled ones.
+    Other keyword arguments go to ParameterSweep.run_sweep (e.g. max_workers, fee_model_factory).
+
+    Returns the best parameters of the last rung completed and the history of all evaluations, with their rung,
+    window length, summary and score. Parameter sets that fail or give no score are ranked last.
+    """
+    if market_data is None:
+        market_data = MarketData.MarketData(price_data,swap_data,fee_tier,decimals_0,decimals_1)
+    if min_window_steps is None:
+        min_window_steps = int(np.searchsorted(market_data.time,market_data.time[0] + DAY_NS,side='left')) + 1
+
+    candidates = sample_candidates(bounds,n_candidates,seed) + [dict(p) for p in (initial_candidates or [])]
+    schedule   = rung_schedule(len(candidates),len(market_data),reduction,n_rungs,min_window_steps)
+    total      = sum(n for n,steps in schedule)
+
+    history    = []
+    done       = 0
+    for rung,(n_keep,window_steps) in enumerate(schedule):
+        candidates    = candidates[:n_keep]
+        rung_progress = (lambda completed,_,offset=done: progress(offset + completed,total)) if progress is not None else None
+
+        results       = ParameterSweep.run_sweep(None,None,strategy_factory,candidates,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                                                 token_0_usd_data=token_0_usd_data,frequency=frequency,market_data=market_data.window(0,window_steps),
+                                                 progress=rung_progress,cancel_event=cancel_event,**sweep_options)
+        if len(results) == 0:
+            break
+        results['score']        = score_results(results,objective,maximize)
+        results['rung']         = rung
+        results['window_steps'] = window_steps
+        history.append(results)
+        done      += n_keep
+
+        # Survivors in order of score, best first, with all the parameters they were built with
+        ranked     = results.sort_values('score',ascending=False,na_position='last',kind='stable')
+        candidates = row_candidates(ranked,candidates)
+        if cancel_event is not None and cancel_event.is_set():
+            break
+
+    history = pd.concat(history,ignore_index=True) if len(history) > 0 else pd.DataFrame()
+    best    = candidates[0] if len(history) > 0 else None
+    return best,history
+
+def rung_schedule(n_candidates,n_steps,reduction=2,n_rungs=4,min_window_steps=60):
+    """
+    Number of candidates and window length (in steps) of every rung. The last rung covers all steps, each
+    earlier one is reduction times shorter (at least min_window_steps) and has reduction times more candidates.
+    """
+    schedule = []
+    for rung in range(n_rungs):
+        window_steps = min(n_steps,max(min_window_steps,math.ceil(n_steps / reduction**(n_rungs-1-rung))))
+        # Windows clamped to the same length would give the same scores, and a single
+        # survivor only needs the full period
+        if len(schedule) > 0 and (schedule[-1][1] == window_steps or (schedule[-1][0] == 1 and window_steps < n_steps)):
+            continue
+        n_keep       = max(1,math.ceil(schedule[-1][0] / reduction)) if len(schedule) > 0 else n_candidates
+        schedule.append((n_keep,window_steps))
+    return schedule
+
+def sample_candidates(bounds,n_candidates,seed=None):
+    """
+    Latin hypercube sample of n_candidates parameter dicts within bounds.
+    """
+    rng        = np.random.default_rng(seed)
+    names      = list(bounds)
+    strata     = np.stack([rng.permutation(n_candidates) for name in names],axis=1)
+    unit       = (strata + rng.random((n_candidates,len(names)))) / n_candidates
+    low        = np.array([bounds[name][0] for name in names],dtype=float)
+    high       = np.array([bounds[name][1] for name in names],dtype=float)
+    values     = low + unit*(high - low)
+    return [dict(zip(names,row.tolist())) for row in values]
+
+def row_candidates(rows,candidates):
+    """
+    Parameter dicts of the rows of a sweep table, in the order of the rows. Each is the candidate whose parameters
+    the row carries (and no others), so later rungs build strategies from the same keys and values as the first one.
+    """
+    names     = list(dict.fromkeys(name for candidate in candidates for name in candidate))
+    remaining = list(candidates)
+    matched   = []
+    for _,row in rows.iterrows():
+        for k,candidate in enumerate(remaining):
+            if all(same_value(row.get(name),candidate[name]) if name in candidate else is_missing(row.get(name)) for name in names):
+                matched.append(remaining.pop(k))
+                break
+    return matched
+
+def same_value(a,b):
+    # Sweep tables can turn integers into floats and None into NaN
+    return is_missing(b) if is_missing(a) else bool(a == b)
+
+def is_missing(value):
+    return value is None or (isinstance(value,float) and math.isnan(value))
+
+def score_results(results,objective,maximize=True):
+    """
+    Score of every row of a sweep table, higher is better. Failed parameter sets score NaN.
+    """
+    if callable(objective):
+        score = np.array([objective(row) if row.get('error') is None else np.nan for row in results.to_dict('records')],dtype=float)
+    else:
+        score = results[objective].to_numpy(dtype=float) if objective in results else np.full(len(results),np.nan)
+    score     = np.where(np.isfinite(score),score,np.nan)
+    return score if maximize else -score
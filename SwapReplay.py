@@ -0,0 +1,232 @@
+import numpy as np
+
+import TickMath
+
+########################################################
+# Swap replay fee model.
+# Re-executes every swap against the pool with the strategy's positions added to it, moving the price
+# through the initialized ticks as SwapMath/TickBitmap do: within each tick interval the swap pays
+# fee_tier on the amount traded, and the positions earn their share of the active liquidity.
+# Unlike the proportional estimate (ActiveStrategyFramework.compute_swap_fees), the positions'
+# liquidity slows the price down and fees are split per tick interval crossed, which matters
+# for large positions and price impact studies.
+#
+# Each swap moves the price from the tick of the previous swap to its own tick, the direction of the move
+# giving the token swapped in, and stops there or earlier if its amount runs out. Swaps only cross the
+# initialized ticks on that path, found with the bitmap, and the liquidity of all the tick intervals of
+# a span of swaps is looked up at once, so the cost is O(ticks crossed) with vectorized lookups.
+# Pool liquidity comes from a LiquidityBook (liquidity at every tick and time) when given, otherwise
+# the swap's virtual_liquidity is taken as constant across ticks. Math is done in floats on raw token
+# amounts and liquidity.
+#
+# Can be passed to simulate_strategy as fee_model.
+########################################################
+
+# Guard against swaps that would run through an unbounded number of empty ticks
+MAX_CROSSINGS = 10000
+
+class TickBitmap:
+    """
+    Initialized ticks as a bitmap of 64 bit words over tick/tick_spacing, as Uniswap v3's TickBitmap.
+    Next initialized tick searches use bit operations within a word and jump over empty words.
+    """
+    def __init__(self,ticks,tick_spacing = 1):
+
+        self.tick_spacing   = tick_spacing
+        self.offset         = TickMath.MIN_TICK // tick_spacing
+        compressed          = np.unique(np.asarray(ticks,dtype=np.int64) // tick_spacing) - self.offset
+        self.word_index     = np.unique(compressed >> 6)
+        self.words          = dict.fromkeys(self.word_index.tolist(),0)
+        for position in compressed.tolist():
+            self.words[position >> 6] |= 1 << (position & 63)
+
+    def next_initialized_tick(self,tick,lte):
+        """
+        Largest initialized tick <= tick (lte=True) or smallest initialized tick > tick (lte=False), None if there is none.
+        """
+        position = tick // self.tick_spacing - self.offset
+        if not lte:
+            position += 1
+        word,bit = position >> 6,position & 63
+
+        # Within the word of tick
+        bits     = self.words.get(word,0)
+        bits     = bits & ((1 << (bit + 1)) - 1) if lte else bits & ~((1 << bit) - 1)
+        if bits == 0:
+            # Closest non-empty word
+            k    = np.searchsorted(self.word_index,word,side='left') - 1 if lte else np.searchsorted(self.word_index,word,side='right')
+            if k < 0 or k >= len(self.word_index):
+                return None
+            word = int(self.word_index[k])
+            bits = self.words[word]
+
+        bit      = bits.bit_length() - 1 if lte else (bits & -bits).bit_length() - 1
+        return ((word << 6) + bit + self.offset) * self.tick_spacing
+
+
+class SwapReplay:
+    def __init__(self,market_data,liquidity_book = None):
+
+        self.market_data      = market_data
+        self.liquidity_book   = liquidity_book
+        self.fee_tier         = market_data.fee_tier
+        self.tick_swap        = market_data.tick_swap
+        self.swap_time        = market_data.swap_time
+
+        # Each swap starts where the previous one ended. Its direction is the observed move, the token
+        # labelled in by the swap data (the token that left the pool, see GetPoolData) only breaks ties.
+        self.tick_start       = np.r_[self.tick_swap[:1],self.tick_swap[:-1]]
+        self.zero_for_one     = (self.tick_swap < self.tick_start) | ((self.tick_swap == self.tick_start) & ~market_data.token_0_in)
+
+        # The price moves from the edge of the start tick it leaves to the edge of the end tick it reaches
+        self.start_edge       = np.where(self.zero_for_one,self.tick_start + 1,self.tick_start)
+        self.limit_edge       = np.where(self.zero_for_one,self.tick_swap,self.tick_swap + 1)
+
+        # Raw amount traded, in the labelled token, and whether it is the token swapped in
+        self.amount           = market_data.traded_in * np.where(market_data.token_0_in,10.0**market_data.decimals_0,10.0**market_data.decimals_1)
+        self.amount_is_in     = market_data.token_0_in == self.zero_for_one
+        self.decimals_in      = np.where(self.zero_for_one,market_data.decimals_0,market_data.decimals_1)
+
+        self.pool_bitmap      = None
+        if liquidity_book is not None:
+            tick_spacing      = market_data.tickSpacing if np.all(liquidity_book.ticks % market_data.tickSpacing == 0) else 1
+            self.pool_bitmap  = TickBitmap(liquidity_book.ticks,tick_spacing)
+
+    ########################################################
+    # Fee model interface, see FeeGrowthIndex
+    ########################################################
+    def range_fees(self,swap_start,swap_stop,lower_bin_tick,upper_bin_tick,position_liquidity):
+
+        swap_fees    = self.swap_fees(swap_start,swap_stop,lower_bin_tick,upper_bin_tick,position_liquidity)
+        zero_for_one = self.zero_for_one[swap_start:swap_stop]
+        return float(swap_fees[zero_for_one].sum()),float(swap_fees[~zero_for_one].sum())
+
+    def swap_fees(self,swap_start,swap_stop,lower_bin_tick,upper_bin_tick,position_liquidity):
+        """
+        Fees earned by a set of ranges in each of the swaps swap_start to swap_stop-1, in units of the token swapped in.
+        """
+        swaps          = np.arange(swap_start,swap_stop)
+        if len(swaps) == 0:
+            return np.zeros(0)
+
+        # liquidityNet of the positions, and their liquidity from each of their ticks up
+        lower_bin_tick     = np.asarray(lower_bin_tick,dtype=np.int64)
+        upper_bin_tick     = np.asarray(upper_bin_tick,dtype=np.int64)
+        position_liquidity = np.asarray(position_liquidity,dtype=float)
+        position_ticks,position_index = np.unique(np.r_[np.minimum(lower_bin_tick,upper_bin_tick),np.maximum(lower_bin_tick,upper_bin_tick)],return_inverse=True)
+        position_net       = np.zeros(len(position_ticks))
+        np.add.at(position_net,position_index,np.r_[position_liquidity,-position_liquidity])
+        position_cum       = np.cumsum(position_net)
+
+        ######################################
+        # 1. Tick intervals each swap moves through, in order
+        ######################################
+
+        interval_swap,interval_from,interval_to = self.swap_intervals(swaps,position_ticks)
+
+        ######################################
+        # 2. Liquidity within every interval, at the tick below it
+        ######################################
+
+        interval_tick  = np.minimum(interval_from,interval_to)
+        k              = np.searchsorted(position_ticks,interval_tick,side='right') - 1
+        position_liq   = np.maximum(np.where(k >= 0,np.r_[position_cum,0.0][k],0.0),0.0)
+        if self.liquidity_book is not None:
+            pool_liq   = np.maximum(self.liquidity_book.liquidity_at(interval_tick,self.swap_time[interval_swap]),0.0)
+        else:
+            pool_liq   = self.market_data.virtual_liquidity[interval_swap]
+        liquidity      = pool_liq + position_liq
+        share          = np.divide(position_liq,liquidity,out=np.zeros(len(liquidity)),where=liquidity > 0)
+
+        ######################################
+        # 3. Amounts to cross every interval (SwapMath), and where each swap runs out of its amount
+        ######################################
+
+        fee_tier       = self.fee_tier
+        zero_for_one   = self.zero_for_one[interval_swap]
+        amount_is_in   = self.amount_is_in[interval_swap]
+        sqrt_from      = 1.0001**(interval_from/2)
+        sqrt_to        = 1.0001**(interval_to/2)
+        amount_0       = liquidity*np.abs(1/sqrt_to - 1/sqrt_from)
+        amount_1       = liquidity*np.abs(sqrt_to - sqrt_from)
+        net_in         = np.where(zero_for_one,amount_0,amount_1)
+        needed         = np.where(amount_is_in,net_in/(1 - fee_tier),np.where(zero_for_one,amount_1,amount_0))
+
+        # Amount of the swap left when it enters each interval, summed within each swap that crosses ticks
+        before         = np.zeros(len(needed))
+        bounds         = np.r_[0,np.flatnonzero(np.diff(interval_swap)) + 1,len(needed)]
+        for k in np.flatnonzero(np.diff(bounds) > 1):
+            first,stop           = bounds[k],bounds[k+1]
+            before[first+1:stop] = np.cumsum(needed[first:stop-1])
+        remaining      = np.maximum(self.amount[interval_swap] - before,0.0)
+        partial        = remaining < needed
+
+        # Amount in (before fees) of the interval the swap ends in
+        with np.errstate(divide='ignore',invalid='ignore'):
+            partial_in = np.where(amount_is_in,remaining*(1 - fee_tier),
+                         np.where(zero_for_one,liquidity*(1/(sqrt_from - remaining/liquidity) - 1/sqrt_from),
+                                               liquidity*(1/(1/sqrt_from - remaining/liquidity) - sqrt_from)))
+        used_in        = np.where(partial,partial_in,net_in)
+        fees           = np.where(liquidity > 0,share*fee_tier/(1 - fee_tier)*used_in,0.0)
+
+        swap_fees      = np.bincount(interval_swap - swap_start,weights=fees,minlength=len(swaps))
+        return swap_fees / 10.0**self.decimals_in[swaps]
+
+    def swap_intervals(self,swaps,position_ticks):
+        """
+        Swap, start tick and end tick of the intervals between initialized ticks (of the pool or of the positions)
+        that swaps move through, in the order they move through them.
+        """
+        start_edge    = self.start_edge[swaps]
+        limit_edge    = self.limit_edge[swaps]
+        lowest        = np.minimum(start_edge,limit_edge)
+        highest       = np.maximum(start_edge,limit_edge)
+
+        # Swaps that cross no initialized tick move through one interval
+        crossings     = np.searchsorted(position_ticks,highest,side='left') - np.searchsorted(position_ticks,lowest,side='right')
+        if self.liquidity_book is not None:
+            pool_ticks = self.liquidity_book.ticks
+            crossings  = crossings + np.searchsorted(pool_ticks,highest,side='left') - np.searchsorted(pool_ticks,lowest,side='right')
+        single        = crossings <= 0
+
+        interval_swap = [swaps[single]]
+        interval_from = [start_edge[single]]
+        interval_to   = [limit_edge[single]]
+        for k in np.flatnonzero(~single):
+            edges = self.crossed_ticks(int(start_edge[k]),int(limit_edge[k]),bool(self.zero_for_one[swaps[k]]),position_ticks)
+            interval_swap.append(np.full(len(edges) - 1,swaps[k]))
+            interval_from.append(edges[:-1])
+            interval_to.append(edges[1:])
+
+        interval_swap = np.concatenate(interval_swap)
+        order         = np.argsort(interval_swap,kind='stable')
+        return interval_swap[order],np.concatenate(interval_from)[order],np.concatenate(interval_to)[order]
+
+    def crossed_ticks(self,start_edge,limit_edge,zero_for_one,position_ticks):
+
+        # Initialized ticks from start_edge to limit_edge, both included, found with the bitmap as the swap crosses them
+        edges = [start_edge]
+        tick  = start_edge - 1 if zero_for_one else start_edge
+        for crossing in range(MAX_CROSSINGS):
+            next_tick = self.next_tick(tick,zero_for_one,position_ticks)
+            if next_tick is None or (next_tick <= limit_edge if zero_for_one else next_tick >= limit_edge):
+                break
+            edges.append(next_tick)
+            tick = next_tick - 1 if zero_for_one else next_tick
+        edges.append(limit_edge)
+        return np.array(edges,dtype=np.int64)
+
+    def next_tick(self,tick,zero_for_one,position_ticks):
+
+        if zero_for_one:
+            k             = np.searchsorted(position_ticks,tick,side='right') - 1
+            position_next = int(position_ticks[k]) if k >= 0 else None
+        else:
+            k             = np.searchsorted(position_ticks,tick,side='right')
+            position_next = int(position_ticks[k]) if k < len(position_ticks) else None
+        pool_next         = self.pool_bitmap.next_initialized_tick(tick,zero_for_one) if self.pool_bitmap is not None else None
+
+        candidates        = [x for x in (position_next,pool_next) if x is not None]
+        if len(candidates) == 0:
+            return None
+        return max(candidates) if zero_for_one else min(candidates)
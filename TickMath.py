@@ -0,0 +1,173 @@
+import functools
+
+########################################################
+# Exact integer port of Uniswap v3's TickMath, SqrtPriceMath (amount deltas)
+# and LiquidityAmounts libraries, working on Q64.96 sqrt prices.
+# Python integers are unbounded, so mulDiv is an exact product followed by a floor division.
+# Used by UNI_v3_funcs when the tick math mode is set to 'exact'.
+########################################################
+
+MIN_TICK       = -887272
+MAX_TICK       = -MIN_TICK
+MIN_SQRT_RATIO = 4295128739
+MAX_SQRT_RATIO = 1461446703485210103287273052203988822378723970342
+Q96            = 1 << 96
+MAX_UINT256    = (1 << 256) - 1
+
+# Q128.128 values of 1/sqrt(1.0001)**(2**i), applied for every bit set in the absolute tick
+TICK_RATIOS    = ((0x2,     0xfff97272373d413259a46990580e213a),
+                  (0x4,     0xfff2e50f5f656932ef12357cf3c7fdcc),
+                  (0x8,     0xffe5caca7e10e4e61c3624eaa0941cd0),
+                  (0x10,    0xffcb9843d60f6159c9db58835c926644),
+                  (0x20,    0xff973b41fa98c081472e6896dfb254c0),
+                  (0x40,    0xff2ea16466c96a3843ec78b326b52861),
+                  (0x80,    0xfe5dee046a99a2a811c461f1969c3053),
+                  (0x100,   0xfcbe86c7900a88aedcffc83b479aa3a4),
+                  (0x200,   0xf987a7253ac413176f2b074cf7815e54),
+                  (0x400,   0xf3392b0822b70005940c7a398e4b70f3),
+                  (0x800,   0xe7159475a2c29b7443b29c7fa6e889d9),
+                  (0x1000,  0xd097f3bdfd2022b8845ad8f792aa5825),
+                  (0x2000,  0xa9f746462d870fdf8a65dc1f90e061e5),
+                  (0x4000,  0x70d869a156d2a1b890bb3df62baf32f7),
+                  (0x8000,  0x31be135f97d08fd981231505542fcfa6),
+                  (0x10000, 0x9aa508b5b7a84e1c677de54f3e99bc9),
+                  (0x20000, 0x5d6af8dedb81196699c329225ee604),
+                  (0x40000, 0x2216e584f5fa1ea926041bedfe98),
+                  (0x80000, 0x48a170391f7dc42444e8fa2))
+
+# Sqrt prices of recently used ticks, see UNI_v3_funcs.SQRT_PRICE_TABLE_SIZE
+SQRT_RATIO_CACHE_SIZE = 4096
+
+########################################################
+# TickMath
+########################################################
+
+@functools.lru_cache(maxsize=SQRT_RATIO_CACHE_SIZE)
+def get_sqrt_ratio_at_tick(tick):
+    """
+    sqrt(1.0001**tick) as a Q64.96 number, rounded up as TickMath.getSqrtRatioAtTick.
+    """
+    tick     = int(tick)
+    abs_tick = abs(tick)
+    if abs_tick > MAX_TICK:
+        raise ValueError('Tick out of range: {}'.format(tick))
+
+    ratio = 0xfffcb933bd6fad37aa2d162d1a594001 if abs_tick & 0x1 else 0x100000000000000000000000000000000
+    for bit,factor in TICK_RATIOS:
+        if abs_tick & bit:
+            ratio = (ratio * factor) >> 128
+
+    if tick > 0:
+        ratio = MAX_UINT256 // ratio
+
+    # Q128.128 to Q64.96, rounding up
+    return (ratio >> 32) + (0 if ratio % (1 << 32) == 0 else 1)
+
+def get_tick_at_sqrt_ratio(sqrt_price_x96):
+    """
+    Greatest tick whose sqrt ratio is at most sqrt_price_x96, as TickMath.getTickAtSqrtRatio.
+    """
+    if sqrt_price_x96 < MIN_SQRT_RATIO or sqrt_price_x96 >= MAX_SQRT_RATIO:
+        raise ValueError('Sqrt price out of range: {}'.format(sqrt_price_x96))
+
+    ratio = sqrt_price_x96 << 32
+    msb   = ratio.bit_length() - 1
+    r     = ratio >> (msb - 127) if msb >= 128 else ratio << (127 - msb)
+
+    # Integer and first 14 fractional bits of log2(ratio) as a Q64.64 number
+    log_2 = (msb - 128) << 64
+    for i in range(63,49,-1):
+        r      = (r * r) >> 127
+        f      = r >> 128
+        log_2 |= f << i
+        r    >>= f
+
+    # log_sqrt(1.0001)(ratio) as a Q128.128 number, with the error bounds of the approximation
+    log_sqrt10001 = log_2 * 255738958999603826347141
+    tick_low      = (log_sqrt10001 - 3402992956809132418596140100660247210) >> 128
+    tick_high     = (log_sqrt10001 + 291339464771989622907027621153398088495) >> 128
+
+    if tick_low == tick_high:
+        return tick_low
+    return tick_high if get_sqrt_ratio_at_tick(tick_high) <= sqrt_price_x96 else tick_low
+
+########################################################
+# SqrtPriceMath amount deltas
+########################################################
+
+def mul_div_rounding_up(a,b,denominator):
+    return -((-a * b) // denominator)
+
+def get_amount_0_delta(sqrt_ratio_a,sqrt_ratio_b,liquidity,round_up=False):
+    """
+    Token 0 amount between two sqrt prices for a liquidity, as SqrtPriceMath.getAmount0Delta.
+    """
+    if sqrt_ratio_a > sqrt_ratio_b:
+        (sqrt_ratio_a,sqrt_ratio_b) = (sqrt_ratio_b,sqrt_ratio_a)
+
+    numerator_1 = int(liquidity) << 96
+    numerator_2 = sqrt_ratio_b - sqrt_ratio_a
+
+    if round_up:
+        return -(-mul_div_rounding_up(numerator_1,numerator_2,sqrt_ratio_b) // sqrt_ratio_a)
+    return (numerator_1 * numerator_2 // sqrt_ratio_b) // sqrt_ratio_a
+
+def get_amount_1_delta(sqrt_ratio_a,sqrt_ratio_b,liquidity,round_up=False):
+    """
+    Token 1 amount between two sqrt prices for a liquidity, as SqrtPriceMath.getAmount1Delta.
+    """
+    if sqrt_ratio_a > sqrt_ratio_b:
+        (sqrt_ratio_a,sqrt_ratio_b) = (sqrt_ratio_b,sqrt_ratio_a)
+
+    if round_up:
+        return mul_div_rounding_up(int(liquidity),sqrt_ratio_b - sqrt_ratio_a,Q96)
+    return int(liquidity) * (sqrt_ratio_b - sqrt_ratio_a) // Q96
+
+########################################################
+# LiquidityAmounts
+########################################################
+
+def get_liquidity_for_amount_0(sqrt_ratio_a,sqrt_ratio_b,amount_0):
+
+    if sqrt_ratio_a > sqrt_ratio_b:
+        (sqrt_ratio_a,sqrt_ratio_b) = (sqrt_ratio_b,sqrt_ratio_a)
+
+    intermediate = sqrt_ratio_a * sqrt_ratio_b // Q96
+    return int(amount_0) * intermediate // (sqrt_ratio_b - sqrt_ratio_a)
+
+def get_liquidity_for_amount_1(sqrt_ratio_a,sqrt_ratio_b,amount_1):
+
+    if sqrt_ratio_a > sqrt_ratio_b:
+        (sqrt_ratio_a,sqrt_ratio_b) = (sqrt_ratio_b,sqrt_ratio_a)
+
+    return int(amount_1) * Q96 // (sqrt_ratio_b - sqrt_ratio_a)
+
+def get_liquidity_for_amounts(sqrt_ratio,sqrt_ratio_a,sqrt_ratio_b,amount_0,amount_1):
+    """
+    Maximum liquidity for the given raw token amounts, as LiquidityAmounts.getLiquidityForAmounts.
+    """
+    if sqrt_ratio_a > sqrt_ratio_b:
+        (sqrt_ratio_a,sqrt_ratio_b) = (sqrt_ratio_b,sqrt_ratio_a)
+
+    if sqrt_ratio <= sqrt_ratio_a:
+        return get_liquidity_for_amount_0(sqrt_ratio_a,sqrt_ratio_b,amount_0)
+    elif sqrt_ratio < sqrt_ratio_b:
+        liquidity_0 = get_liquidity_for_amount_0(sqrt_ratio,sqrt_ratio_b,amount_0)
+        liquidity_1 = get_liquidity_for_amount_1(sqrt_ratio_a,sqrt_ratio,amount_1)
+        return liquidity_0 if liquidity_0 < liquidity_1 else liquidity_1
+    else:
+        return get_liquidity_for_amount_1(sqrt_ratio_a,sqrt_ratio_b,amount_1)
+
+def get_amounts_for_liquidity(sqrt_ratio,sqrt_ratio_a,sqrt_ratio_b,liquidity):
+    """
+    Raw token amounts held by a liquidity at sqrt_ratio, as LiquidityAmounts.getAmountsForLiquidity.
+    """
+    if sqrt_ratio_a > sqrt_ratio_b:
+        (sqrt_ratio_a,sqrt_ratio_b) = (sqrt_ratio_b,sqrt_ratio_a)
+
+    if sqrt_ratio <= sqrt_ratio_a:
+        return get_amount_0_delta(sqrt_ratio_a,sqrt_ratio_b,liquidity),0
+    elif sqrt_ratio < sqrt_ratio_b:
+        return get_amount_0_delta(sqrt_ratio,sqrt_ratio_b,liquidity),get_amount_1_delta(sqrt_ratio_a,sqrt_ratio,liquidity)
+    else:
+        return 0,get_amount_1_delta(sqrt_ratio_a,sqrt_ratio_b,liquidity)
@@ -5,6 +5,9 @@ Created on Mon Jun 14 18:53:09 2021
 @author: JNP
 """
 
+import numpy as np
+import functools
+import TickMath
 
 
 '''liquitidymath'''
@@ -14,6 +17,44 @@ Created on Mon Jun 14 18:53:09 2021
 #liquidity: int
 #sqrtA = price for lower tick
 #sqrtB = price for upper tick
+
+'''cached sqrt prices'''
+#Ticks repeat a lot in simulations, in particular range bounds (multiples of the tick spacing in a narrow band).
+#sqrtP values are memoized in bounded tables, one per tick spacing, which evict the least recently used ticks.
+#Passing the pool's tick_spacing keeps range bounds in their own table, apart from the current ticks
+SQRT_PRICE_TABLE_SIZE = 4096
+sqrt_price_tables     = {}
+
+def compute_sqrt_price_x96(tick):
+    
+    return int(1.0001**(tick/2)*(2**96))
+
+def sqrt_price_table(tick_spacing=1):
+    
+    table = sqrt_price_tables.get(tick_spacing)
+    if table is None:
+        table = functools.lru_cache(maxsize=SQRT_PRICE_TABLE_SIZE)(compute_sqrt_price_x96)
+        sqrt_price_tables[tick_spacing] = table
+    return table
+
+def get_sqrt_price_x96(tick,tick_spacing=1):
+    
+    return sqrt_price_table(tick_spacing)(tick)
+
+get_sqrt_price_x96_current = sqrt_price_table(1)
+
+'''tick math mode'''
+#'float' uses the 1.0001**(tick/2) approximation, 'exact' the integer port of the Uniswap v3 libraries
+#in TickMath.py (getSqrtRatioAtTick, getAmountsForLiquidity, getLiquidityForAmounts), matching chain state
+TICK_MATH = 'float'
+
+def set_tick_math(mode):
+    
+    global TICK_MATH
+    if mode not in ('float','exact'):
+        raise ValueError('Unsupported tick math mode: ' + str(mode))
+    TICK_MATH = mode
+
 '''get_amounts function'''
 #Use 'get_amounts' function to calculate amounts as a function of liquitidy and price range
 def get_amount0(sqrtA,sqrtB,liquidity,decimals):
@@ -34,11 +75,15 @@ def get_amount1(sqrtA,sqrtB,liquidity,decimals):
     
     return amount1
 
-def get_amounts(tick,tickA,tickB,liquidity,decimal0,decimal1):
+def get_amounts(tick,tickA,tickB,liquidity,decimal0,decimal1,tick_spacing=1):
+
+    if TICK_MATH == 'exact':
+        return get_amounts_exact(tick,tickA,tickB,liquidity,decimal0,decimal1)
 
-    sqrt  = int(1.0001**(tick/2)*(2**96))
-    sqrtA = int(1.0001**(tickA/2)*(2**96))
-    sqrtB = int(1.0001**(tickB/2)*(2**96))
+    get_sqrt_price_x96_bound = sqrt_price_table(tick_spacing)
+    sqrt  = get_sqrt_price_x96_current(tick)
+    sqrtA = get_sqrt_price_x96_bound(tickA)
+    sqrtB = get_sqrt_price_x96_bound(tickB)
 
     if (sqrtA > sqrtB):
         (sqrtA,sqrtB)=(sqrtB,sqrtA)
@@ -93,11 +138,15 @@ def get_liquidity1(sqrtA,sqrtB,amount1,decimals):
     liquidity = int(amount1/((sqrtB-sqrtA)/2**96/10**decimals))
     return liquidity
 
-def get_liquidity(tick,tickA,tickB,amount0,amount1,decimal0,decimal1):
+def get_liquidity(tick,tickA,tickB,amount0,amount1,decimal0,decimal1,tick_spacing=1):
     
-        sqrt  = int(1.0001**(tick/2)*(2**96))
-        sqrtA = int(1.0001**(tickA/2)*(2**96))
-        sqrtB = int(1.0001**(tickB/2)*(2**96))
+        if TICK_MATH == 'exact':
+            return get_liquidity_exact(tick,tickA,tickB,amount0,amount1,decimal0,decimal1)
+        
+        get_sqrt_price_x96_bound = sqrt_price_table(tick_spacing)
+        sqrt  = get_sqrt_price_x96_current(tick)
+        sqrtA = get_sqrt_price_x96_bound(tickA)
+        sqrtB = get_sqrt_price_x96_bound(tickB)
         
         if (sqrtA > sqrtB):
             (sqrtA,sqrtB)=(sqrtB,sqrtA)
@@ -117,7 +166,95 @@ def get_liquidity(tick,tickA,tickB,amount0,amount1,decimal0,decimal1):
             return liquidity1
 
 
-        
 
-        
-        
\ No newline at end of file
+'''exact versions'''
+#Integer Q64.96 math as done on chain, amounts in and out are decimal adjusted as above
+def get_amounts_exact(tick,tickA,tickB,liquidity,decimal0,decimal1):
+    
+    amount0,amount1 = TickMath.get_amounts_for_liquidity(TickMath.get_sqrt_ratio_at_tick(tick),
+                                                         TickMath.get_sqrt_ratio_at_tick(tickA),
+                                                         TickMath.get_sqrt_ratio_at_tick(tickB),
+                                                         int(liquidity))
+    return amount0/10**decimal0,amount1/10**decimal1
+
+def get_liquidity_exact(tick,tickA,tickB,amount0,amount1,decimal0,decimal1):
+    
+    return TickMath.get_liquidity_for_amounts(TickMath.get_sqrt_ratio_at_tick(tick),
+                                              TickMath.get_sqrt_ratio_at_tick(tickA),
+                                              TickMath.get_sqrt_ratio_at_tick(tickB),
+                                              int(amount0*10**decimal0),
+                                              int(amount1*10**decimal1))
+
+
+
+'''array versions'''
+#Same calculations on NumPy arrays, to price many positions (or one position at many ticks) in one call
+#Arguments are broadcast against each other. Liquidity is handled as float since it can exceed int64
+#2**96 as a float keeps the arrays in float64 (NumPy makes object arrays of Python integers beyond int64), with the same values
+Q96 = 2.0**96
+
+def liquidity_float_array(liquidity):
+    
+    # Python integers beyond int64 come in as object arrays, converted one by one as the scalar version does
+    liquidity = np.asarray(liquidity)
+    if liquidity.dtype == object:
+        return np.asarray([float(x) for x in liquidity.ravel()])
+    return liquidity.astype(float).ravel()
+
+def get_sqrt_price_x96_array(tick):
+    
+    return np.trunc(1.0001**(np.asarray(tick)/2)*(Q96))
+
+def get_amounts_array(tick,tickA,tickB,liquidity,decimal0,decimal1):
+    
+    if TICK_MATH == 'exact':
+        amount0,amount1 = np.frompyfunc(get_amounts_exact,6,2)(tick,tickA,tickB,liquidity,decimal0,decimal1)
+        return np.asarray(amount0,dtype=float),np.asarray(amount1,dtype=float)
+    
+    sqrt      = get_sqrt_price_x96_array(tick)
+    sqrtA     = get_sqrt_price_x96_array(tickA)
+    sqrtB     = get_sqrt_price_x96_array(tickB)
+    liquidity = np.asarray(liquidity,dtype=float)
+    
+    (sqrtA,sqrtB) = (np.minimum(sqrtA,sqrtB),np.maximum(sqrtA,sqrtB))
+    
+    # Below the range all liquidity is in token 0, above it all is in token 1
+    sqrt      = np.clip(sqrt,sqrtA,sqrtB)
+    
+    amount0   = ((liquidity*Q96*(sqrtB-sqrt)/sqrtB/sqrt)/10**decimal0)
+    amount1   = liquidity*(sqrt-sqrtA)/Q96/10**decimal1
+    return amount0,amount1
+
+def amounts_relation_array(tick,tickA,tickB,decimals0,decimals1):
+    
+    sqrt  = (1.0001**np.asarray(tick,dtype=float)/10**(decimals1-decimals0))**(1/2)
+    sqrtA = (1.0001**np.asarray(tickA,dtype=float)/10**(decimals1-decimals0))**(1/2)
+    sqrtB = (1.0001**np.asarray(tickB,dtype=float)/10**(decimals1-decimals0))**(1/2)
+    
+    with np.errstate(divide='ignore',invalid='ignore'):
+        relation = (sqrt-sqrtA)/((1/sqrt)-(1/sqrtB))
+    return relation
+
+def get_liquidity_array(tick,tickA,tickB,amount0,amount1,decimal0,decimal1):
+    
+    if TICK_MATH == 'exact':
+        return np.frompyfunc(get_liquidity_exact,7,1)(tick,tickA,tickB,amount0,amount1,decimal0,decimal1)
+    
+    sqrt      = get_sqrt_price_x96_array(tick)
+    sqrtA     = get_sqrt_price_x96_array(tickA)
+    sqrtB     = get_sqrt_price_x96_array(tickB)
+    amount0   = np.asarray(amount0,dtype=float)
+    amount1   = np.asarray(amount1,dtype=float)
+    
+    (sqrtA,sqrtB) = (np.minimum(sqrtA,sqrtB),np.maximum(sqrtA,sqrtB))
+    
+    below     = sqrt <= sqrtA
+    above     = sqrt >= sqrtB
+    sqrt      = np.clip(sqrt,sqrtA,sqrtB)
+    
+    # Branches that do not apply can divide by zero, their values are discarded
+    with np.errstate(divide='ignore',invalid='ignore'):
+        liquidity0 = np.trunc(amount0/((Q96*(sqrtB-sqrt)/sqrtB/sqrt)/10**decimal0))
+        liquidity1 = np.trunc(amount1/((sqrt-sqrtA)/Q96/10**decimal1))
+    
+    return np.where(below,liquidity0,np.where(above,liquidity1,np.minimum(liquidity0,liquidity1)))
@@ -0,0 +1,119 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+import MarketData
+import ParameterSweep
+
+########################################################
+# Walk-forward backtests over rolling train/test windows.
+# The history is split in test windows of test_length moving forward by step. For every window the
+# strategy is built from the model data of the train_length before it, strategy_factory(model_data_train,**parameters)
+# (e.g. the return ECDF of ResetStrategy), and simulated on the test window only. Windows and parameter
+# sets run in parallel through ParameterSweep's process pool, over views of one shared MarketData.
+#
+# Work on data shared by overlapping windows is done once: prepare_model runs over the whole model
+# history before it is sliced (e.g. AutoRegressiveStrategy's outlier cleaning, see clean_model_data),
+# and all parameter sets of a window share its market data view, model data slice and fee model.
+#
+# Strategies that only look at data up to each time point (AutoRegressiveStrategy) can be given the
+# model data up to the end of the test window with model_through_test=True.
+########################################################
+
+def walk_forward(price_data,swap_data,model_data,strategy_factory,train_length,test_length,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                 step=None,parameters=None,model_through_test=False,prepare_model=None,token_0_usd_data=None,frequency='M',market_data=None,
+                 fee_model_factory=None,simulation_options=None,max_workers=None,progress=None,cancel_event=None,mp_context=None,cache=None):
+    """
+    Simulates strategy_factory(model_data_train,**p) on every test window for every parameter set p in parameters
+    (as in ParameterSweep.run_sweep, default a single empty one). train_length, test_length and step (default test_length)
+    are pandas Timedelta strings or objects. Returns one row per window and parameter set with the window bounds,
+    the parameters, the analyze_strategy summary, the run time and the error raised, if any.
+    The other arguments are those of ParameterSweep.run_sweep, with fee models built per window.
+    """
+    if market_data is None:
+        market_data = MarketData.MarketData(price_data,swap_data,fee_tier,decimals_0,decimals_1)
+    if simulation_options is None:
+        simulation_options = ParameterSweep.DEFAULT_SIMULATION_OPTIONS
+    if prepare_model is not None:
+        model_data = prepare_model(model_data)
+
+    windows        = walk_forward_windows(market_data,model_data.index,train_length,test_length,step)
+    parameter_sets = ParameterSweep.parameter_grid(parameters) if parameters is not None else [dict()]
+
+    # All parameter sets of a window go to the same worker
+    tasks          = [[(window,p) for p in parameter_sets] for window in windows.to_dict('records')]
+    worker_setup   = {'strategy_factory'   : strategy_factory,
+                      'fee_model_factory'  : None,
+                      'window_fee_model'   : fee_model_factory,
+                      'simulation_options' : simulation_options,
+                      'liquidity_in_0'     : liquidity_in_0,
+                      'liquidity_in_1'     : liquidity_in_1,
+                      'frequency'          : frequency,
+                      'cache'              : cache,
+                      'model_data'         : model_data,
+                      'model_through_test' : model_through_test}
+
+    results = ParameterSweep.run_in_pool(run_window,tasks,market_data,token_0_usd_data,worker_setup,max_workers,progress,cancel_event,mp_context)
+    return pd.DataFrame([row for window in results for row in window])
+
+def walk_forward_windows(market_data,model_index,train_length,test_length,step=None):
+    """
+    Train and test bounds of every walk-forward window, with the first (start_step) and last (stop_step-1) steps of
+    market_data in its test window. Test windows cover [test_start,test_end], so consecutive windows share their boundary
+    step and every swap is simulated once. The first window starts once train_length of model data is available.
+    """
+    train_length = pd.Timedelta(train_length)
+    test_length  = pd.Timedelta(test_length)
+    step         = pd.Timedelta(step) if step is not None else test_length
+
+    index        = market_data.index
+    test_start   = max(index[0],model_index[0] + train_length) if len(model_index) > 0 else index[0] + train_length
+    windows      = []
+    while test_start + test_length <= index[-1]:
+        test_end   = test_start + test_length
+        start_step = int(np.searchsorted(market_data.time,MarketData.epoch_ns([test_start])[0],side='left'))
+        stop_step  = int(np.searchsorted(market_data.time,MarketData.epoch_ns([test_end])[0],  side='right'))
+        if stop_step - start_step > 1:
+            windows.append({'window'      : len(windows),
+                            'train_start' : test_start - train_length,
+                            'train_end'   : test_start,
+                            'test_start'  : test_start,
+                            'test_end'    : test_end,
+                            'start_step'  : start_step,
+                            'stop_step'   : stop_step})
+        test_start = test_start + step
+
+    return pd.DataFrame(windows,columns=['window','train_start','train_end','test_start','test_end','start_step','stop_step'])
+
+########################################################
+# Worker side, see ParameterSweep.init_worker
+########################################################
+
+def run_window(items):
+
+    state       = ParameterSweep.WORKER_STATE
+    window      = items[0][0]
+    market_data = state['market_data'].window(window['start_step'],window['stop_step'])
+    fee_model   = state['window_fee_model'](market_data) if state['window_fee_model'] is not None else None
+
+    # Model data of the train span, up to the test window (or through it)
+    model_data  = state['model_data']
+    model_end   = window['test_end'] if state['model_through_test'] else window['train_end']
+    in_window   = (model_data.index >= window['train_start']) & \
+                  ((model_data.index <= model_end) if state['model_through_test'] else (model_data.index < model_end))
+    model_train = model_data[in_window]
+
+    rows        = []
+    for window,parameters in items:
+        row   = {name: window[name] for name in ('window','train_start','train_end','test_start','test_end')}
+        row.update(parameters)
+        start = time.perf_counter()
+        try:
+            row.update(ParameterSweep.simulation_summary(state['strategy_factory'](model_train,**parameters),market_data,fee_model))
+            row['error'] = None
+        except Exception as e:
+            row['error'] = '{}: {}'.format(type(e).__name__,e)
+        row['run_time']  = time.perf_counter() - start
+        rows.append(row)
+    return rows